@@ -1,3 +1,18 @@
 from django.contrib import admin
+from .models import ClickRollup, HeavyHitterSketch, RollupWatermark
 
-# Register your models here.
+@admin.register(ClickRollup)
+class ClickRollupAdmin(admin.ModelAdmin):
+    list_display = ('url', 'granularity', 'bucket', 'dimension', 'value', 'clicks')
+    list_filter = ('granularity', 'dimension')
+    raw_id_fields = ('url',)
+
+@admin.register(HeavyHitterSketch)
+class HeavyHitterSketchAdmin(admin.ModelAdmin):
+    list_display = ('url', 'day', 'dimension')
+    list_filter = ('dimension',)
+    raw_id_fields = ('url',)
+
+@admin.register(RollupWatermark)
+class RollupWatermarkAdmin(admin.ModelAdmin):
+    list_display = ('name', 'last_id', 'updated_at')
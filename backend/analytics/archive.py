@@ -0,0 +1,188 @@
+"""
+Cold storage for old raw clicks.
+
+Clicks older than the retention period are first folded into the click
+rollups, so analytics keep their history, then exported one day at a time
+to gzip NDJSON files under CLICK_ARCHIVE_DIR/date=YYYY-MM-DD/ and deleted
+in small chunks so the click table is never locked for long. Archived
+partitions can be read back on demand with read_archived_clicks.
+"""
+import gzip
+import json
+import logging
+import os
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import ClickEvent, RollupWatermark
+from .rollups import CLICK_ROLLUP_WATERMARK, compact_click_rollups
+
+logger = logging.getLogger(__name__)
+
+# Rows deleted per statement
+ARCHIVE_DELETE_CHUNK_SIZE = 1000
+
+ARCHIVE_FIELDS = (
+    'id', 'url_id', 'timestamp', 'ip_address', 'user_agent', 'browser', 'device',
+    'os', 'country', 'city', 'referrer', 'session_id', 'weight'
+)
+
+PARTITION_PREFIX = 'date='
+
+
+def _day_bounds(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def partition_dir(day, archive_dir=None):
+    """Directory holding the archived clicks of one day."""
+    return os.path.join(archive_dir or settings.CLICK_ARCHIVE_DIR, f'{PARTITION_PREFIX}{day.isoformat()}')
+
+
+def _part_last_id(path):
+    """Highest click id in a part file, from its part-<first>-<last> name."""
+    return int(os.path.basename(path).split('.')[0].split('-')[2])
+
+
+def archived_last_id(day, archive_dir=None):
+    """Highest click id already exported for a day, or 0."""
+    directory = partition_dir(day, archive_dir)
+    if not os.path.isdir(directory):
+        return 0
+    return max(
+        (_part_last_id(name) for name in os.listdir(directory) if name.startswith('part-') and name.endswith('.ndjson.gz')),
+        default=0
+    )
+
+
+def export_partition(day, clicks, archive_dir=None):
+    """
+    Write a day's clicks to a new gzip NDJSON part file.
+
+    Returns the highest exported click id and the number of rows written.
+    """
+    directory = partition_dir(day, archive_dir)
+    os.makedirs(directory, exist_ok=True)
+    temp_path = os.path.join(directory, f'.part-{os.getpid()}.ndjson.gz.tmp')
+
+    first_id = last_id = None
+    count = 0
+    with gzip.open(temp_path, 'wt', encoding='utf-8') as archive:
+        for click in clicks.order_by('id').attribute_values(*ARCHIVE_FIELDS).iterator(chunk_size=5000):
+            archive.write(json.dumps(click, cls=DjangoJSONEncoder) + '\n')
+            first_id = click['id'] if first_id is None else first_id
+            last_id = click['id']
+            count += 1
+
+    if count == 0:
+        os.remove(temp_path)
+        return None, 0
+
+    # Only a complete file becomes visible to readers
+    os.replace(temp_path, os.path.join(directory, f'part-{first_id}-{last_id}.ndjson.gz'))
+    return last_id, count
+
+
+def delete_in_chunks(clicks, chunk_size=ARCHIVE_DELETE_CHUNK_SIZE):
+    """Delete clicks a chunk at a time so no single statement holds locks for long."""
+    deleted = 0
+    while True:
+        ids = list(clicks.order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return deleted
+        deleted += ClickEvent.objects.filter(id__in=ids).delete()[0]
+
+
+def archive_clicks(retention_days=None, chunk_size=ARCHIVE_DELETE_CHUNK_SIZE, archive_dir=None):
+    """
+    Roll up, export and delete raw clicks older than the retention period.
+
+    Only clicks already folded into the rollups are archived. Returns the
+    number of days archived and clicks exported.
+    """
+    retention_days = retention_days or settings.CLICK_RETENTION_DAYS
+    cutoff, _ = _day_bounds(timezone.localdate() - timedelta(days=retention_days))
+
+    compact_click_rollups()
+    watermark = RollupWatermark.current(CLICK_ROLLUP_WATERMARK)
+    archivable = ClickEvent.objects.filter(timestamp__lt=cutoff, id__lte=watermark)
+
+    days = archivable.annotate(day=TruncDate('timestamp')).values_list('day', flat=True).distinct().order_by('day')
+    archived_days = 0
+    exported = 0
+    for day in list(days):
+        start, end = _day_bounds(day)
+        day_clicks = archivable.filter(timestamp__gte=start, timestamp__lt=end)
+
+        # A run interrupted between export and delete leaves exported rows behind;
+        # every row of the day up to the highest archived id is in a part file already
+        already_archived = archived_last_id(day, archive_dir)
+        if already_archived:
+            delete_in_chunks(day_clicks.filter(id__lte=already_archived), chunk_size)
+
+        last_id, count = export_partition(day, day_clicks.filter(id__gt=already_archived), archive_dir)
+        if not count:
+            continue
+
+        # Never delete rows that weren't in the exported file
+        delete_in_chunks(day_clicks.filter(id__lte=last_id), chunk_size)
+        archived_days += 1
+        exported += count
+        logger.info(f"Archived {count} clicks from {day}")
+
+    return archived_days, exported
+
+
+def archived_partitions(archive_dir=None):
+    """List the archived days and their part files, oldest first."""
+    archive_dir = archive_dir or settings.CLICK_ARCHIVE_DIR
+    if not os.path.isdir(archive_dir):
+        return []
+
+    partitions = []
+    for name in sorted(os.listdir(archive_dir)):
+        day = parse_date(name[len(PARTITION_PREFIX):]) if name.startswith(PARTITION_PREFIX) else None
+        if day is None:
+            continue
+        directory = os.path.join(archive_dir, name)
+        files = sorted(
+            os.path.join(directory, filename) for filename in os.listdir(directory)
+            if filename.startswith('part-') and filename.endswith('.ndjson.gz')
+        )
+        partitions.append((day, files))
+    return partitions
+
+
+def read_archived_clicks(start=None, end=None, url_ids=None, archive_dir=None):
+    """
+    Yield archived clicks between two days (inclusive), optionally for some URLs only.
+
+    Only the partitions in the date range are opened. url_ids None reads
+    every URL's clicks; an empty collection reads none. Clicks come back as
+    dicts of ARCHIVE_FIELDS with the timestamp parsed. Each click is in
+    exactly one part file, as archive_clicks never exports a row twice.
+    """
+    if url_ids is not None:
+        url_ids = set(url_ids)
+        if not url_ids:
+            return
+    for day, files in archived_partitions(archive_dir):
+        if (start and day < start) or (end and day > end):
+            continue
+
+        for path in files:
+            with gzip.open(path, 'rt', encoding='utf-8') as archive:
+                for line in archive:
+                    click = json.loads(line)
+                    if url_ids is not None and click['url_id'] not in url_ids:
+                        continue
+                    click['timestamp'] = parse_datetime(click['timestamp'])
+                    # Archived before clicks were sampled
+                    click.setdefault('weight', 1)
+                    yield click
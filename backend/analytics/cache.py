@@ -0,0 +1,195 @@
+"""
+Shared result cache for the analytics endpoints.
+
+Results are computed once and shared by everyone allowed to see them,
+keyed by endpoint, scope (a URL, or a user's links for the dashboard),
+query string and time bucket. Each entry records the scope's ingestion
+watermark (the owner's cache version, bumped by every click) when it was
+computed:
+
+- Entries whose watermark has moved on are recomputed, but not more often
+  than every ANALYTICS_CACHE_MIN_AGE seconds, so a busy link costs a few
+  recomputes a minute instead of one per view.
+- Entries are refreshed early with probabilistic expiry (XFetch): the
+  closer a bucket is to its end, and the longer the result took to compute,
+  the likelier a request is to recompute it ahead of time.
+- Only one worker computes a key at a time. The others serve the previous
+  value, or wait briefly for the new one if there is none.
+
+Results computed at an older watermark or in an earlier bucket are marked
+outdated, so they are sent without the ETag of the current one.
+
+Watermarks are cache versions, so without a shared cache
+(settings.SHARED_CACHE) the views' scopes opt out and every request computes
+its result directly, without an ETag.
+
+Hits, stale hits, misses and compute time are counted per endpoint.
+"""
+import functools
+import hashlib
+import logging
+import math
+import random
+import time
+
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+from urlbriefr.conditional import mark_outdated
+
+logger = logging.getLogger(__name__)
+
+# Length of a time bucket; time-windowed figures lag by at most this many seconds
+ANALYTICS_RESULT_BUCKET = 300
+
+# Results are kept for this long after computing even if newer clicks arrived
+ANALYTICS_CACHE_MIN_AGE = 15
+
+# Expected upper bound on a computation; a lock outliving it is assumed dead
+ANALYTICS_CACHE_LOCK_TIMEOUT = 30
+
+# How long a request without a previous value waits for another worker's result
+ANALYTICS_CACHE_WAIT = 5
+ANALYTICS_CACHE_POLL_INTERVAL = 0.05
+
+# XFetch aggressiveness: above 1 favours earlier refreshes
+ANALYTICS_CACHE_BETA = 1.0
+
+ANALYTICS_CACHE_OUTCOMES = ('hits', 'stale_hits', 'misses')
+
+
+def _entry_key(name, scope_id, path, bucket):
+    path_hash = hashlib.md5(path.encode()).hexdigest()
+    return f"analytics_result_{name}_{scope_id}_{path_hash}_{bucket}"
+
+
+def _increment(key, amount=1):
+    if not cache.add(key, amount, None):
+        try:
+            cache.incr(key, amount)
+        except ValueError:
+            cache.set(key, amount, None)
+
+
+def record_analytics_cache_event(name, outcome, compute_seconds=None):
+    """Count a hit, stale hit or miss for a cached analytics endpoint, with its compute time."""
+    _increment(f"analytics_cache_{outcome}_{name}")
+    if compute_seconds is not None:
+        _increment(f"analytics_cache_compute_ms_{name}", int(compute_seconds * 1000))
+
+
+def get_analytics_cache_stats(names):
+    """Get hit, stale hit and miss counts, hit rate and mean compute time for cached endpoints."""
+    stats = {}
+    for name in names:
+        counts = {outcome: cache.get(f"analytics_cache_{outcome}_{name}", 0) for outcome in ANALYTICS_CACHE_OUTCOMES}
+        total = sum(counts.values())
+        compute_ms = cache.get(f"analytics_cache_compute_ms_{name}", 0)
+        stats[name] = {
+            **counts,
+            'hit_rate': round((counts['hits'] + counts['stale_hits']) / total * 100, 2) if total > 0 else 0,
+            'avg_compute_ms': round(compute_ms / counts['misses'], 1) if counts['misses'] else 0,
+        }
+    return stats
+
+
+def _is_fresh(entry, watermark, now):
+    if entry['watermark'] != watermark and now - entry['computed_at'] >= ANALYTICS_CACHE_MIN_AGE:
+        return False
+    # XFetch: -log(u) is exponentially distributed, so refreshes spread out ahead of the expiry
+    early = entry['compute_seconds'] * ANALYTICS_CACHE_BETA * -math.log(1.0 - random.random())
+    return now + early < entry['expires_at']
+
+
+def get_or_compute(name, scope_id, watermark, path, compute):
+    """
+    Get a cached analytics result, computing it if it is missing or stale.
+
+    compute() returns (data, cacheable); results that aren't cacheable (e.g.
+    errors) are returned without being stored. Returns (data, cacheable,
+    current), where current is False for a result computed at an older
+    watermark or in an earlier bucket.
+    """
+    now = time.time()
+    bucket = int(now // ANALYTICS_RESULT_BUCKET)
+    key = _entry_key(name, scope_id, path, bucket)
+
+    def served(entry):
+        current = entry['watermark'] == watermark and entry['expires_at'] == (bucket + 1) * ANALYTICS_RESULT_BUCKET
+        return entry['data'], True, current
+
+    entry = cache.get(key)
+    if entry is not None and _is_fresh(entry, watermark, now):
+        record_analytics_cache_event(name, 'hits')
+        return served(entry)
+
+    previous = entry or cache.get(_entry_key(name, scope_id, path, bucket - 1))
+    lock_key = f"{key}_lock"
+    locked = cache.add(lock_key, True, ANALYTICS_CACHE_LOCK_TIMEOUT)
+    if not locked:
+        # Another worker is computing this key
+        if previous is not None:
+            record_analytics_cache_event(name, 'stale_hits')
+            return served(previous)
+
+        deadline = time.monotonic() + ANALYTICS_CACHE_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(ANALYTICS_CACHE_POLL_INTERVAL)
+            entry = cache.get(key)
+            if entry is not None:
+                record_analytics_cache_event(name, 'hits')
+                return served(entry)
+        logger.warning(f"Timed out waiting for analytics result {key}, computing it again")
+
+    try:
+        started = time.monotonic()
+        data, cacheable = compute()
+        compute_seconds = time.monotonic() - started
+        record_analytics_cache_event(name, 'misses', compute_seconds)
+        if cacheable:
+            # Kept into the next bucket to serve while that bucket's value is computed
+            cache.set(key, {
+                'data': data,
+                'watermark': watermark,
+                'computed_at': now,
+                'compute_seconds': compute_seconds,
+                'expires_at': (bucket + 1) * ANALYTICS_RESULT_BUCKET,
+            }, ANALYTICS_RESULT_BUCKET * 2)
+        return data, cacheable, True
+    finally:
+        if locked:
+            cache.delete(lock_key)
+
+
+def cached_analytics(name, scope):
+    """
+    Serve a viewset method's response data from the shared analytics result cache.
+
+    scope(view, request, *args, **kwargs) returns (scope_id, watermark) for
+    requests that may see the cached result, or None to run the view
+    uncached (e.g. so it can return its own 403 or 404).
+    """
+    def decorator(view_method):
+        @functools.wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            cache_scope = scope(self, request, *args, **kwargs) if request.method == 'GET' else None
+            if cache_scope is None:
+                return view_method(self, request, *args, **kwargs)
+
+            response = None
+
+            def compute():
+                nonlocal response
+                response = view_method(self, request, *args, **kwargs)
+                return response.data, response.status_code == status.HTTP_200_OK
+
+            scope_id, watermark = cache_scope
+            data, cacheable, current = get_or_compute(name, scope_id, watermark, request.get_full_path(), compute)
+            if response is not None:
+                return response
+            if not current:
+                return mark_outdated(Response(data))
+            return Response(data)
+        return wrapper
+    return decorator
@@ -0,0 +1,107 @@
+"""
+Weekly cohort retention matrix.
+
+Sessions are grouped into cohorts by the week of their first visit. A
+session counts as retained in week k of its cohort when its last visit came
+at least k weeks after its first, so row c of the matrix is how many of
+cohort c's sessions were still returning 0, 1, 2, ... weeks later.
+
+The sessions are read as three integer columns (first and last visit in
+epoch seconds, visit count) in one query and the matrix is built with
+NumPy, without a Python object per session.
+"""
+from datetime import datetime, time, timedelta
+
+import numpy as np
+from django.db import connections
+from django.db.models import Func, IntegerField
+from django.utils import timezone
+
+SECONDS_PER_WEEK = 7 * 24 * 60 * 60
+
+DEFAULT_COHORT_WEEKS = 12
+MAX_COHORT_WEEKS = 52
+
+
+class Epoch(Func):
+    """Seconds since the Unix epoch of a datetime column, as an integer."""
+
+    output_field = IntegerField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template="CAST(ROUND((julianday(%(expressions)s) - 2440587.5) * 86400) AS INTEGER)", **extra_context)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template="EXTRACT(EPOCH FROM %(expressions)s)::bigint", **extra_context)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template="UNIX_TIMESTAMP(%(expressions)s)", **extra_context)
+
+
+def cohort_window_start(weeks, now=None):
+    """Start of the first cohort week (a Monday) in a window of `weeks` weeks ending this week."""
+    today = timezone.localdate(now or timezone.now())
+    this_week = today - timedelta(days=today.weekday())
+    return timezone.make_aware(datetime.combine(this_week - timedelta(weeks=weeks - 1), time.min))
+
+
+def _session_columns(sessions, start, end):
+    """First and last visit epoch seconds and visit counts of the sessions first seen between two times."""
+    queryset = sessions.filter(first_visit__gte=start, first_visit__lt=end).order_by().annotate(
+        first=Epoch('first_visit'), last=Epoch('last_visit')
+    ).values_list('first', 'last', 'visit_count')
+
+    # Fetch through the cursor to skip building a model row per session
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    columns = np.array(rows, dtype=np.int64).reshape(-1, 3)
+    return columns[:, 0], columns[:, 1], columns[:, 2]
+
+
+def cohort_matrix(sessions, weeks=DEFAULT_COHORT_WEEKS, now=None):
+    """
+    Build the weekly retention matrix for the sessions first seen in the last `weeks` weeks.
+
+    Cells for weeks that haven't happened yet are None.
+    """
+    now = now or timezone.now()
+    start = cohort_window_start(weeks, now)
+    first, last, visits = _session_columns(sessions, start, start + timedelta(weeks=weeks))
+
+    cohort = (first - int(start.timestamp())) // SECONDS_PER_WEEK
+    # Sessions can't be retained for more weeks than the window has
+    age = np.clip((last - first) // SECONDS_PER_WEEK, 0, weeks - 1)
+
+    # Sessions per (cohort, weeks retained), then retained[c, k] = sessions of cohort c retained k weeks or more
+    histogram = np.bincount(cohort * weeks + age, minlength=weeks * weeks).reshape(weeks, weeks)
+    retained = histogram[:, ::-1].cumsum(axis=1)[:, ::-1]
+    sizes = retained[:, 0]
+    cohort_visits = np.bincount(cohort, weights=visits, minlength=weeks)
+
+    # Cohort c has been observed for weeks 0 .. weeks - 1 - c
+    observed = np.arange(weeks)[None, :] <= (weeks - 1 - np.arange(weeks))[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rates = np.where(sizes[:, None] > 0, retained / sizes[:, None] * 100, 0.0)
+        observed_sizes = (sizes[:, None] * observed).sum(axis=0)
+        average_rates = np.where(observed_sizes > 0, (retained * observed).sum(axis=0) / observed_sizes * 100, 0.0)
+
+    cohorts = []
+    for c in range(weeks):
+        visible = int(observed[c].sum())
+        cohorts.append({
+            'week_start': (start + timedelta(weeks=c)).date(),
+            'sessions': int(sizes[c]),
+            'avg_visits': round(float(cohort_visits[c] / sizes[c]), 2) if sizes[c] else 0,
+            'retained': [int(count) for count in retained[c, :visible]] + [None] * (weeks - visible),
+            'retention_rates': [round(float(rate), 2) for rate in rates[c, :visible]] + [None] * (weeks - visible),
+        })
+
+    return {
+        'weeks': weeks,
+        'total_sessions': int(sizes.sum()),
+        'cohorts': cohorts,
+        # Per week since first visit, over the cohorts that have reached it
+        'average_retention_rates': [round(float(rate), 2) for rate in average_rates],
+    }
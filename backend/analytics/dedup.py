@@ -0,0 +1,44 @@
+"""
+Suppression of duplicate clicks.
+
+Link unfurlers, prefetchers and double clicks send bursts of identical
+requests. A click is a duplicate when a click on the same URL from the same
+IP address and user agent was seen in the current or the previous window of
+CLICK_DEDUP_WINDOW seconds. Seen clicks are kept as short fingerprints in
+the cache under keys for their time bucket, which expire two windows later,
+so memory stays bounded by the click rate.
+
+Duplicates skip every analytics write and are only counted in the URL's
+suppressed_clicks counter.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+
+from shortener.models import ShortenedURL
+
+
+def click_fingerprint(url_id, ip_address, user_agent):
+    """Short hash identifying identical clicks on a URL."""
+    return hashlib.blake2b(f"{url_id}|{ip_address}|{user_agent}".encode(), digest_size=8).hexdigest()
+
+
+def is_duplicate_click(url_id, ip_address, user_agent):
+    """Remember a click and check whether an identical one was seen within the dedup window."""
+    window = settings.CLICK_DEDUP_WINDOW
+    if window <= 0:
+        return False
+
+    fingerprint = click_fingerprint(url_id, ip_address, user_agent)
+    bucket = int(time.time() // window)
+    if not cache.add(f"click_seen_{bucket}_{fingerprint}", 1, window * 2):
+        return True
+    return cache.get(f"click_seen_{bucket - 1}_{fingerprint}") is not None
+
+
+def record_suppressed_click(url):
+    """Count a duplicate click in a single update."""
+    ShortenedURL.objects.filter(pk=url.pk).update(suppressed_clicks=F('suppressed_clicks') + 1)
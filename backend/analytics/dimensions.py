@@ -0,0 +1,148 @@
+"""
+Dictionary-encoded click attributes.
+
+Clicks point at rows of the UserAgent, Referrer and Location dimension
+tables instead of repeating their strings. At ingest, raw strings are
+mapped to dimension rows through a per-process LRU, so a repeat user agent
+costs neither a query nor a parse; a new one is parsed once and stored.
+
+Aggregations group clicks by the integer dimension ids and resolve the ids
+afterwards with one query per dimension table.
+"""
+import threading
+from collections import OrderedDict
+
+from django.db import IntegrityError, transaction
+from user_agents import parse
+
+from .models import CLICK_ATTRIBUTES, Location, Referrer, UserAgent
+
+# Dimension rows kept per process, per table
+DIMENSION_CACHE_SIZE = 10000
+
+# ClickEvent foreign key -> dimension model
+DIMENSION_MODELS = {
+    'agent_id': UserAgent,
+    'referral_id': Referrer,
+    'location_id': Location,
+}
+
+
+class LRUCache:
+    """A small thread-safe least recently used mapping."""
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_caches = {model: LRUCache(DIMENSION_CACHE_SIZE) for model in DIMENSION_MODELS.values()}
+
+
+def clear_dimension_caches():
+    """Forget the cached dimension rows, e.g. after the tables were rolled back."""
+    for cache in _caches.values():
+        cache.clear()
+
+
+def _get_or_create(model, key, lookup, build):
+    """Get a dimension row from the LRU or the database, creating it with build() if it's new."""
+    row = _caches[model].get(key)
+    if row is not None:
+        return row
+
+    row = model.objects.filter(**lookup).first()
+    if row is None:
+        try:
+            with transaction.atomic():
+                row = model.objects.create(**lookup, **build())
+        except IntegrityError:
+            # Another request created it first
+            row = model.objects.get(**lookup)
+    _caches[model].set(key, row)
+    return row
+
+
+def user_agent_dimension(user_agent):
+    """Get the UserAgent row for a user agent string, parsing it only if it's new."""
+    user_agent = user_agent or ''
+
+    def build():
+        parsed = parse(user_agent)
+        return {
+            'user_agent': user_agent,
+            'browser': parsed.browser.family or '',
+            'device': parsed.device.family or '',
+            'os': parsed.os.family or '',
+        }
+
+    return _get_or_create(UserAgent, user_agent, {'user_agent_hash': UserAgent.hash(user_agent)}, build)
+
+
+def referrer_dimension(referrer):
+    """Get the Referrer row for a referrer URL, or None when there isn't one."""
+    if not referrer:
+        return None
+    return _get_or_create(Referrer, referrer, {'url_hash': Referrer.hash(referrer)}, lambda: {'url': referrer})
+
+
+def location_dimension(country, city):
+    """Get the Location row for a country and city, or None when both are unknown."""
+    if not country and not city:
+        return None
+    lookup = {'country': country or '', 'city': city or ''}
+    return _get_or_create(Location, (lookup['country'], lookup['city']), lookup, dict)
+
+
+def attribute_foreign_key(attribute):
+    """The ClickEvent foreign key holding a CLICK_ATTRIBUTES attribute."""
+    return f"{CLICK_ATTRIBUTES[attribute].split('__')[0]}_id"
+
+
+def resolve_dimensions(foreign_key, ids, attributes):
+    """Map dimension ids to dicts of the given attributes, in one query."""
+    ids = {dimension_id for dimension_id in ids if dimension_id is not None}
+    if not ids:
+        return {}
+    fields = {attribute: CLICK_ATTRIBUTES[attribute].split('__')[1] for attribute in attributes}
+    rows = DIMENSION_MODELS[foreign_key].objects.filter(id__in=ids).values_list('id', *fields.values())
+    return {row[0]: dict(zip(fields, row[1:])) for row in rows}
+
+
+def grouped_attribute_rows(events, group_by, attributes, **aggregates):
+    """
+    Aggregate clicks grouped by some fields and the dimension ids holding some attributes.
+
+    Returns the grouped row dicts with the attribute values filled in
+    (None where the click has no dimension row).
+    """
+    foreign_keys = {}
+    for attribute in attributes:
+        foreign_keys.setdefault(attribute_foreign_key(attribute), []).append(attribute)
+
+    rows = list(events.values(*group_by, *foreign_keys).annotate(**aggregates).order_by())
+    for foreign_key, fk_attributes in foreign_keys.items():
+        resolved = resolve_dimensions(foreign_key, {row[foreign_key] for row in rows}, fk_attributes)
+        missing = dict.fromkeys(fk_attributes)
+        for row in rows:
+            row.update(resolved.get(row[foreign_key], missing))
+    return rows
@@ -0,0 +1,172 @@
+"""
+Raw click export as CSV or NDJSON.
+
+Rows are streamed from a server-side cursor (and from archived partitions
+for older dates), so memory use doesn't depend on the size of the export.
+Exports can be streamed straight to the client or written to a gzip file
+by an export job for later download.
+"""
+import csv
+import gzip
+import json
+import logging
+import os
+import uuid
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from shortener.models import ShortenedURL
+from .archive import read_archived_clicks
+from .models import ClickEvent, ClickExportJob
+
+logger = logging.getLogger(__name__)
+
+# Columns a client can ask for
+EXPORT_COLUMNS = (
+    'timestamp', 'short_code', 'url_id', 'ip_address', 'user_agent', 'browser',
+    'device', 'os', 'country', 'city', 'referrer', 'session_id', 'weight'
+)
+
+DEFAULT_EXPORT_COLUMNS = (
+    'timestamp', 'short_code', 'ip_address', 'browser', 'device', 'os', 'country', 'city', 'referrer'
+)
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+# Rows fetched per round trip from the server-side cursor
+EXPORT_CHUNK_SIZE = 2000
+
+
+def parse_export_options(params):
+    """
+    Validate export options from query params or a request body.
+
+    Returns a dict of file_format, columns, start and end (inclusive dates,
+    either may be None). Raises ValueError with a message for the client.
+    """
+    file_format = params.get('file_format') or 'csv'
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f"file_format must be one of: {', '.join(EXPORT_FORMATS)}")
+
+    columns = params.get('columns') or DEFAULT_EXPORT_COLUMNS
+    if isinstance(columns, str):
+        columns = [column.strip() for column in columns.split(',') if column.strip()]
+    unknown = [column for column in columns if column not in EXPORT_COLUMNS]
+    if unknown or not columns:
+        raise ValueError(f"columns must be chosen from: {', '.join(EXPORT_COLUMNS)}")
+
+    dates = {}
+    for name in ('start', 'end'):
+        value = params.get(name)
+        dates[name] = parse_date(value) if value else None
+        if value and dates[name] is None:
+            raise ValueError(f"{name} must be a date in YYYY-MM-DD format")
+    if dates['start'] and dates['end'] and dates['start'] > dates['end']:
+        raise ValueError("start must not be after end")
+
+    return {'file_format': file_format, 'columns': list(columns), **dates}
+
+
+def export_source(user, url=None):
+    """
+    Get the raw clicks, URL ids and short codes for a URL's export, or for
+    every link a user owns when no URL is given.
+    """
+    if url is not None:
+        return ClickEvent.objects.filter(url=url), [url.id], {url.id: url.short_code}
+
+    short_codes = dict(ShortenedURL.objects.filter(user=user).values_list('id', 'short_code'))
+    return ClickEvent.objects.filter(url__user=user), list(short_codes), short_codes
+
+
+def iter_export_clicks(clicks, url_ids, short_codes, columns, start=None, end=None):
+    """
+    Yield click dicts for an export: archived clicks first, then raw clicks by id.
+
+    clicks is the raw ClickEvent queryset to export, url_ids the URLs whose
+    archived clicks to include (none when empty) and short_codes maps URL
+    ids to short codes.
+    """
+    if start:
+        clicks = clicks.filter(timestamp__gte=timezone.make_aware(datetime.combine(start, time.min)))
+    if end:
+        clicks = clicks.filter(timestamp__lt=timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min)))
+
+    # A user without links has no archived clicks; an empty url_ids must never read everyone's
+    if url_ids:
+        for click in read_archived_clicks(start, end, url_ids):
+            click['short_code'] = short_codes.get(click['url_id'])
+            yield click
+
+    fields = {column for column in columns if column != 'short_code'} | {'url_id'}
+    for click in clicks.order_by('id').attribute_values(*fields).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        click['short_code'] = short_codes.get(click['url_id'])
+        yield click
+
+
+class _Echo:
+    """File-like object whose write returns the value, so csv.writer output can be streamed."""
+
+    def write(self, value):
+        return value
+
+
+def render_export(clicks, columns, file_format):
+    """Render click dicts as CSV or NDJSON lines, one string at a time."""
+    if file_format == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(columns)
+        for click in clicks:
+            yield writer.writerow([click.get(column) for column in columns])
+    else:
+        for click in clicks:
+            yield json.dumps({column: click.get(column) for column in columns}, cls=DjangoJSONEncoder) + '\n'
+
+
+def export_filename(label, file_format, compressed=False):
+    """Download filename for an export."""
+    date = timezone.localdate().isoformat()
+    return f"clicks-{label}-{date}.{file_format}{'.gz' if compressed else ''}"
+
+
+def run_export_job(job):
+    """Write an export job's clicks to a gzip file and record the outcome."""
+    job.status = 'running'
+    job.save(update_fields=['status'])
+
+    os.makedirs(settings.CLICK_EXPORT_DIR, exist_ok=True)
+    path = os.path.join(settings.CLICK_EXPORT_DIR, f"{job.id}-{uuid.uuid4().hex}.{job.file_format}.gz")
+    try:
+        clicks, url_ids, short_codes = export_source(job.user, job.url)
+        rows = iter_export_clicks(clicks, url_ids, short_codes, job.columns, job.start_date, job.end_date)
+
+        row_count = 0
+
+        def counted(rows):
+            nonlocal row_count
+            for row in rows:
+                row_count += 1
+                yield row
+
+        with gzip.open(path, 'wt', encoding='utf-8', newline='') as export_file:
+            for line in render_export(counted(rows), job.columns, job.file_format):
+                export_file.write(line)
+    except Exception as e:
+        logger.exception(f"Click export job {job.id} failed")
+        if os.path.exists(path):
+            os.remove(path)
+        ClickExportJob.objects.filter(pk=job.pk).update(
+            status='failed', error=str(e), completed_at=timezone.now()
+        )
+        return
+
+    ClickExportJob.objects.filter(pk=job.pk).update(
+        status='completed', file_path=path, row_count=row_count, completed_at=timezone.now()
+    )
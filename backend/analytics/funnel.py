@@ -0,0 +1,99 @@
+"""
+Batched funnel step tracking.
+
+A batch of (short_code, session_id, step) events is applied with one query
+to resolve the short codes, one to find the existing sessions, a bulk
+insert of the missing sessions and one UPDATE per step.
+"""
+from collections import defaultdict
+
+from django.db.models import Q
+
+from shortener.cache import bump_user_cache_version
+from shortener.models import ShortenedURL
+from .models import UserSession
+
+FUNNEL_STEPS = ('reached_destination', 'completed_action')
+
+# Events accepted in one request
+MAX_FUNNEL_BATCH = 500
+
+
+def parse_funnel_events(data):
+    """
+    Validate a batch of funnel events from a request body.
+
+    The body is a list of events or a dict with an `events` list; each event
+    has short_code, session_id and step. Returns a list of (short_code,
+    session_id, step) tuples. Raises ValueError with a message for the client.
+    """
+    events = data.get('events') if isinstance(data, dict) else data
+    if not isinstance(events, list) or not events:
+        raise ValueError("events must be a non-empty list")
+    if len(events) > MAX_FUNNEL_BATCH:
+        raise ValueError(f"At most {MAX_FUNNEL_BATCH} events can be sent at once")
+
+    parsed = []
+    for index, event in enumerate(events):
+        if not isinstance(event, dict):
+            raise ValueError(f"Event {index} must be an object")
+        short_code, session_id, step = event.get('short_code'), event.get('session_id'), event.get('step')
+        if not short_code or not session_id or not step:
+            raise ValueError(f"Event {index} is missing short_code, session_id or step")
+        if step not in FUNNEL_STEPS:
+            raise ValueError(f"Event {index} has an invalid step: {step}. Must be one of: {', '.join(FUNNEL_STEPS)}")
+        parsed.append((str(short_code), str(session_id), step))
+    return parsed
+
+
+def apply_funnel_events(events):
+    """
+    Set the funnel step flags for a batch of (short_code, session_id, step) events.
+
+    Sessions that don't exist yet are created. Returns the number of events
+    applied and the short codes that weren't found.
+    """
+    short_codes = {short_code for short_code, session_id, step in events}
+    urls = {
+        short_code: (url_id, user_id)
+        for short_code, url_id, user_id in ShortenedURL.objects.filter(
+            short_code__in=short_codes
+        ).values_list('short_code', 'id', 'user_id')
+    }
+
+    # url_id -> step -> session ids
+    steps = defaultdict(lambda: defaultdict(set))
+    applied = 0
+    for short_code, session_id, step in events:
+        if short_code in urls:
+            steps[urls[short_code][0]][step].add(session_id)
+            applied += 1
+    if not steps:
+        return 0, sorted(short_codes)
+
+    def sessions_of(targets):
+        return Q(*[Q(url_id=url_id, session_id__in=session_ids) for url_id, session_ids in targets], _connector=Q.OR)
+
+    sessions = {url_id: set().union(*by_step.values()) for url_id, by_step in steps.items()}
+    wanted = {(url_id, session_id) for url_id, session_ids in sessions.items() for session_id in session_ids}
+    existing = set(UserSession.objects.filter(sessions_of(sessions.items())).order_by().values_list('url_id', 'session_id'))
+
+    # New sessions get their flags on insert; a concurrent insert of the same session is left to the UPDATEs
+    UserSession.objects.bulk_create([
+        UserSession(
+            url_id=url_id, session_id=session_id,
+            **{step: session_id in steps[url_id][step] for step in FUNNEL_STEPS}
+        )
+        for url_id, session_id in wanted - existing
+    ], ignore_conflicts=True, batch_size=500)
+
+    for step in FUNNEL_STEPS:
+        targets = [(url_id, by_step[step]) for url_id, by_step in steps.items() if by_step[step]]
+        if targets:
+            UserSession.objects.filter(sessions_of(targets)).exclude(**{step: True}).update(**{step: True})
+
+    # Funnel figures are part of the owners' analytics responses
+    for user_id in {urls[short_code][1] for short_code in short_codes if short_code in urls}:
+        bump_user_cache_version(user_id)
+
+    return applied, sorted(short_codes - set(urls))
@@ -0,0 +1,101 @@
+"""
+Space-Saving heavy-hitter summaries for top-N panels.
+
+A summary monitors at most `capacity` values, each with a count and an
+error. A monitored value's true count lies between count - error and count,
+and any value that isn't monitored occurred at most `floor` times, where
+floor is the smallest count of a full summary (0 otherwise). Every value
+occurring more than total / capacity times is guaranteed to be monitored.
+
+Summaries merge: the merged bounds are the sums of each summary's bounds,
+so per-URL, per-day summaries can be combined over any range of days and
+any set of URLs while memory stays bounded by the capacity. Merged upper
+bounds include the floor of every summary that doesn't monitor a value, so
+top() reports the guaranteed lower bounds instead.
+"""
+from collections import Counter
+
+# Values monitored per summary
+HEAVY_HITTER_CAPACITY = 100
+
+
+class SpaceSaving:
+    """A Space-Saving summary of (value, parent_value) keys."""
+
+    def __init__(self, capacity=HEAVY_HITTER_CAPACITY, counters=None):
+        self.capacity = capacity
+        # key -> [count, error]
+        self.counters = counters if counters is not None else {}
+
+    @classmethod
+    def from_entries(cls, entries, capacity=HEAVY_HITTER_CAPACITY):
+        """Load a summary stored with to_entries."""
+        return cls(capacity, {(value, parent): [count, error] for value, parent, count, error in entries or ()})
+
+    def to_entries(self):
+        """Serialise the summary as JSON-friendly [value, parent, count, error] lists."""
+        return [[value, parent, count, error] for (value, parent), (count, error) in self.counters.items()]
+
+    @classmethod
+    def from_counts(cls, counts, capacity=HEAVY_HITTER_CAPACITY):
+        """Summarise exact counts, keeping the `capacity` most frequent keys."""
+        return cls(capacity, {key: [count, 0] for key, count in Counter(counts).most_common(capacity)})
+
+    def floor(self):
+        """Upper bound on the count of any value that isn't monitored."""
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(count for count, error in self.counters.values())
+
+    def add(self, key, weight=1):
+        """Count a key, replacing the least counted value once the summary is full."""
+        counter = self.counters.get(key)
+        if counter is not None:
+            counter[0] += weight
+        elif len(self.counters) < self.capacity:
+            self.counters[key] = [weight, 0]
+        else:
+            smallest = min(self.counters, key=lambda k: self.counters[k][0])
+            floor = self.counters.pop(smallest)[0]
+            self.counters[key] = [floor + weight, floor]
+
+    @classmethod
+    def merge_all(cls, summaries, capacity=HEAVY_HITTER_CAPACITY):
+        """
+        Merge summaries into one.
+
+        A value missing from a full summary may still have occurred up to that
+        summary's floor, so its merged count includes every such floor.
+        """
+        floor_total = 0
+        # Sum of count - floor over the summaries monitoring each key
+        excess = Counter()
+        lower = Counter()
+        for summary in summaries:
+            floor = summary.floor()
+            floor_total += floor
+            for key, (count, error) in summary.counters.items():
+                excess[key] += count - floor
+                lower[key] += count - error
+
+        merged = cls(capacity)
+        for key, count in excess.most_common(capacity):
+            count += floor_total
+            merged.counters[key] = [count, count - lower[key]]
+        return merged
+
+    def merge(self, other):
+        """Merge another summary into this one, keeping this summary's capacity."""
+        self.counters = SpaceSaving.merge_all([self, other], self.capacity).counters
+
+    def top(self, limit=None):
+        """
+        Most counted values first, as (value, parent_value, count) tuples.
+
+        Counts are the guaranteed lower bounds (count - error); values with
+        equal lower bounds are ranked by their upper bounds.
+        """
+        ranked = sorted(self.counters.items(), key=lambda item: (item[1][1] - item[1][0], -item[1][0], item[0]))
+        if limit is not None:
+            ranked = ranked[:limit]
+        return [(value, parent, count - error) for (value, parent), (count, error) in ranked]
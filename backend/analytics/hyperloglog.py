@@ -0,0 +1,96 @@
+"""
+HyperLogLog sketches for approximate distinct counts.
+
+A sketch keeps 2**PRECISION one-byte registers (4096 with the default
+precision of 12). Estimates have a relative standard error of about
+1.04 / sqrt(4096) = 1.6%: roughly 68% of estimates fall within 1.6% of the
+true count, 95% within 3.3% and 99.7% within 4.9%. Below about 10,000
+distinct values linear counting takes over, whose error is smaller still
+(a standard error of about 1 at 100 values and 2 at 200). Merging sketches
+(element-wise max of the registers) gives the same sketch as adding every
+value to one, so the bounds hold for merged ranges too.
+
+Sketches are stored zlib-compressed; sparse sketches compress to a few
+dozen bytes and a full one to at most ~4 KB.
+"""
+import hashlib
+import math
+import zlib
+
+import numpy as np
+
+PRECISION = 12
+REGISTER_COUNT = 1 << PRECISION
+
+# Relative standard error of an estimate
+STANDARD_ERROR = 1.04 / math.sqrt(REGISTER_COUNT)
+
+_VALUE_BITS = 64 - PRECISION
+_ALPHA = 0.7213 / (1 + 1.079 / REGISTER_COUNT)
+
+
+def register_position(value):
+    """Get the register index and rank a value would set."""
+    hashed = int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), 'big')
+    index = hashed >> _VALUE_BITS
+    remainder = hashed & ((1 << _VALUE_BITS) - 1)
+    rank = _VALUE_BITS - remainder.bit_length() + 1
+    return index, rank
+
+
+class HyperLogLog:
+    """A HyperLogLog sketch with 2**PRECISION registers."""
+
+    def __init__(self, registers=None):
+        self.registers = bytearray(registers) if registers is not None else bytearray(REGISTER_COUNT)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Load a sketch stored with to_bytes."""
+        if not data:
+            return cls()
+        return cls(zlib.decompress(bytes(data)))
+
+    def to_bytes(self):
+        """Serialise the sketch compactly for storage."""
+        return zlib.compress(bytes(self.registers))
+
+    def add(self, value):
+        """Add a value; returns True if the sketch changed."""
+        index, rank = register_position(value)
+        return self.set_register(index, rank)
+
+    def set_register(self, index, rank):
+        """Raise a register to the given rank; returns True if the sketch changed."""
+        if self.registers[index] >= rank:
+            return False
+        self.registers[index] = rank
+        return True
+
+    def merge(self, other):
+        """Merge another sketch into this one."""
+        merged = np.maximum(
+            np.frombuffer(self.registers, dtype=np.uint8),
+            np.frombuffer(other.registers, dtype=np.uint8)
+        )
+        self.registers = bytearray(merged.tobytes())
+        return self
+
+    @classmethod
+    def merge_all(cls, sketches):
+        """Merge many stored sketches (bytes) into one."""
+        merged = np.zeros(REGISTER_COUNT, dtype=np.uint8)
+        for data in sketches:
+            if data:
+                np.maximum(merged, np.frombuffer(zlib.decompress(bytes(data)), dtype=np.uint8), out=merged)
+        return cls(merged.tobytes())
+
+    def count(self):
+        """Estimate the number of distinct values added."""
+        registers = np.frombuffer(self.registers, dtype=np.uint8)
+        estimate = _ALPHA * REGISTER_COUNT ** 2 / float(np.sum(np.exp2(-registers.astype(np.float64))))
+        zeros = int(np.count_nonzero(registers == 0))
+        if estimate <= 2.5 * REGISTER_COUNT and zeros:
+            # Small range correction: linear counting
+            estimate = REGISTER_COUNT * math.log(REGISTER_COUNT / zeros)
+        return int(round(estimate))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from analytics.cache import get_analytics_cache_stats
+from analytics.views import CACHED_ANALYTICS_ENDPOINTS
+
+class Command(BaseCommand):
+    help = 'Show hit rates and compute times for the analytics result cache'
+
+    def handle(self, *args, **options):
+        stats = get_analytics_cache_stats(CACHED_ANALYTICS_ENDPOINTS)
+        
+        for name, counts in stats.items():
+            self.stdout.write(
+                f"{name}: {counts['hits']} hits, {counts['stale_hits']} stale hits, {counts['misses']} misses "
+                f"({counts['hit_rate']}% hit rate, {counts['avg_compute_ms']} ms average compute)"
+            )
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from analytics.archive import ARCHIVE_DELETE_CHUNK_SIZE, archive_clicks
+
+class Command(BaseCommand):
+    help = 'Roll up, export to cold storage and delete raw clicks older than the retention period'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.CLICK_RETENTION_DAYS,
+                            help='Keep raw clicks for this many days')
+        parser.add_argument('--chunk-size', type=int, default=ARCHIVE_DELETE_CHUNK_SIZE,
+                            help='Rows deleted per statement')
+
+    def handle(self, *args, **options):
+        days, exported = archive_clicks(retention_days=options['days'], chunk_size=options['chunk_size'])
+        
+        if exported > 0:
+            self.stdout.write(self.style.SUCCESS(f'Archived {exported} clicks from {days} days to {settings.CLICK_ARCHIVE_DIR}'))
+        else:
+            self.stdout.write(self.style.SUCCESS('No clicks older than the retention period'))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Min
+from analytics.models import ClickEvent, ClickRollup, HeavyHitterSketch, RollupWatermark
+from analytics.rollups import CLICK_ROLLUP_WATERMARK, ROLLUP_BATCH_SIZE, compact_click_rollups
+
+class Command(BaseCommand):
+    help = 'Fold raw click events into the click rollups, optionally rebuilding them from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Delete the rollups covered by raw clicks and fold those clicks again')
+        parser.add_argument('--batch-size', type=int, default=ROLLUP_BATCH_SIZE, help='Clicks folded per transaction')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            # Archived clicks are gone from the raw table, so only the days
+            # that still have raw clicks can be rebuilt
+            first = ClickEvent.objects.aggregate(id=Min('id'), timestamp=Min('timestamp'))
+            if first['id'] is None:
+                raise CommandError('There are no raw clicks to rebuild the rollups from')
+            
+            with transaction.atomic():
+                deleted, _ = ClickRollup.objects.filter(
+                    bucket__gte=first['timestamp'].replace(hour=0, minute=0, second=0, microsecond=0)
+                ).delete()
+                HeavyHitterSketch.objects.filter(day__gte=first['timestamp'].date()).delete()
+                RollupWatermark.objects.update_or_create(
+                    name=CLICK_ROLLUP_WATERMARK, defaults={'last_id': first['id'] - 1}
+                )
+            self.stdout.write(f'Deleted {deleted} click rollups from {first["timestamp"].date()} on')
+        
+        folded = compact_click_rollups(batch_size=options['batch_size'])
+        watermark = RollupWatermark.current(CLICK_ROLLUP_WATERMARK)
+        self.stdout.write(self.style.SUCCESS(f'Folded {folded} clicks into rollups (watermark at click {watermark})'))
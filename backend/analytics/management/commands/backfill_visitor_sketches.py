@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models.functions import TruncDate
+from analytics.hyperloglog import HyperLogLog
+from analytics.models import ClickEvent, VisitorSketch
+
+class Command(BaseCommand):
+    help = 'Add the visitor IPs of existing click events to the daily unique visitor sketches'
+
+    def handle(self, *args, **options):
+        visits = ClickEvent.objects.exclude(ip_address__isnull=True).annotate(
+            day=TruncDate('timestamp')
+        ).values('url_id', 'url__user_id', 'day', 'ip_address').distinct().order_by('day')
+        
+        sketches = {}
+        current_day = None
+        written = 0
+        for visit in visits.iterator(chunk_size=5000):
+            if visit['day'] != current_day:
+                written += self.save_sketches(current_day, sketches)
+                sketches = {}
+                current_day = visit['day']
+            
+            for scope in VisitorSketch.scopes(visit['url_id'], visit['url__user_id']):
+                key = (scope['url_id'], scope['user_id'])
+                sketches.setdefault(key, HyperLogLog()).add(visit['ip_address'])
+        
+        written += self.save_sketches(current_day, sketches)
+        self.stdout.write(self.style.SUCCESS(f'Updated {written} visitor sketches'))
+
+    def save_sketches(self, day, sketches):
+        """Merge a day's sketches into the stored ones, so visits recorded since are kept."""
+        for (url_id, user_id), hll in sketches.items():
+            with transaction.atomic():
+                sketch, created = VisitorSketch.objects.select_for_update().get_or_create(
+                    day=day, url_id=url_id, user_id=user_id,
+                    defaults={'registers': hll.to_bytes()}
+                )
+                if not created:
+                    sketch.registers = hll.merge(HyperLogLog.from_bytes(sketch.registers)).to_bytes()
+                    sketch.save(update_fields=['registers'])
+        if day is not None:
+            VisitorSketch.merge_site_sketch(day)
+        return len(sketches)
@@ -0,0 +1,67 @@
+import gzip
+import time
+
+import brotli
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory, force_authenticate
+from shortener.models import ShortenedURL
+from shortener.views import ShortenedURLViewSet
+from analytics.views import AnalyticsViewSet
+from urlbriefr.middleware import BROTLI_QUALITY, GZIP_LEVEL
+from urlbriefr.renderers import MessagePackRenderer
+
+class Command(BaseCommand):
+    help = 'Compare render time and wire size of JSON and msgpack for the analytics and URL list payloads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url-id', type=int, help='URL to benchmark (defaults to the most clicked URL)')
+        parser.add_argument('--iterations', type=int, default=50, help='Render/compress repetitions per measurement')
+
+    def handle(self, *args, **options):
+        if options['url_id']:
+            url = ShortenedURL.objects.filter(pk=options['url_id'], user__isnull=False).first()
+        else:
+            url = ShortenedURL.objects.filter(user__isnull=False).annotate(
+                click_count=Count('clicks')
+            ).order_by('-click_count').first()
+        if url is None:
+            raise CommandError('No URL with an owner to benchmark')
+        
+        payloads = {
+            'analytics retrieve': self.get_payload(AnalyticsViewSet, 'retrieve', url.user, f'/api/analytics/{url.id}/', pk=url.id),
+            'url list': self.get_payload(ShortenedURLViewSet, 'list', url.user, '/api/urls/'),
+        }
+        
+        iterations = options['iterations']
+        self.stdout.write(f'URL {url.id} ({url.short_code}), {iterations} iterations per measurement')
+        self.stdout.write(f"{'payload':<20} {'format':<8} {'render ms':>10} {'raw B':>9} {'gzip B':>9} {'gzip ms':>8} {'br B':>9} {'br ms':>8}")
+        
+        for name, data in payloads.items():
+            for label, renderer in (('json', JSONRenderer()), ('msgpack', MessagePackRenderer())):
+                render_ms, body = self.measure(lambda: renderer.render(data), iterations)
+                gzip_ms, gzipped = self.measure(lambda: gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0), iterations)
+                br_ms, brotlied = self.measure(lambda: brotli.compress(body, quality=BROTLI_QUALITY), iterations)
+                self.stdout.write(
+                    f'{name:<20} {label:<8} {render_ms:>10.3f} {len(body):>9} '
+                    f'{len(gzipped):>9} {gzip_ms:>8.3f} {len(brotlied):>9} {br_ms:>8.3f}'
+                )
+        
+        self.stdout.write(self.style.SUCCESS('Benchmark complete'))
+
+    def get_payload(self, viewset, action, user, path, **kwargs):
+        """Run a viewset action as the URL owner and return its response data."""
+        request = APIRequestFactory().get(path)
+        force_authenticate(request, user=user)
+        response = viewset.as_view({'get': action})(request, **kwargs)
+        if response.status_code != 200:
+            raise CommandError(f'{path} returned {response.status_code}')
+        return response.data
+
+    def measure(self, func, iterations):
+        """Average a function's run time in milliseconds and return its last result."""
+        start = time.perf_counter()
+        for _ in range(iterations):
+            result = func()
+        return (time.perf_counter() - start) * 1000 / iterations, result
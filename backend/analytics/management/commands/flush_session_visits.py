@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from analytics.visitors import flush_session_visits
+
+class Command(BaseCommand):
+    help = 'Write the repeat session visits buffered in the cache (run every minute, or schedule flush_session_visits_task)'
+
+    def handle(self, *args, **options):
+        updated = flush_session_visits()
+        self.stdout.write(self.style.SUCCESS(f'Updated {updated} sessions'))
@@ -0,0 +1,29 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.dateparse import parse_date
+from analytics.archive import archived_partitions, read_archived_clicks
+
+class Command(BaseCommand):
+    help = 'Print archived clicks as NDJSON, or list the archived partitions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='First day to read (YYYY-MM-DD)')
+        parser.add_argument('--end', help='Last day to read (YYYY-MM-DD)')
+        parser.add_argument('--url', type=int, action='append', dest='url_ids', help='Only clicks for this URL id (repeatable)')
+        parser.add_argument('--list', action='store_true', help='List partitions instead of printing clicks')
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for day, files in archived_partitions():
+                self.stdout.write(f'{day} {len(files)} file(s)')
+            return
+        
+        start = parse_date(options['start']) if options['start'] else None
+        end = parse_date(options['end']) if options['end'] else None
+        if (options['start'] and start is None) or (options['end'] and end is None):
+            raise CommandError('Dates must be in YYYY-MM-DD format')
+        
+        for click in read_archived_clicks(start, end, options['url_ids']):
+            self.stdout.write(json.dumps(click, cls=DjangoJSONEncoder))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from analytics.models import AnalyticsReportJob
+from analytics.reports import run_report_job
+
+class Command(BaseCommand):
+    help = 'Generate pending analytics reports (for deployments without a Celery worker)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None, help='Generate at most this many reports')
+
+    def handle(self, *args, **options):
+        jobs = AnalyticsReportJob.objects.filter(status='pending').select_related('user').order_by('created_at')
+        if options['limit']:
+            jobs = jobs[:options['limit']]
+        
+        generated = 0
+        for job in jobs:
+            run_report_job(job)
+            generated += 1
+        
+        self.stdout.write(self.style.SUCCESS(f'Generated {generated} analytics reports'))
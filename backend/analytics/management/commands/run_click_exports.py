@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from analytics.export import run_export_job
+from analytics.models import ClickExportJob
+
+class Command(BaseCommand):
+    help = 'Write pending click export jobs (for deployments without a Celery worker)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None, help='Write at most this many exports')
+
+    def handle(self, *args, **options):
+        jobs = ClickExportJob.objects.filter(status='pending').select_related('user', 'url').order_by('created_at')
+        if options['limit']:
+            jobs = jobs[:options['limit']]
+        
+        written = 0
+        for job in jobs:
+            run_export_job(job)
+            written += 1
+        
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} click exports'))
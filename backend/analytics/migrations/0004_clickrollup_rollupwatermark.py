@@ -0,0 +1,40 @@
+# Generated by Django 5.2.2 on 2026-10-19 04:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0003_clickevent_session_id_usersession'),
+        ('shortener', '0013_urlstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ClickRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hourly'), ('day', 'Daily')], max_length=4)),
+                ('bucket', models.DateTimeField()),
+                ('dimension', models.CharField(choices=[('total', 'Total'), ('browser', 'Browser'), ('device', 'Device'), ('os', 'Operating system'), ('country', 'Country'), ('city', 'City'), ('referrer', 'Referrer')], max_length=20)),
+                ('value', models.CharField(blank=True, default='', max_length=2000)),
+                ('parent_value', models.CharField(blank=True, default='', max_length=100)),
+                ('clicks', models.PositiveBigIntegerField(default=0)),
+                ('url', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='click_rollups', to='shortener.shortenedurl')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['url', 'granularity', 'dimension', 'bucket'], name='analytics_c_url_id_585e73_idx')],
+            },
+        ),
+    ]
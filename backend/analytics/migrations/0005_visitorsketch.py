@@ -0,0 +1,30 @@
+# Generated by Django 5.2.2 on 2026-10-19 04:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0004_clickrollup_rollupwatermark'),
+        ('shortener', '0013_urlstats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VisitorSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('registers', models.BinaryField()),
+                ('url', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='visitor_sketches', to='shortener.shortenedurl')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='visitor_sketches', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(condition=models.Q(('url__isnull', False)), fields=('url', 'day'), name='unique_url_visitor_sketch'), models.UniqueConstraint(condition=models.Q(('url__isnull', True), ('user__isnull', False)), fields=('user', 'day'), name='unique_user_visitor_sketch'), models.UniqueConstraint(condition=models.Q(('url__isnull', True), ('user__isnull', True)), fields=('day',), name='unique_global_visitor_sketch')],
+            },
+        ),
+    ]
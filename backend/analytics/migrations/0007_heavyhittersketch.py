@@ -0,0 +1,75 @@
+# Generated by Django 5.2.2 on 2026-10-19 04:45
+
+import django.db.models.deletion
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+# Values kept per sketch, frozen here so later changes to analytics.heavy_hitters don't change this migration
+HEAVY_HITTER_CAPACITY = 100
+
+
+def sketch_entries(counts):
+    """Exact counts as stored Space-Saving entries: the most frequent keys with no error."""
+    return [[value, parent, count, 0] for (value, parent), count in counts.most_common(HEAVY_HITTER_CAPACITY)]
+
+
+def move_to_heavy_hitter_sketches(apps, schema_editor):
+    """Summarise the referrer and city rollups, and the rolled up user agents, as heavy-hitter sketches."""
+    ClickRollup = apps.get_model('analytics', 'ClickRollup')
+    ClickEvent = apps.get_model('analytics', 'ClickEvent')
+    RollupWatermark = apps.get_model('analytics', 'RollupWatermark')
+    HeavyHitterSketch = apps.get_model('analytics', 'HeavyHitterSketch')
+    
+    counts = {}
+    rollups = ClickRollup.objects.filter(granularity='day', dimension__in=('referrer', 'city'))
+    for row in rollups.values('url_id', 'bucket', 'dimension', 'value', 'parent_value', 'clicks').iterator():
+        key = (row['url_id'], row['bucket'].date(), row['dimension'])
+        counts.setdefault(key, Counter())[(row['value'], row['parent_value'])] += row['clicks']
+    
+    # User agents weren't rolled up, so take them from the raw clicks the rollups already cover
+    watermark = RollupWatermark.objects.filter(name='click_rollups').values_list('last_id', flat=True).first() or 0
+    user_agents = ClickEvent.objects.filter(id__lte=watermark).annotate(
+        day=TruncDate('timestamp')
+    ).values('url_id', 'day', 'user_agent').annotate(clicks=Count('id')).order_by()
+    for row in user_agents.iterator():
+        key = (row['url_id'], row['day'], 'user_agent')
+        counts.setdefault(key, Counter())[(row['user_agent'] or '', '')] += row['clicks']
+    
+    HeavyHitterSketch.objects.bulk_create([
+        HeavyHitterSketch(url_id=url_id, day=day, dimension=dimension, entries=sketch_entries(day_counts))
+        for (url_id, day, dimension), day_counts in counts.items()
+    ], batch_size=500)
+    rollups.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0006_clickexportjob'),
+        ('shortener', '0013_urlstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HeavyHitterSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('dimension', models.CharField(choices=[('referrer', 'Referrer'), ('city', 'City'), ('user_agent', 'User agent')], max_length=20)),
+                ('entries', models.JSONField(default=list)),
+                ('url', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='heavy_hitter_sketches', to='shortener.shortenedurl')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('url', 'dimension', 'day'), name='unique_heavy_hitter_sketch')],
+            },
+        ),
+        migrations.RunPython(move_to_heavy_hitter_sketches, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='clickrollup',
+            name='dimension',
+            field=models.CharField(choices=[('total', 'Total'), ('browser', 'Browser'), ('device', 'Device'), ('os', 'Operating system'), ('country', 'Country')], max_length=20),
+        ),
+    ]
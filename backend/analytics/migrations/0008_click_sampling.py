@@ -0,0 +1,23 @@
+# Generated by Django 5.2.2 on 2026-10-19 05:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0007_heavyhittersketch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clickevent',
+            name='weight',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='clickrollup',
+            name='variance',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.2 on 2026-10-19 05:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0008_click_sampling'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Referrer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(max_length=2000)),
+                ('url_hash', models.CharField(max_length=64, unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserAgent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_agent', models.TextField(blank=True, default='')),
+                ('user_agent_hash', models.CharField(max_length=64, unique=True)),
+                ('browser', models.CharField(blank=True, default='', max_length=100)),
+                ('device', models.CharField(blank=True, default='', max_length=100)),
+                ('os', models.CharField(blank=True, default='', max_length=100)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Location',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('country', models.CharField(blank=True, default='', max_length=100)),
+                ('city', models.CharField(blank=True, default='', max_length=100)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('country', 'city'), name='unique_location')],
+            },
+        ),
+        migrations.AddField(
+            model_name='clickevent',
+            name='location',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='clicks', to='analytics.location'),
+        ),
+        migrations.AddField(
+            model_name='clickevent',
+            name='referral',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='clicks', to='analytics.referrer'),
+        ),
+        migrations.AddField(
+            model_name='clickevent',
+            name='agent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='clicks', to='analytics.useragent'),
+        ),
+    ]
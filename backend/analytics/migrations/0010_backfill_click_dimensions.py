@@ -0,0 +1,111 @@
+# Generated by Django 5.2.2 on 2026-10-19 05:17
+
+import hashlib
+
+from django.db import migrations, transaction
+
+
+def _hash(value):
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+# Clicks moved per batch, so memory and statement size stay bounded on large tables
+BACKFILL_BATCH_SIZE = 2000
+
+
+def move_to_dimension_tables(apps, schema_editor):
+    """Store each distinct user agent, referrer and location once and point the clicks at them."""
+    ClickEvent = apps.get_model('analytics', 'ClickEvent')
+    UserAgent = apps.get_model('analytics', 'UserAgent')
+    Referrer = apps.get_model('analytics', 'Referrer')
+    Location = apps.get_model('analytics', 'Location')
+    
+    # Dimension ids resolved in the current batch, cleared after it so memory stays bounded
+    agents, referrals, locations = {}, {}, {}
+    
+    def agent_id(user_agent, browser, device, os):
+        if not any((user_agent, browser, device, os)):
+            return None
+        # Clicks stored without their user agent string are keyed by what was parsed from it
+        key = _hash(user_agent) if user_agent else _hash('\0' + '|'.join(value or '' for value in (browser, device, os)))
+        if key not in agents:
+            agents[key] = UserAgent.objects.get_or_create(user_agent_hash=key, defaults={
+                'user_agent': user_agent or '', 'browser': browser or '', 'device': device or '', 'os': os or ''
+            })[0].id
+        return agents[key]
+    
+    def referral_id(url):
+        if not url:
+            return None
+        key = _hash(url)
+        if key not in referrals:
+            referrals[key] = Referrer.objects.get_or_create(url_hash=key, defaults={'url': url})[0].id
+        return referrals[key]
+    
+    def location_id(country, city):
+        if not country and not city:
+            return None
+        key = (country or '', city or '')
+        if key not in locations:
+            locations[key] = Location.objects.get_or_create(country=key[0], city=key[1])[0].id
+        return locations[key]
+    
+    # The clicks' already parsed fields are kept rather than parsing again
+    last_id = 0
+    while True:
+        batch = list(ClickEvent.objects.filter(id__gt=last_id).order_by('id').only(
+            'id', 'user_agent', 'browser', 'device', 'os', 'referrer', 'country', 'city'
+        )[:BACKFILL_BATCH_SIZE])
+        if not batch:
+            break
+        for click in batch:
+            click.agent_id = agent_id(click.user_agent, click.browser, click.device, click.os)
+            click.referral_id = referral_id(click.referrer)
+            click.location_id = location_id(click.country, click.city)
+        # One UPDATE per batch rather than one per distinct value, committed on its own
+        with transaction.atomic():
+            ClickEvent.objects.bulk_update(batch, ['agent', 'referral', 'location'])
+        last_id = batch[-1].id
+        for resolved in (agents, referrals, locations):
+            resolved.clear()
+
+
+def move_to_click_columns(apps, schema_editor):
+    """Copy each click's user agent, referrer and location back into its own columns."""
+    ClickEvent = apps.get_model('analytics', 'ClickEvent')
+    
+    last_id = 0
+    while True:
+        batch = list(ClickEvent.objects.filter(id__gt=last_id).order_by('id').select_related(
+            'agent', 'referral', 'location'
+        )[:BACKFILL_BATCH_SIZE])
+        if not batch:
+            break
+        for click in batch:
+            agent, referral, location = click.agent, click.referral, click.location
+            click.user_agent = (agent.user_agent or None) if agent else None
+            click.browser = (agent.browser or None) if agent else None
+            click.device = (agent.device or None) if agent else None
+            click.os = (agent.os or None) if agent else None
+            click.referrer = referral.url if referral else None
+            click.country = (location.country or None) if location else None
+            click.city = (location.city or None) if location else None
+        with transaction.atomic():
+            ClickEvent.objects.bulk_update(
+                batch, ['user_agent', 'browser', 'device', 'os', 'referrer', 'country', 'city']
+            )
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+    # Each batch commits on its own, so the click table isn't held in one
+    # transaction and the removal that follows has no pending FK checks
+    atomic = False
+
+    dependencies = [
+        ('analytics', '0009_click_dimensions'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_to_dimension_tables, move_to_click_columns),
+    ]
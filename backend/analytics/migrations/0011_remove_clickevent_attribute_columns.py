@@ -0,0 +1,41 @@
+# Generated by Django 5.2.2 on 2026-10-19 05:17
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0010_backfill_click_dimensions'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='clickevent',
+            name='browser',
+        ),
+        migrations.RemoveField(
+            model_name='clickevent',
+            name='city',
+        ),
+        migrations.RemoveField(
+            model_name='clickevent',
+            name='country',
+        ),
+        migrations.RemoveField(
+            model_name='clickevent',
+            name='device',
+        ),
+        migrations.RemoveField(
+            model_name='clickevent',
+            name='os',
+        ),
+        migrations.RemoveField(
+            model_name='clickevent',
+            name='referrer',
+        ),
+        migrations.RemoveField(
+            model_name='clickevent',
+            name='user_agent',
+        ),
+    ]
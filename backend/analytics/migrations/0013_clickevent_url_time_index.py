@@ -0,0 +1,44 @@
+# Generated by Django 5.2.2 on 2026-10-19 05:30
+
+from django.db import migrations, models
+
+
+class AddIndexConcurrently(migrations.AddIndex):
+    """
+    Build the index without locking clicks against writes on PostgreSQL.
+
+    django.contrib.postgres.operations.AddIndexConcurrently can't be imported
+    without psycopg, and development databases are SQLite, where indexes are
+    added the usual way.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.add_index(model, self.index, concurrently=True)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().database_backwards(app_label, schema_editor, from_state, to_state)
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.remove_index(model, self.index, concurrently=True)
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('analytics', '0012_analyticsreportjob'),
+        ('shortener', '0015_shortenedurl_suppressed_clicks'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='clickevent',
+            index=models.Index(fields=['url', 'timestamp', 'id'], name='click_url_time_idx'),
+        ),
+    ]
@@ -1,6 +1,76 @@
-from django.db import models
+import hashlib
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F, Q
 from shortener.models import ShortenedURL
 from django.utils import timezone
+from .heavy_hitters import HEAVY_HITTER_CAPACITY, SpaceSaving
+from .hyperloglog import HyperLogLog, register_position
+
+class UserAgent(models.Model):
+    """A distinct user agent string, parsed once into browser, device and OS."""
+    
+    user_agent = models.TextField(blank=True, default='')
+    # SHA-256 of the string, since long text can't be indexed everywhere
+    user_agent_hash = models.CharField(max_length=64, unique=True)
+    browser = models.CharField(max_length=100, blank=True, default='')
+    device = models.CharField(max_length=100, blank=True, default='')
+    os = models.CharField(max_length=100, blank=True, default='')
+    
+    def __str__(self):
+        return f"{self.browser} / {self.os} / {self.device}"
+    
+    @staticmethod
+    def hash(user_agent):
+        return hashlib.sha256(user_agent.encode()).hexdigest()
+
+class Referrer(models.Model):
+    """A distinct referrer URL."""
+    
+    url = models.URLField(max_length=2000)
+    url_hash = models.CharField(max_length=64, unique=True)
+    
+    def __str__(self):
+        return self.url
+    
+    @staticmethod
+    def hash(url):
+        return hashlib.sha256(url.encode()).hexdigest()
+
+class Location(models.Model):
+    """A distinct country and city pair."""
+    
+    country = models.CharField(max_length=100, blank=True, default='')
+    city = models.CharField(max_length=100, blank=True, default='')
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['country', 'city'], name='unique_location'),
+        ]
+        
+    def __str__(self):
+        return f"{self.city}, {self.country}"
+
+# Click attributes stored in the dimension tables, and their lookups from ClickEvent
+CLICK_ATTRIBUTES = {
+    'user_agent': 'agent__user_agent',
+    'browser': 'agent__browser',
+    'device': 'agent__device',
+    'os': 'agent__os',
+    'country': 'location__country',
+    'city': 'location__city',
+    'referrer': 'referral__url',
+}
+
+class ClickEventQuerySet(models.QuerySet):
+    
+    def attribute_values(self, *fields):
+        """values() that also accepts the CLICK_ATTRIBUTES names, read from the dimension tables."""
+        return self.values(
+            *[field for field in fields if field not in CLICK_ATTRIBUTES],
+            **{field: F(CLICK_ATTRIBUTES[field]) for field in fields if field in CLICK_ATTRIBUTES}
+        )
 
 class ClickEvent(models.Model):
     """Model to store click analytics for shortened URLs."""
@@ -13,24 +83,25 @@ class ClickEvent(models.Model):
     timestamp = models.DateTimeField(default=timezone.now)
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     
-    # Device info
-    user_agent = models.TextField(blank=True, null=True)
-    browser = models.CharField(max_length=100, blank=True, null=True)
-    device = models.CharField(max_length=100, blank=True, null=True)
-    os = models.CharField(max_length=100, blank=True, null=True)
-    
-    # Location info (can be populated by IP geolocation)
-    country = models.CharField(max_length=100, blank=True, null=True)
-    city = models.CharField(max_length=100, blank=True, null=True)
-    
-    # Referrer info
-    referrer = models.URLField(max_length=2000, blank=True, null=True)
+    # User agent, referrer and location (from IP geolocation) are stored once in dimension tables
+    agent = models.ForeignKey(UserAgent, on_delete=models.PROTECT, related_name='clicks', null=True, blank=True)
+    referral = models.ForeignKey(Referrer, on_delete=models.PROTECT, related_name='clicks', null=True, blank=True)
+    location = models.ForeignKey(Location, on_delete=models.PROTECT, related_name='clicks', null=True, blank=True)
     
     # Session identifier
     session_id = models.CharField(max_length=100, blank=True, null=True)
     
+    # Clicks this row stands for; above 1 when the link's clicks are being sampled
+    weight = models.PositiveIntegerField(default=1)
+    
+    objects = ClickEventQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            # A link's clicks by time, for time ranges and click log pages
+            models.Index(fields=['url', 'timestamp', 'id'], name='click_url_time_idx'),
+        ]
         
     def __str__(self):
         return f"{self.url.short_code} - {self.timestamp}"
@@ -74,3 +145,304 @@ class UserSession(models.Model):
         self.last_visit = timezone.now()
         self.visit_count += 1
         self.save(update_fields=['last_visit', 'visit_count'])
+
+class ClickRollup(models.Model):
+    """Pre-aggregated click counts per URL, time bucket and dimension value."""
+    
+    GRANULARITY_CHOICES = (
+        ('hour', 'Hourly'),
+        ('day', 'Daily'),
+    )
+    
+    DIMENSION_CHOICES = (
+        ('total', 'Total'),
+        ('browser', 'Browser'),
+        ('device', 'Device'),
+        ('os', 'Operating system'),
+        ('country', 'Country'),
+    )
+    
+    url = models.ForeignKey(
+        ShortenedURL,
+        on_delete=models.CASCADE,
+        related_name='click_rollups'
+    )
+    granularity = models.CharField(max_length=4, choices=GRANULARITY_CHOICES)
+    bucket = models.DateTimeField()
+    dimension = models.CharField(max_length=20, choices=DIMENSION_CHOICES)
+    # Empty when the raw value was missing
+    value = models.CharField(max_length=2000, blank=True, default='')
+    # Country of a city, since city names alone are ambiguous
+    parent_value = models.CharField(max_length=100, blank=True, default='')
+    clicks = models.PositiveBigIntegerField(default=0)
+    # Variance of clicks from sampling, 0 when every click was stored
+    variance = models.PositiveBigIntegerField(default=0)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['url', 'granularity', 'dimension', 'bucket']),
+        ]
+        
+    def __str__(self):
+        return f"{self.url.short_code} - {self.granularity} {self.bucket} {self.dimension}={self.value}: {self.clicks}"
+
+class HeavyHitterSketch(models.Model):
+    """
+    Daily Space-Saving summary of a high-cardinality click dimension for a URL.
+    
+    Summaries merge across days and URLs, so top-N panels over any range
+    read a bounded amount of data per day instead of grouping raw values.
+    """
+    
+    DIMENSION_CHOICES = (
+        ('referrer', 'Referrer'),
+        ('city', 'City'),
+        ('user_agent', 'User agent'),
+    )
+    
+    url = models.ForeignKey(
+        ShortenedURL,
+        on_delete=models.CASCADE,
+        related_name='heavy_hitter_sketches'
+    )
+    day = models.DateField()
+    dimension = models.CharField(max_length=20, choices=DIMENSION_CHOICES)
+    # [value, parent_value, count, error] lists; a city's parent value is its country
+    entries = models.JSONField(default=list)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['url', 'dimension', 'day'], name='unique_heavy_hitter_sketch'),
+        ]
+        
+    def __str__(self):
+        return f"{self.url_id} - {self.day} top {self.dimension}"
+    
+    def summary(self):
+        return SpaceSaving.from_entries(self.entries, HEAVY_HITTER_CAPACITY)
+    
+    @classmethod
+    def summaries(cls, dimensions, since=None, **url_filter):
+        """
+        Merged summaries per dimension over every matching URL and day from
+        the given day on. Sketches are merged as they are read, so memory stays
+        bounded by the capacity however many there are.
+        """
+        sketches = cls.objects.filter(dimension__in=dimensions, **url_filter)
+        if since:
+            sketches = sketches.filter(day__gte=since)
+        
+        merged = {dimension: SpaceSaving(HEAVY_HITTER_CAPACITY) for dimension in dimensions}
+        for dimension, entries in sketches.values_list('dimension', 'entries').iterator():
+            merged[dimension].merge(SpaceSaving.from_entries(entries))
+        return merged
+
+class RollupWatermark(models.Model):
+    """Highest raw row id a compaction job has folded into its rollups."""
+    
+    name = models.CharField(max_length=50, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.name} @ {self.last_id}"
+    
+    @classmethod
+    def current(cls, name):
+        """Get the last compacted id for a job, or 0 if it has never run."""
+        return cls.objects.filter(name=name).values_list('last_id', flat=True).first() or 0
+
+class VisitorSketch(models.Model):
+    """
+    Daily HyperLogLog sketch of visitor IPs.
+    
+    Kept per URL, per user (all of their links) and globally (url and user
+    both empty), so unique visitors for any date range and scope are a
+    merge of at most one sketch per day. Clicks only write the URL and user
+    sketches; the global ones are merged from those by a periodic task.
+    """
+    
+    url = models.ForeignKey(
+        ShortenedURL,
+        on_delete=models.CASCADE,
+        related_name='visitor_sketches',
+        null=True,
+        blank=True
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='visitor_sketches',
+        null=True,
+        blank=True
+    )
+    day = models.DateField()
+    registers = models.BinaryField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['url', 'day'], condition=models.Q(url__isnull=False),
+                name='unique_url_visitor_sketch'
+            ),
+            models.UniqueConstraint(
+                fields=['user', 'day'], condition=models.Q(url__isnull=True, user__isnull=False),
+                name='unique_user_visitor_sketch'
+            ),
+            models.UniqueConstraint(
+                fields=['day'], condition=models.Q(url__isnull=True, user__isnull=True),
+                name='unique_global_visitor_sketch'
+            ),
+        ]
+        
+    def __str__(self):
+        scope = f"URL {self.url_id}" if self.url_id else f"user {self.user_id}" if self.user_id else "global"
+        return f"Visitors {scope} - {self.day}"
+    
+    @staticmethod
+    def scopes(url_id, user_id):
+        """Lookups for every sketch a visit to a URL counts towards as it happens."""
+        scopes = [{'url_id': url_id, 'user_id': None}]
+        if user_id:
+            scopes.append({'url_id': None, 'user_id': user_id})
+        return scopes
+    
+    @classmethod
+    def record_visitor(cls, url_id, user_id, visitor, when=None):
+        """Add a visitor to the day's sketches for a URL and its owner."""
+        if not visitor:
+            return
+        day = timezone.localdate(when or timezone.now())
+        index, rank = register_position(visitor)
+        scopes = cls.scopes(url_id, user_id)
+        
+        # Most visits don't raise a register, so check every scope in one query without locking first
+        current = dict(cls.objects.filter(
+            Q(*[Q(**scope) for scope in scopes], _connector=Q.OR), day=day
+        ).values_list('url_id', 'registers'))
+        for scope in scopes:
+            registers = current.get(scope['url_id'])
+            if registers is not None and HyperLogLog.from_bytes(registers).registers[index] >= rank:
+                continue
+            
+            with transaction.atomic():
+                sketch, created = cls.objects.select_for_update().get_or_create(
+                    day=day, **scope, defaults={'registers': HyperLogLog().to_bytes()}
+                )
+                hll = HyperLogLog.from_bytes(sketch.registers)
+                if hll.set_register(index, rank):
+                    sketch.registers = hll.to_bytes()
+                    sketch.save(update_fields=['registers'])
+    
+    @classmethod
+    def merge_site_sketch(cls, day):
+        """Rebuild a day's global sketch from its user sketches and those of links without an owner."""
+        registers = cls.objects.filter(day=day).filter(
+            Q(url__isnull=True, user__isnull=False) | Q(url__isnull=False, url__user__isnull=True)
+        ).values_list('registers', flat=True)
+        merged = HyperLogLog.merge_all(registers.iterator())
+        cls.objects.update_or_create(day=day, url=None, user=None, defaults={'registers': merged.to_bytes()})
+    
+    @classmethod
+    def estimates_by_url(cls, url_ids, start=None, end=None):
+        """Estimate unique visitors between two days (inclusive) for each of some URLs, in one query."""
+        sketches = cls.objects.filter(url_id__in=url_ids)
+        if start:
+            sketches = sketches.filter(day__gte=start)
+        if end:
+            sketches = sketches.filter(day__lte=end)
+        
+        by_url = {url_id: [] for url_id in url_ids}
+        for url_id, registers in sketches.values_list('url_id', 'registers').iterator():
+            by_url[url_id].append(registers)
+        return {url_id: HyperLogLog.merge_all(registers).count() for url_id, registers in by_url.items()}
+    
+    @classmethod
+    def estimate(cls, start=None, end=None, **scope):
+        """
+        Estimate unique visitors for a scope between two days (inclusive).
+        
+        The scope is url_id, url_id__in, user_id or nothing for the whole site.
+        """
+        sketches = cls.objects.all()
+        if 'url_id' in scope or 'url_id__in' in scope:
+            sketches = sketches.filter(**scope)
+        elif scope.get('user_id'):
+            sketches = sketches.filter(url__isnull=True, user_id=scope['user_id'])
+        else:
+            sketches = sketches.filter(url__isnull=True, user__isnull=True)
+        if start:
+            sketches = sketches.filter(day__gte=start)
+        if end:
+            sketches = sketches.filter(day__lte=end)
+        return HyperLogLog.merge_all(sketches.values_list('registers', flat=True).iterator()).count()
+
+class ClickExportJob(models.Model):
+    """A background export of raw clicks to a compressed file for later download."""
+    
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    )
+    
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='click_export_jobs'
+    )
+    # Empty for an export of every link the user owns
+    url = models.ForeignKey(
+        ShortenedURL,
+        on_delete=models.CASCADE,
+        related_name='click_export_jobs',
+        null=True,
+        blank=True
+    )
+    file_format = models.CharField(max_length=10, default='csv')
+    columns = models.JSONField(default=list)
+    start_date = models.DateField(null=True, blank=True)
+    end_date = models.DateField(null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    row_count = models.PositiveBigIntegerField(default=0)
+    file_path = models.CharField(max_length=500, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        
+    def __str__(self):
+        return f"Click export {self.id} ({self.status})"
+
+
+class AnalyticsReportJob(models.Model):
+    """A background analytics report workbook, shared by identical requests through its content key."""
+    
+    STATUS_CHOICES = ClickExportJob.STATUS_CHOICES
+    
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='analytics_report_jobs'
+    )
+    # Empty for a report on every link the user owns
+    url_ids = models.JSONField(default=list)
+    file_format = models.CharField(max_length=10, default='xlsx')
+    start_date = models.DateField()
+    end_date = models.DateField()
+    # Hash of the report parameters and the data version they were requested at
+    content_key = models.CharField(max_length=64, db_index=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    file_path = models.CharField(max_length=500, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        
+    def __str__(self):
+        return f"Analytics report {self.id} ({self.status})"
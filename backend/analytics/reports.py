@@ -0,0 +1,229 @@
+"""
+Analytics report workbooks.
+
+A report covers some or all of a user's links over a date window, in four
+sheets: a summary per link, daily clicks, dimension breakdowns and a sample
+of the most recent raw clicks. It is written as an .xlsx workbook in
+XlsxWriter's constant memory mode, or as a zip of one CSV per sheet, with
+rows generated one at a time.
+
+Reports are only ever generated by a background worker. Each one is stored
+under a key hashing its parameters and the owner's cache version (bumped by
+every click), so repeating a request before new clicks arrive reuses the
+finished file instead of building it again.
+"""
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import zipfile
+from datetime import datetime, time, timedelta
+
+import xlsxwriter
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from shortener.cache import get_user_cache_version
+from shortener.models import ShortenedURL
+from .models import AnalyticsReportJob, ClickEvent, VisitorSketch
+from .rollups import ROLLUP_DIMENSIONS, ClickSource
+
+logger = logging.getLogger(__name__)
+
+REPORT_FORMATS = {
+    'xlsx': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'csv': ('zip', 'application/zip'),
+}
+
+DEFAULT_REPORT_DAYS = 30
+MAX_REPORT_DAYS = 366
+MAX_REPORT_URLS = 500
+
+# Most recent raw clicks included in the sample sheet
+REPORT_SAMPLE_ROWS = 1000
+
+SAMPLE_COLUMNS = ('timestamp', 'short_code', 'browser', 'device', 'os', 'country', 'city', 'referrer', 'weight')
+
+
+def parse_report_options(data):
+    """
+    Validate report options from a request body.
+
+    Returns a dict of file_format, url_ids (empty for every link) and start
+    and end dates. Raises ValueError with a message for the client.
+    """
+    file_format = data.get('file_format') or 'xlsx'
+    if file_format not in REPORT_FORMATS:
+        raise ValueError(f"file_format must be one of: {', '.join(REPORT_FORMATS)}")
+
+    url_ids = data.get('urls') or []
+    if isinstance(url_ids, str):
+        url_ids = url_ids.split(',')
+    try:
+        url_ids = sorted({int(url_id) for url_id in url_ids if url_id != ''})
+    except (TypeError, ValueError):
+        raise ValueError("urls must be a list of URL ids")
+    if len(url_ids) > MAX_REPORT_URLS:
+        raise ValueError(f"At most {MAX_REPORT_URLS} URLs can be reported on at once")
+
+    dates = {}
+    for name in ('start', 'end'):
+        value = data.get(name)
+        dates[name] = parse_date(value) if value else None
+        if value and dates[name] is None:
+            raise ValueError(f"{name} must be a date in YYYY-MM-DD format")
+    end = dates['end'] or timezone.localdate()
+    start = dates['start'] or end - timedelta(days=DEFAULT_REPORT_DAYS - 1)
+    if start > end:
+        raise ValueError("start must not be after end")
+    if (end - start).days >= MAX_REPORT_DAYS:
+        raise ValueError(f"Reports can cover at most {MAX_REPORT_DAYS} days")
+
+    return {'file_format': file_format, 'url_ids': url_ids, 'start': start, 'end': end}
+
+
+def report_content_key(user, options, scope_user_id):
+    """
+    Key of a report's contents: its parameters and the data version of the
+    links' owner (scope_user_id), or the global one when it is None.
+    """
+    parts = {
+        'user': user.id,
+        'version': get_user_cache_version(scope_user_id),
+        'urls': options['url_ids'],
+        'format': options['file_format'],
+        'start': options['start'].isoformat(),
+        'end': options['end'].isoformat(),
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+def report_path(job):
+    """Where a report with the job's content key is stored."""
+    extension = REPORT_FORMATS[job.file_format][0]
+    return os.path.join(settings.ANALYTICS_REPORT_DIR, f"{job.content_key}.{extension}")
+
+
+def report_filename(job):
+    """Download filename for a report."""
+    return f"analytics-report-{job.start_date.isoformat()}-{job.end_date.isoformat()}.{REPORT_FORMATS[job.file_format][0]}"
+
+
+def report_sheets(job):
+    """
+    Yield a report's sheets as (name, header, rows) with rows an iterator of lists.
+
+    Every figure is computed with queries grouped by URL, so the cost
+    doesn't grow with the number of links.
+    """
+    # Access to the listed links was checked when the job was created
+    urls = ShortenedURL.objects.filter(pk__in=job.url_ids) if job.url_ids else ShortenedURL.objects.filter(user=job.user)
+    urls = list(urls.order_by('-access_count', 'id').values('id', 'short_code', 'title', 'original_url', 'access_count'))
+    url_ids = [url['id'] for url in urls]
+
+    since = timezone.make_aware(datetime.combine(job.start_date, time.min))
+    until = timezone.make_aware(datetime.combine(job.end_date + timedelta(days=1), time.min))
+    dates = [job.start_date + timedelta(days=day) for day in range((job.end_date - job.start_date).days + 1)]
+    source = ClickSource(url_id__in=url_ids)
+    clicks_by_date = source.clicks_by_url_and_date(since, until)
+    dimension_counts = source.dimension_counts_by_url(ROLLUP_DIMENSIONS, since, until)
+    unique_visitors = VisitorSketch.estimates_by_url(url_ids, job.start_date, job.end_date)
+
+    yield 'Summary', ['short_code', 'title', 'original_url', 'total_clicks', 'clicks_in_period', 'unique_visitors'], (
+        [
+            url['short_code'], url['title'] or '', url['original_url'], url['access_count'],
+            sum(clicks_by_date.get(url['id'], {}).values()), unique_visitors[url['id']]
+        ]
+        for url in urls
+    )
+
+    yield 'Daily clicks', ['date', *(url['short_code'] for url in urls)], (
+        [date, *(clicks_by_date.get(url['id'], {}).get(date, 0) for url in urls)]
+        for date in dates
+    )
+
+    yield 'Breakdowns', ['short_code', 'dimension', 'value', 'clicks'], (
+        [url['short_code'], dimension, value or 'Unknown', count]
+        for url in urls
+        for dimension in ROLLUP_DIMENSIONS
+        for value, count in dimension_counts.get(url['id'], {}).get(dimension, {}).most_common()
+    )
+
+    short_codes = {url['id']: url['short_code'] for url in urls}
+    sample = ClickEvent.objects.filter(
+        url_id__in=url_ids, timestamp__gte=since, timestamp__lt=until
+    ).order_by('-timestamp').attribute_values(
+        *(column for column in SAMPLE_COLUMNS if column != 'short_code'), 'url_id'
+    )[:REPORT_SAMPLE_ROWS]
+    yield 'Raw sample', list(SAMPLE_COLUMNS), (
+        [
+            short_codes[click['url_id']] if column == 'short_code'
+            else timezone.localtime(click['timestamp']).replace(tzinfo=None) if column == 'timestamp'
+            else click[column]
+            for column in SAMPLE_COLUMNS
+        ]
+        for click in sample.iterator(chunk_size=REPORT_SAMPLE_ROWS)
+    )
+
+
+def write_xlsx(path, sheets):
+    """Write sheets to a workbook, flushing each row to disk as it's written."""
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    header_format = workbook.add_format({'bold': True})
+    date_format = workbook.add_format({'num_format': 'yyyy-mm-dd'})
+    datetime_format = workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'})
+    try:
+        for name, header, rows in sheets:
+            worksheet = workbook.add_worksheet(name)
+            worksheet.write_row(0, 0, header, header_format)
+            for row_number, row in enumerate(rows, start=1):
+                for column, value in enumerate(row):
+                    if isinstance(value, datetime):
+                        worksheet.write_datetime(row_number, column, value, datetime_format)
+                    elif hasattr(value, 'isoformat'):
+                        worksheet.write_datetime(row_number, column, datetime.combine(value, time.min), date_format)
+                    else:
+                        worksheet.write(row_number, column, value)
+    finally:
+        workbook.close()
+
+
+def write_csv_zip(path, sheets):
+    """Write sheets to a zip holding one CSV file per sheet."""
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, header, rows in sheets:
+            filename = f"{name.lower().replace(' ', '_')}.csv"
+            with archive.open(filename, 'w') as member, io.TextIOWrapper(member, encoding='utf-8', newline='') as text:
+                writer = csv.writer(text)
+                writer.writerow(header)
+                writer.writerows(rows)
+
+
+def run_report_job(job):
+    """Generate a report job's file, or reuse the one written for an identical request, and record the outcome."""
+    path = report_path(job)
+    if os.path.exists(path):
+        AnalyticsReportJob.objects.filter(pk=job.pk).update(status='completed', file_path=path, completed_at=timezone.now())
+        return
+
+    job.status = 'running'
+    job.save(update_fields=['status'])
+
+    os.makedirs(settings.ANALYTICS_REPORT_DIR, exist_ok=True)
+    # Written under a temporary name, so a half-written file is never reused
+    partial_path = f"{path}.{job.id}.partial"
+    try:
+        writer = write_xlsx if job.file_format == 'xlsx' else write_csv_zip
+        writer(partial_path, report_sheets(job))
+        os.replace(partial_path, path)
+    except Exception as e:
+        logger.exception(f"Analytics report job {job.id} failed")
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        AnalyticsReportJob.objects.filter(pk=job.pk).update(status='failed', error=str(e), completed_at=timezone.now())
+        return
+
+    AnalyticsReportJob.objects.filter(pk=job.pk).update(status='completed', file_path=path, completed_at=timezone.now())
@@ -0,0 +1,379 @@
+"""
+Click rollups: pre-aggregated click counts for the analytics endpoints.
+
+A compaction job folds raw ClickEvent rows into hourly totals and daily
+per-dimension counts, and records the highest click id it has folded in a
+watermark. Readers combine the rollups with the raw clicks above the
+watermark, so results are exact while only the unrolled tail is scanned.
+Clicks are summed by weight, so links whose raw clicks are sampled are
+rolled up as estimates, with their sampling variance alongside.
+
+High-cardinality dimensions (referrers, cities, user agents) are folded
+into daily heavy-hitter summaries instead, which answer top-N queries
+approximately with bounded storage and memory.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import BooleanField, Case, F, Max, Sum, Value, When
+from django.db.models.functions import ExtractHour, TruncDate, TruncDay, TruncHour
+from django.utils import timezone
+
+from .dimensions import grouped_attribute_rows
+from .heavy_hitters import SpaceSaving
+from .models import ClickEvent, ClickRollup, HeavyHitterSketch, RollupWatermark
+from .sampling import click_estimate
+
+CLICK_ROLLUP_WATERMARK = 'click_rollups'
+
+# Clicks folded per transaction
+ROLLUP_BATCH_SIZE = 20000
+
+# Leave very recent clicks to the raw tail so in-flight inserts with lower ids aren't skipped
+ROLLUP_SAFETY_LAG = timedelta(minutes=1)
+
+# Rolled up exactly per day; the value is the click attribute
+ROLLUP_DIMENSIONS = ('browser', 'device', 'os', 'country')
+
+# Summarised per day by heavy-hitter sketches: dimension -> (value field, parent field)
+HEAVY_HITTER_DIMENSIONS = {
+    'referrer': ('referrer', None),
+    'city': ('city', 'country'),
+    'user_agent': ('user_agent', None),
+}
+
+# ClickRollup fields making up a rollup key, in key order
+ROLLUP_KEY_FIELDS = ('url_id', 'granularity', 'bucket', 'dimension', 'value', 'parent_value')
+
+# Estimated clicks and sampling variance of a group of raw clicks
+WEIGHTED_CLICKS = {
+    'clicks': Sum('weight'),
+    'variance': Sum(F('weight') * (F('weight') - 1)),
+}
+
+
+def _add_counts(counts, variances, granularity, dimension, rows, value_field=None, parent_field=None):
+    for row in rows:
+        key = (
+            row['url_id'], granularity, row['bucket'], dimension,
+            (row[value_field] or '') if value_field else '',
+            (row[parent_field] or '') if parent_field else '',
+        )
+        counts[key] += row['clicks']
+        variances[key] += row['variance']
+
+
+def _day_start(when):
+    return when.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def aggregate_clicks(events):
+    """Group raw click events into rollup keys, returning click counts and sampling variances per key."""
+    counts = Counter()
+    variances = Counter()
+
+    hourly = events.annotate(bucket=TruncHour('timestamp')).values('url_id', 'bucket').annotate(**WEIGHTED_CLICKS)
+    _add_counts(counts, variances, 'hour', 'total', hourly)
+
+    daily = events.annotate(bucket=TruncDay('timestamp'))
+    _add_counts(counts, variances, 'day', 'total', daily.values('url_id', 'bucket').annotate(**WEIGHTED_CLICKS))
+
+    # One pass grouped by the integer dimension ids covers every rolled up dimension
+    rows = grouped_attribute_rows(daily, ('url_id', 'bucket'), ROLLUP_DIMENSIONS, **WEIGHTED_CLICKS)
+    for dimension in ROLLUP_DIMENSIONS:
+        _add_counts(counts, variances, 'day', dimension, rows, value_field=dimension)
+
+    return counts, variances
+
+
+def heavy_hitter_key(click, dimension):
+    """The (value, parent_value) key a click counts towards in a heavy-hitter summary."""
+    value_field, parent_field = HEAVY_HITTER_DIMENSIONS[dimension]
+    return (click[value_field] or '', (click[parent_field] or '') if parent_field else '')
+
+
+def aggregate_heavy_hitters(events):
+    """Group raw click events into exact counts per URL, day and heavy-hitter dimension."""
+    counts = {}
+    daily = events.annotate(day=TruncDate('timestamp'))
+    for dimension, fields in HEAVY_HITTER_DIMENSIONS.items():
+        fields = [field for field in fields if field]
+        for row in grouped_attribute_rows(daily, ('url_id', 'day'), fields, clicks=Sum('weight')):
+            key = (row['url_id'], row['day'], dimension)
+            counts.setdefault(key, Counter())[heavy_hitter_key(row, dimension)] += row['clicks']
+    return counts
+
+
+def merge_heavy_hitters(counts):
+    """Merge exact click counts into the daily heavy-hitter sketches, creating the missing ones."""
+    if not counts:
+        return
+
+    days = [key[1] for key in counts]
+    existing = HeavyHitterSketch.objects.filter(
+        url_id__in={key[0] for key in counts},
+        day__gte=min(days),
+        day__lte=max(days)
+    )
+
+    to_update = []
+    for sketch in existing:
+        day_counts = counts.pop((sketch.url_id, sketch.day, sketch.dimension), None)
+        if day_counts:
+            sketch.entries = SpaceSaving.merge_all([sketch.summary(), SpaceSaving.from_counts(day_counts)]).to_entries()
+            to_update.append(sketch)
+
+    HeavyHitterSketch.objects.bulk_update(to_update, ['entries'], batch_size=500)
+    HeavyHitterSketch.objects.bulk_create([
+        HeavyHitterSketch(
+            url_id=url_id, day=day, dimension=dimension, entries=SpaceSaving.from_counts(day_counts).to_entries()
+        )
+        for (url_id, day, dimension), day_counts in counts.items()
+    ], batch_size=500)
+
+
+def merge_rollups(counts, variances=None):
+    """Add click counts (and sampling variances) to existing rollup rows, creating the missing ones."""
+    variances = variances or Counter()
+    if not counts:
+        return
+
+    buckets = [key[2] for key in counts]
+    existing = ClickRollup.objects.filter(
+        url_id__in={key[0] for key in counts},
+        bucket__gte=min(buckets),
+        bucket__lte=max(buckets)
+    )
+
+    to_update = []
+    for rollup in existing:
+        key = (rollup.url_id, rollup.granularity, rollup.bucket, rollup.dimension, rollup.value, rollup.parent_value)
+        clicks = counts.pop(key, None)
+        if clicks:
+            rollup.clicks += clicks
+            rollup.variance += variances[key]
+            to_update.append(rollup)
+
+    ClickRollup.objects.bulk_update(to_update, ['clicks', 'variance'], batch_size=1000)
+    ClickRollup.objects.bulk_create([
+        ClickRollup(**dict(zip(ROLLUP_KEY_FIELDS, key)), clicks=clicks, variance=variances[key])
+        for key, clicks in counts.items()
+    ], batch_size=1000)
+
+
+def compact_click_rollups(batch_size=ROLLUP_BATCH_SIZE, max_batches=None):
+    """
+    Fold raw clicks above the watermark into the rollups.
+
+    Each batch is folded and the watermark advanced in one transaction, with
+    the watermark row locked so concurrent runs can't double count.
+    Returns the number of clicks folded.
+    """
+    folded = 0
+    batches = 0
+
+    while max_batches is None or batches < max_batches:
+        with transaction.atomic():
+            watermark, _ = RollupWatermark.objects.select_for_update().get_or_create(name=CLICK_ROLLUP_WATERMARK)
+
+            candidates = ClickEvent.objects.filter(
+                id__gt=watermark.last_id,
+                timestamp__lt=timezone.now() - ROLLUP_SAFETY_LAG
+            )
+            upper = candidates.order_by('id').values_list('id', flat=True)[batch_size - 1:batch_size].first()
+            if upper is None:
+                upper = candidates.aggregate(upper=Max('id'))['upper']
+            if upper is None:
+                break
+
+            events = ClickEvent.objects.filter(id__gt=watermark.last_id, id__lte=upper)
+            counts, variances = aggregate_clicks(events)
+            folded += sum(clicks for key, clicks in counts.items() if key[1] == 'hour')
+            merge_rollups(counts, variances)
+            merge_heavy_hitters(aggregate_heavy_hitters(events))
+
+            watermark.last_id = upper
+            watermark.save(update_fields=['last_id', 'updated_at'])
+
+        batches += 1
+
+    return folded
+
+
+class ClickHistogram:
+    """
+    Click counts by date, hour of day and dimension value, built up from
+    rollups and raw clicks, with heavy-hitter summaries of the clicks since
+    the window start for the high-cardinality dimensions.
+    """
+
+    # Click attributes the breakdowns are counted by
+    ATTRIBUTE_FIELDS = ROLLUP_DIMENSIONS + ('referrer', 'city', 'user_agent')
+
+    # ClickEvent fields a raw click needs to be counted
+    CLICK_FIELDS = ('timestamp', 'weight') + ATTRIBUTE_FIELDS
+
+    def __init__(self, since):
+        self.since = since
+        self.by_date = Counter()
+        self.by_hour = Counter()
+        self.by_dimension = {dimension: Counter() for dimension in ROLLUP_DIMENSIONS}
+        self.heavy_hitters = {dimension: [SpaceSaving()] for dimension in HEAVY_HITTER_DIMENSIONS}
+        # Sampling variance of the total click count
+        self.variance = 0
+
+    def add_click(self, click):
+        """Count one raw click, given as a dict of CLICK_FIELDS."""
+        timestamp = click['timestamp']
+        weight = click['weight']
+        self._add(click, timestamp, timestamp >= self.since, weight, weight * (weight - 1))
+
+    def add_click_group(self, group):
+        """Count raw clicks grouped in the database by hour, whether they are in the window and their attributes."""
+        self._add(group, group['hour'], group['in_window'], group['clicks'], group['variance'])
+
+    def _add(self, attributes, when, in_window, clicks, variance):
+        if in_window:
+            self.by_date[when.date()] += clicks
+        self.by_hour[when.hour] += clicks
+        self.variance += variance
+        for dimension in ROLLUP_DIMENSIONS:
+            self.by_dimension[dimension][(attributes[dimension] or '', '')] += clicks
+        if in_window:
+            for dimension, summaries in self.heavy_hitters.items():
+                summaries[0].add(heavy_hitter_key(attributes, dimension), clicks)
+
+    def clicks_by_date(self):
+        return [{'date': date, 'count': count} for date, count in sorted(self.by_date.items())]
+
+    def clicks_by_hour(self):
+        return [{'hour': hour, 'count': count} for hour, count in sorted(self.by_hour.items())]
+
+    def dimension_counts(self, dimension):
+        """
+        Click counts per dimension value, most clicked first.
+
+        Returns (value, parent_value, count) tuples; missing values are ''.
+        High-cardinality dimensions only return their heavy hitters since the
+        window start, whose counts may be underestimates.
+        """
+        if dimension in self.heavy_hitters:
+            return SpaceSaving.merge_all(self.heavy_hitters[dimension]).top()
+        # Ties are ranked by value so the result doesn't depend on the order clicks were counted in
+        ranked = sorted(self.by_dimension[dimension].items(), key=lambda item: (-item[1], item[0]))
+        return [(value, parent, count) for (value, parent), count in ranked]
+
+    def sampling(self):
+        """Estimated total clicks behind the breakdowns and its margin of error."""
+        return click_estimate(sum(self.by_hour.values()), self.variance)
+
+
+class ClickSource:
+    """Rollups plus the unrolled raw tail for a set of URLs."""
+
+    def __init__(self, **url_filter):
+        watermark = RollupWatermark.current(CLICK_ROLLUP_WATERMARK)
+        self.rollups = ClickRollup.objects.filter(**url_filter)
+        self.tail = ClickEvent.objects.filter(id__gt=watermark, **url_filter)
+        self.url_filter = url_filter
+
+    def clicks_by_date(self, since):
+        """Daily click counts from the given time on, oldest first."""
+        counts = Counter()
+        for row in self.rollups.filter(
+            granularity='day', dimension='total', bucket__gte=_day_start(since)
+        ).values('bucket').annotate(count=Sum('clicks')).order_by():
+            counts[row['bucket'].date()] += row['count']
+        for row in self.tail.filter(timestamp__gte=since).annotate(
+            date=TruncDate('timestamp')
+        ).values('date').annotate(count=Sum('weight')).order_by():
+            counts[row['date']] += row['count']
+        return [{'date': date, 'count': count} for date, count in sorted(counts.items())]
+
+    def _window(self, since, until=None):
+        """Rollups and raw tail limited to a window; until, if given, must be the start of a day."""
+        rollups = self.rollups.filter(bucket__gte=_day_start(since))
+        tail = self.tail.filter(timestamp__gte=since)
+        if until is not None:
+            rollups = rollups.filter(bucket__lt=until)
+            tail = tail.filter(timestamp__lt=until)
+        return rollups, tail
+
+    def clicks_by_url_and_date(self, since, until=None):
+        """Daily click counts per URL from the given time on, as {url_id: Counter(date -> count)}."""
+        rollups, tail = self._window(since, until)
+        counts = {}
+        for row in rollups.filter(
+            granularity='day', dimension='total'
+        ).values('url_id', 'bucket').annotate(count=Sum('clicks')).order_by():
+            counts.setdefault(row['url_id'], Counter())[row['bucket'].date()] += row['count']
+        for row in tail.annotate(
+            date=TruncDate('timestamp')
+        ).values('url_id', 'date').annotate(count=Sum('weight')).order_by():
+            counts.setdefault(row['url_id'], Counter())[row['date']] += row['count']
+        return counts
+
+    def dimension_counts_by_url(self, dimensions, since=None, until=None):
+        """Click counts per value of some rolled up dimensions for each URL, as {url_id: {dimension: Counter}}."""
+        rollups, tail = self._window(since, until) if since is not None else (self.rollups, self.tail)
+
+        counts = {}
+        for row in rollups.filter(granularity='day', dimension__in=dimensions).values('url_id', 'dimension', 'value').annotate(count=Sum('clicks')).order_by():
+            by_dimension = counts.setdefault(row['url_id'], {dimension: Counter() for dimension in dimensions})
+            by_dimension[row['dimension']][row['value']] += row['count']
+        for row in grouped_attribute_rows(tail, ('url_id',), dimensions, count=Sum('weight')):
+            by_dimension = counts.setdefault(row['url_id'], {dimension: Counter() for dimension in dimensions})
+            for dimension in dimensions:
+                by_dimension[dimension][row[dimension] or ''] += row['count']
+        return counts
+
+    def top_value_by_url(self, dimension):
+        """The most clicked value of a rolled up dimension per URL, as {url_id: (value, count)}."""
+        return {
+            url_id: by_dimension[dimension].most_common(1)[0]
+            for url_id, by_dimension in self.dimension_counts_by_url([dimension]).items()
+            if by_dimension[dimension]
+        }
+
+    def histogram(self, since):
+        """
+        Build every click breakdown in five queries.
+
+        One grouped query covers all daily dimension rollups, one the daily
+        totals since the given time, one the hourly totals and one the
+        heavy-hitter sketches since that day, and one sums the raw tail by
+        hour and click attributes, so clicks that share them come back as a
+        single row.
+        """
+        histogram = ClickHistogram(since)
+
+        daily = self.rollups.filter(granularity='day')
+        for row in daily.exclude(dimension='total').values(
+            'dimension', 'value', 'parent_value'
+        ).annotate(count=Sum('clicks')).order_by():
+            histogram.by_dimension[row['dimension']][(row['value'], row['parent_value'])] += row['count']
+
+        for row in daily.filter(dimension='total', bucket__gte=_day_start(since)).values(
+            'bucket'
+        ).annotate(count=Sum('clicks')).order_by():
+            histogram.by_date[row['bucket'].date()] += row['count']
+
+        for row in self.rollups.filter(granularity='hour', dimension='total').annotate(
+            hour=ExtractHour('bucket')
+        ).values('hour').annotate(count=Sum('clicks'), variance=Sum('variance')).order_by():
+            histogram.by_hour[row['hour']] += row['count']
+            histogram.variance += row['variance']
+
+        summaries = HeavyHitterSketch.summaries(HEAVY_HITTER_DIMENSIONS, since=timezone.localdate(since), **self.url_filter)
+        for dimension, summary in summaries.items():
+            histogram.heavy_hitters[dimension].append(summary)
+
+        tail = self.tail.annotate(
+            hour=TruncHour('timestamp'),
+            in_window=Case(When(timestamp__gte=since, then=Value(True)), default=Value(False), output_field=BooleanField())
+        ).attribute_values('hour', 'in_window', *ClickHistogram.ATTRIBUTE_FIELDS).annotate(**WEIGHTED_CLICKS).order_by()
+        for group in tail.iterator():
+            histogram.add_click_group(group)
+
+        return histogram
@@ -0,0 +1,90 @@
+"""
+Adaptive sampling of raw clicks on very busy links.
+
+Each link's click rate is counted per minute in the cache. While a link
+stays under CLICK_SAMPLING_THRESHOLD clicks a minute every click is stored;
+above it only every Nth click is, with N the smallest power of two that
+brings the stored rate back under the threshold, and the stored row gets
+weight N. The link's access counter and hourly click counts still count
+every click exactly.
+
+Aggregations sum weights instead of counting rows, which is an unbiased
+estimate of the true click count. Each stored click of weight w adds
+w * (w - 1) to the estimate's variance (the Horvitz-Thompson bound), which
+is kept alongside the counts so responses can say how precise they are.
+"""
+import math
+import time
+
+from django.core.cache import cache
+
+# Clicks per minute a link can get before its raw clicks are sampled
+CLICK_SAMPLING_THRESHOLD = 600
+
+CLICK_SAMPLING_WINDOW = 60
+
+# Never store fewer than 1 in this many clicks
+MAX_CLICK_SAMPLE_RATE = 1024
+
+# z-score of the reported margins of error
+CONFIDENCE_LEVEL = 0.95
+CONFIDENCE_Z = 1.96
+
+
+def _rate_key(url_id, window):
+    return f"click_rate_{url_id}_{window}"
+
+
+def sample_rate_for(clicks_per_window):
+    """1-in-N rate at which a link getting this many clicks per window stores its clicks."""
+    if clicks_per_window <= CLICK_SAMPLING_THRESHOLD:
+        return 1
+    rate = 2 ** math.ceil(math.log2(clicks_per_window / CLICK_SAMPLING_THRESHOLD))
+    return min(rate, MAX_CLICK_SAMPLE_RATE)
+
+
+def current_sample_rate(url_id):
+    """The rate a link's clicks are being stored at right now, without counting a click."""
+    window = int(time.time() // CLICK_SAMPLING_WINDOW)
+    counts = cache.get_many([_rate_key(url_id, window - 1), _rate_key(url_id, window)])
+    return sample_rate_for(max(counts.values(), default=0))
+
+
+def sample_click(url_id):
+    """
+    Count a click towards its link's rate and decide whether to store it.
+
+    Returns the weight to store the click with, or None if it should only
+    be counted.
+    """
+    window = int(time.time() // CLICK_SAMPLING_WINDOW)
+    key = _rate_key(url_id, window)
+    # Kept for the next window, which bases its rate on this one
+    if cache.add(key, 1, CLICK_SAMPLING_WINDOW * 2):
+        position = 1
+    else:
+        try:
+            position = cache.incr(key)
+        except ValueError:
+            # Expired between the add and the incr
+            cache.set(key, 1, CLICK_SAMPLING_WINDOW * 2)
+            position = 1
+
+    previous = cache.get(_rate_key(url_id, window - 1), 0)
+    rate = sample_rate_for(max(previous, position))
+    # Systematic sampling: every Nth click of the window is stored
+    if position % rate:
+        return None
+    return rate
+
+
+def click_estimate(estimate, variance):
+    """Describe a weighted click count and the precision of the estimate."""
+    margin = round(CONFIDENCE_Z * math.sqrt(variance)) if variance > 0 else 0
+    return {
+        'sampled': variance > 0,
+        'estimated_clicks': estimate,
+        'margin_of_error': margin,
+        'relative_error': round(margin / estimate * 100, 2) if estimate > 0 else 0,
+        'confidence_level': CONFIDENCE_LEVEL,
+    }
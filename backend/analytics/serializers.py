@@ -0,0 +1,40 @@
+from rest_framework import serializers
+from .models import AnalyticsReportJob, ClickExportJob
+
+
+class ClickExportJobSerializer(serializers.ModelSerializer):
+    """Serializer for click export jobs."""
+    
+    download_url = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = ClickExportJob
+        fields = [
+            'id', 'url', 'file_format', 'columns', 'start_date', 'end_date', 'status',
+            'row_count', 'error', 'created_at', 'completed_at', 'download_url'
+        ]
+        read_only_fields = fields
+    
+    def get_download_url(self, obj):
+        if obj.status != 'completed':
+            return None
+        return f"/api/click-exports/{obj.id}/download/"
+
+
+class AnalyticsReportJobSerializer(serializers.ModelSerializer):
+    """Serializer for analytics report jobs."""
+    
+    download_url = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = AnalyticsReportJob
+        fields = [
+            'id', 'url_ids', 'file_format', 'start_date', 'end_date', 'status',
+            'error', 'created_at', 'completed_at', 'download_url'
+        ]
+        read_only_fields = fields
+    
+    def get_download_url(self, obj):
+        if obj.status != 'completed':
+            return None
+        return f"/api/analytics-reports/{obj.id}/download/"
@@ -0,0 +1,82 @@
+import logging
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .archive import archive_clicks
+from .export import run_export_job
+from .funnel import apply_funnel_events
+from .models import AnalyticsReportJob, ClickExportJob, VisitorSketch
+from .reports import run_report_job
+from .rollups import compact_click_rollups
+from .visitors import flush_session_visits
+
+logger = logging.getLogger(__name__)
+
+# Try to import Celery, but don't fail if it's not available
+try:
+    from celery import shared_task
+    CELERY_AVAILABLE = True
+except ImportError:
+    CELERY_AVAILABLE = False
+    # Create a dummy decorator for when Celery is not available
+    def shared_task(func):
+        return func
+
+@shared_task
+def compact_click_rollups_task():
+    """
+    Celery task to fold new clicks into the click rollups.
+    This task should be scheduled to run periodically, e.g. every few minutes.
+    """
+    folded = compact_click_rollups()
+    return f"Folded {folded} clicks into rollups"
+
+@shared_task
+def flush_session_visits_task():
+    """
+    Celery task to write the repeat session visits buffered in the cache.
+    This task should be scheduled to run every minute.
+    """
+    updated = flush_session_visits()
+    return f"Updated {updated} sessions"
+
+@shared_task
+def merge_site_visitor_sketches_task():
+    """
+    Celery task to rebuild today's and yesterday's site-wide unique visitor sketches.
+    This task should be scheduled to run every few minutes.
+    """
+    today = timezone.localdate()
+    for day in (today - timedelta(days=1), today):
+        VisitorSketch.merge_site_sketch(day)
+    return "Merged site-wide visitor sketches"
+
+@shared_task
+def archive_clicks_task():
+    """
+    Celery task to move raw clicks older than the retention period to cold storage.
+    This task should be scheduled to run daily.
+    """
+    days, exported = archive_clicks()
+    return f"Archived {exported} clicks from {days} days"
+
+@shared_task
+def run_click_export_task(job_id):
+    """Celery task to write a click export job's file."""
+    job = ClickExportJob.objects.select_related('user', 'url').get(pk=job_id)
+    run_export_job(job)
+    return f"Click export {job_id} finished"
+
+@shared_task
+def apply_funnel_events_task(events):
+    """Celery task to apply a buffered batch of funnel events."""
+    applied, unknown_short_codes = apply_funnel_events([tuple(event) for event in events])
+    return f"Applied {applied} funnel events"
+
+@shared_task
+def run_analytics_report_task(job_id):
+    """Celery task to write an analytics report job's file."""
+    job = AnalyticsReportJob.objects.select_related('user').get(pk=job_id)
+    run_report_job(job)
+    return f"Analytics report {job_id} finished"
@@ -1,3 +1,970 @@
-from django.test import TestCase
+import io
+import json
+import tempfile
+import time
+import zipfile
+from collections import Counter
+from datetime import timedelta
 
-# Create your tests here.
+from unittest import mock
+
+import openpyxl
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db.models import Sum
+from django.test import Client, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from authentication.models import User
+from shortener.models import ABTestVariant, ShortenedURL
+from . import cache as analytics_cache
+from .archive import archive_clicks, archived_last_id, read_archived_clicks
+from .cohorts import cohort_window_start
+from .heavy_hitters import HEAVY_HITTER_CAPACITY, SpaceSaving
+from .hyperloglog import HyperLogLog, STANDARD_ERROR
+from .dimensions import clear_dimension_caches, location_dimension, referrer_dimension, user_agent_dimension
+from .models import (
+    AnalyticsReportJob, ClickEvent, ClickRollup, HeavyHitterSketch, RollupWatermark, UserAgent, UserSession, VisitorSketch
+)
+from .reports import run_report_job
+from .rollups import CLICK_ROLLUP_WATERMARK, compact_click_rollups
+from .sampling import CLICK_SAMPLING_THRESHOLD, sample_click, sample_rate_for
+from .visitors import SESSION_FLUSH_INTERVAL, VISITOR_COOKIE, flush_session_visits
+
+
+@override_settings(SHARED_CACHE=True)
+class AnalyticsTestCase(TestCase):
+    """A URL owner with an authenticated client and helpers for click history."""
+
+    def setUp(self):
+        # Cached results, cache versions and dimension rows outlive each test's database rollback
+        cache.clear()
+        clear_dimension_caches()
+        self.user = User.objects.create_user(
+            email='owner@example.com', password='password', first_name='Link', last_name='Owner'
+        )
+        self.url = ShortenedURL.objects.create(original_url='https://example.com', user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def agent(self, browser):
+        """A user agent parsed as the given browser on an iOS device."""
+        user_agent = f'{browser} (iOS)'
+        return UserAgent.objects.get_or_create(user_agent_hash=UserAgent.hash(user_agent), defaults={
+            'user_agent': user_agent, 'browser': browser or '', 'device': 'Other', 'os': 'iOS'
+        })[0]
+
+    def add_history(self, count):
+        now = timezone.now()
+        agents = [self.agent('Chrome'), self.agent('Safari'), self.agent(None)]
+        locations = [location_dimension('US', 'Berlin'), location_dimension('DE', 'Berlin')]
+        referrer = referrer_dimension('https://example.org')
+        ClickEvent.objects.bulk_create([
+            ClickEvent(
+                url=self.url,
+                timestamp=now - timedelta(hours=i),
+                ip_address=f'10.0.0.{i % 250}',
+                agent=agents[i % 3],
+                location=locations[i % 2],
+                referral=referrer if i % 4 else None
+            )
+            for i in range(count)
+        ])
+        UserSession.objects.bulk_create([
+            UserSession(
+                url=self.url,
+                session_id=f'session-{count}-{i}',
+                first_visit=now - timedelta(days=i),
+                last_visit=now,
+                visit_count=1 + i % 3,
+                reached_destination=i % 2 == 0
+            )
+            for i in range(count // 10)
+        ])
+
+    def get_analytics(self, query='', endpoint=''):
+        # A distinct query string per request keeps conditional GETs out of the picture
+        response = self.client.get(f'/api/analytics/{self.url.id}/{endpoint}{query}')
+        self.assertEqual(response.status_code, 200)
+        return response
+
+
+class AnalyticsRetrieveQueryCountTests(AnalyticsTestCase):
+    """AnalyticsViewSet.retrieve must issue a fixed number of queries, however much history a URL has."""
+
+    # Owner lookup, URL, user, watermark, 3 rollup aggregates, heavy-hitter sketches, raw tail,
+    # unique IPs, session aggregate, 3 serializer relations, recent clicks, return visit distribution
+    RETRIEVE_QUERIES = 16
+
+    # As above without the watermark, rollup, sketch and unique IP queries, and with
+    # the recent clicks taken from the single streamed pass
+    STREAM_RETRIEVE_QUERIES = 9
+
+    def test_query_count_is_constant(self):
+        self.add_history(50)
+        with self.assertNumQueries(self.RETRIEVE_QUERIES):
+            self.get_analytics('?a')
+
+        self.add_history(500)
+        with self.assertNumQueries(self.RETRIEVE_QUERIES):
+            self.get_analytics('?b')
+
+    def test_query_count_with_rollups(self):
+        self.add_history(200)
+        ClickEvent.objects.update(timestamp=timezone.now() - timedelta(days=1))
+        compact_click_rollups()
+        with self.assertNumQueries(self.RETRIEVE_QUERIES):
+            response = self.get_analytics()
+        self.assertEqual(sum(row['count'] for row in response.data['clicks_by_browser']), 200)
+        self.assertEqual(response.data['clicks_by_referrer'], [{'referrer': 'https://example.org', 'count': 150}])
+        self.assertCountEqual(
+            response.data['clicks_by_city'],
+            [{'city': 'Berlin', 'country': 'US', 'count': 100}, {'city': 'Berlin', 'country': 'DE', 'count': 100}]
+        )
+
+    def test_top_value_panels_cover_the_window(self):
+        self.add_history(20)
+        ClickEvent.objects.update(timestamp=timezone.now() - timedelta(days=40))
+        compact_click_rollups()
+        data = self.get_analytics().data
+
+        # Exact rollups count all time, heavy-hitter sketches only the window
+        self.assertEqual(sum(row['count'] for row in data['clicks_by_browser']), 20)
+        self.assertEqual(data['clicks_by_city'], [])
+        self.assertEqual(data['window']['since'], timezone.localdate() - timedelta(days=30))
+        self.assertIn('clicks_by_city', data['window']['fields'])
+        self.assertNotIn('clicks_by_browser', data['window']['fields'])
+
+    def test_stream_mode_matches_rollups(self):
+        self.add_history(120)
+        rollup_data = self.get_analytics('?mode=rollup').json()
+        with self.assertNumQueries(self.STREAM_RETRIEVE_QUERIES):
+            stream_data = self.get_analytics('?mode=stream').json()
+
+        for key in ('clicks_by_hour', 'clicks_by_browser', 'clicks_by_device', 'clicks_by_os',
+                    'clicks_by_referrer', 'clicks_by_city', 'clicks_by_user_agent', 'retention', 'sampling'):
+            self.assertEqual(stream_data[key], rollup_data[key], key)
+        self.assertEqual(stream_data['recent_clicks'], rollup_data['recent_clicks'])
+
+    def test_avg_return_time_is_computed_in_database(self):
+        now = timezone.now()
+        UserSession.objects.create(url=self.url, session_id='a', first_visit=now - timedelta(hours=2), last_visit=now, visit_count=2)
+        UserSession.objects.create(url=self.url, session_id='b', first_visit=now - timedelta(hours=4), last_visit=now, visit_count=3)
+        UserSession.objects.create(url=self.url, session_id='c', first_visit=now - timedelta(hours=9), last_visit=now, visit_count=1)
+
+        retention = self.get_analytics().data['retention']
+        self.assertEqual(retention['avg_return_time_hours'], 3.0)
+        self.assertEqual(retention['total_sessions'], 3)
+
+
+class AnalyticsResultCacheTests(AnalyticsTestCase):
+    """Analytics results are computed once per key and shared until new clicks make them stale."""
+
+    def test_repeat_views_are_served_from_cache(self):
+        self.add_history(100)
+        first = self.get_analytics().json()
+        # Only the owner lookup for the permission check remains
+        with self.assertNumQueries(1):
+            second = self.get_analytics().json()
+        self.assertEqual(first, second)
+        self.assertEqual(analytics_cache.get_analytics_cache_stats(['retrieve'])['retrieve']['hits'], 1)
+
+    def test_new_clicks_refresh_after_the_minimum_age(self):
+        self.get_analytics()
+        self.url.increment_counter()
+
+        # Too soon: the previous result is still served
+        self.assertEqual(self.get_analytics().data['total_clicks'], 0)
+        with mock.patch.object(analytics_cache, 'ANALYTICS_CACHE_MIN_AGE', 0):
+            self.assertEqual(self.get_analytics().data['total_clicks'], 1)
+
+    def test_outdated_results_are_sent_without_an_etag(self):
+        path = f'/api/analytics/{self.url.id}/'
+        first = self.client.get(path)
+        self.url.increment_counter()
+
+        # The previous result is still served, but not under the ETag of the new clicks
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_clicks'], 0)
+        self.assertNotIn('ETag', response)
+
+        with mock.patch.object(analytics_cache, 'ANALYTICS_CACHE_MIN_AGE', 0):
+            response = self.client.get(path)
+        self.assertEqual(response.data['total_clicks'], 1)
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    @override_settings(SHARED_CACHE=False)
+    def test_results_are_computed_without_a_shared_cache(self):
+        path = f'/api/analytics/{self.url.id}/'
+        first = self.client.get(path)
+        self.assertNotIn('ETag', first)
+
+        # A click handled by another process bumps no version this process could see
+        with mock.patch('shortener.signals.bump_user_cache_version'):
+            self.url.increment_counter()
+        for path in (path, '/api/analytics/dashboard/'):
+            response = self.client.get(path, HTTP_IF_NONE_MATCH='*')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['total_clicks'], 1)
+            self.assertNotIn('ETag', response)
+
+    def test_only_one_worker_computes_a_key(self):
+        self.get_analytics()
+        self.url.increment_counter()
+
+        # Another worker holds the lock for the stale key, so the previous value is served
+        with mock.patch.object(analytics_cache, 'ANALYTICS_CACHE_MIN_AGE', 0), \
+                mock.patch.object(analytics_cache.cache, 'add', return_value=False):
+            with self.assertNumQueries(1):
+                self.assertEqual(self.get_analytics().data['total_clicks'], 0)
+        self.assertEqual(analytics_cache.get_analytics_cache_stats(['retrieve'])['retrieve']['stale_hits'], 1)
+
+
+class ClickSamplingTests(AnalyticsTestCase):
+    """Busy links store 1 in N clicks with weight N, and analytics sum the weights."""
+
+    def test_sample_rate_follows_click_rate(self):
+        self.assertEqual(sample_rate_for(CLICK_SAMPLING_THRESHOLD), 1)
+        self.assertEqual(sample_rate_for(CLICK_SAMPLING_THRESHOLD + 1), 2)
+        self.assertEqual(sample_rate_for(CLICK_SAMPLING_THRESHOLD * 5), 8)
+
+    def test_busy_links_store_every_nth_click(self):
+        self.assertEqual([sample_click(self.url.id) for i in range(3)], [1, 1, 1])
+
+        with mock.patch('analytics.sampling.CLICK_SAMPLING_THRESHOLD', 1):
+            weights = [sample_click(self.url.id) for i in range(13)]
+        # Clicks 4 to 16 of the window: the rate doubles as the window's count does
+        self.assertEqual([weight for weight in weights if weight], [4, 8, 16])
+
+    def test_breakdowns_sum_weights(self):
+        now = timezone.now() - timedelta(hours=1)
+        referrer = referrer_dimension('https://example.org')
+        ClickEvent.objects.bulk_create([
+            ClickEvent(url=self.url, timestamp=now, agent=self.agent(browser), referral=referrer, weight=weight)
+            for browser, weight in [('Chrome', 1), ('Chrome', 8), ('Safari', 8)]
+        ])
+        ClickEvent.objects.create(url=self.url, timestamp=now - timedelta(days=1), agent=self.agent('Safari'), weight=8)
+        compact_click_rollups()
+        ClickEvent.objects.create(url=self.url, agent=self.agent('Chrome'), weight=4)
+
+        data = self.get_analytics().data
+        self.assertEqual(data['clicks_by_browser'], [{'browser': 'Safari', 'count': 16}, {'browser': 'Chrome', 'count': 13}])
+        self.assertEqual(data['clicks_by_referrer'], [{'referrer': 'https://example.org', 'count': 17}])
+        self.assertTrue(data['sampling']['sampled'])
+        self.assertEqual(data['sampling']['estimated_clicks'], 29)
+        self.assertEqual(data['sampling']['margin_of_error'], round(1.96 * (3 * 8 * 7 + 4 * 3) ** 0.5))
+
+
+@override_settings(CLICK_DEDUP_WINDOW=0, SHARED_CACHE=True)
+class VisitorSessionTests(AnalyticsTestCase):
+    """Repeat clicks by a visitor reuse their session on the URL instead of inserting new ones."""
+
+    def click(self, visitor, **headers):
+        response = visitor.get(f'/s/{self.url.short_code}/', **headers)
+        self.assertEqual(response.status_code, 302)
+        return response
+
+    def later(self):
+        """A time at which the current interval's visits are due to be written."""
+        return time.time() + 2 * SESSION_FLUSH_INTERVAL
+
+    def test_cookie_visitors_get_one_session(self):
+        visitor = Client()
+        self.click(visitor)
+        self.assertIn(VISITOR_COOKIE, visitor.cookies)
+        for i in range(4):
+            self.assertNotIn(VISITOR_COOKIE, self.click(visitor).cookies)
+
+        self.assertEqual(UserSession.objects.count(), 1)
+        # Repeat visits are only counted once their interval has ended and been written
+        self.assertEqual(flush_session_visits(), 0)
+        self.assertEqual(UserSession.objects.get().visit_count, 1)
+        self.assertEqual(flush_session_visits(self.later()), 1)
+        self.assertEqual(flush_session_visits(self.later()), 0)
+        session = UserSession.objects.get()
+        self.assertEqual(session.visit_count, 5)
+        self.assertEqual(ClickEvent.objects.filter(session_id=session.session_id).count(), 5)
+
+    def test_visitors_without_cookies_fall_back_to_ip_and_user_agent(self):
+        for i in range(3):
+            self.click(Client(), HTTP_USER_AGENT='Browser/1.0')
+        self.click(Client(), HTTP_USER_AGENT='Browser/2.0')
+        flush_session_visits(self.later())
+
+        self.assertEqual(sorted(UserSession.objects.values_list('visit_count', flat=True)), [1, 3])
+
+    @override_settings(SHARED_CACHE=False)
+    def test_visits_are_written_at_once_without_a_shared_cache(self):
+        visitor = Client()
+        for i in range(3):
+            self.click(visitor)
+
+        self.assertEqual(UserSession.objects.get().visit_count, 3)
+        self.assertEqual(flush_session_visits(self.later()), 0)
+
+
+class ClickDedupTests(AnalyticsTestCase):
+    """Bursts of identical clicks are counted once and skip the analytics writes."""
+
+    def click(self, **headers):
+        response = Client().get(f'/s/{self.url.short_code}/', **headers)
+        self.assertEqual(response.status_code, 302)
+
+    def test_identical_clicks_are_suppressed(self):
+        for i in range(3):
+            self.click(HTTP_USER_AGENT='Unfurler/1.0')
+        self.click(HTTP_USER_AGENT='Browser/1.0')
+
+        self.url.refresh_from_db()
+        self.assertEqual(self.url.access_count, 2)
+        self.assertEqual(self.url.suppressed_clicks, 2)
+        self.assertEqual(ClickEvent.objects.count(), 2)
+        self.assertEqual(UserSession.objects.count(), 2)
+        self.assertEqual(self.get_analytics().data['suppressed_clicks'], 2)
+
+    def test_clicks_after_the_window_are_counted(self):
+        with mock.patch('analytics.dedup.time.time', return_value=1000.0):
+            self.click()
+        with mock.patch('analytics.dedup.time.time', return_value=1003.0):
+            self.click()
+        with mock.patch('analytics.dedup.time.time', return_value=1006.0):
+            self.click()
+
+        self.url.refresh_from_db()
+        self.assertEqual((self.url.access_count, self.url.suppressed_clicks), (2, 1))
+
+    @override_settings(CLICK_DEDUP_WINDOW=0)
+    def test_window_of_zero_counts_every_click(self):
+        for i in range(3):
+            self.click()
+        self.url.refresh_from_db()
+        self.assertEqual((self.url.access_count, self.url.suppressed_clicks), (3, 0))
+
+
+class ClickDimensionTests(AnalyticsTestCase):
+    """Click attributes are stored once per distinct value and looked up through a process cache."""
+
+    USER_AGENT = (
+        'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 '
+        '(KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1'
+    )
+
+    def test_user_agents_are_parsed_once(self):
+        agent = user_agent_dimension(self.USER_AGENT)
+        self.assertEqual((agent.browser, agent.os, agent.device), ('Mobile Safari', 'iOS', 'iPhone'))
+
+        with mock.patch('analytics.dimensions.parse') as parse:
+            with self.assertNumQueries(0):
+                self.assertEqual(user_agent_dimension(self.USER_AGENT).pk, agent.pk)
+            # Known to the database but not to this process
+            clear_dimension_caches()
+            self.assertEqual(user_agent_dimension(self.USER_AGENT).pk, agent.pk)
+        parse.assert_not_called()
+
+    def test_clicks_read_attributes_from_dimensions(self):
+        berlin = location_dimension('DE', 'Berlin')
+        ClickEvent.objects.create(
+            url=self.url, agent=user_agent_dimension(self.USER_AGENT), location=berlin,
+            referral=referrer_dimension('https://example.org/post')
+        )
+        self.assertEqual(location_dimension('DE', 'Berlin'), berlin)
+        self.assertEqual(list(ClickEvent.objects.attribute_values('browser', 'city', 'referrer')), [
+            {'browser': 'Mobile Safari', 'city': 'Berlin', 'referrer': 'https://example.org/post'}
+        ])
+
+    def test_refused_redirects_store_no_user_agent(self):
+        self.url.is_active = False
+        self.url.save()
+        response = Client().get(f'/s/{self.url.short_code}/', HTTP_USER_AGENT=self.USER_AGENT)
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(UserAgent.objects.exists())
+
+
+class RetentionFunnelQueryCountTests(AnalyticsTestCase):
+    """Retention and funnel cost a fixed number of queries whatever the history or window."""
+
+    # Owner lookup, URL, user, visit bucket aggregate, period aggregate, 3 serializer relations
+    RETENTION_QUERIES = 8
+
+    # Owner lookup, URL, user, stage aggregate, watermark, daily rollups,
+    # daily raw tail, daily stage counts, 3 serializer relations
+    FUNNEL_QUERIES = 11
+
+    def test_retention_query_count_is_constant(self):
+        self.add_history(50)
+        with self.assertNumQueries(self.RETENTION_QUERIES):
+            self.get_analytics('?a', endpoint='retention/')
+
+        self.add_history(1000)
+        with self.assertNumQueries(self.RETENTION_QUERIES):
+            data = self.get_analytics('?b', endpoint='retention/').data
+        self.assertEqual(data['total_sessions'], 105)
+        self.assertEqual(sum(data['return_visit_counts'].values()), 105)
+
+    def test_funnel_query_count_does_not_depend_on_window(self):
+        self.add_history(2000)
+        for days in (7, 30, 365):
+            with self.assertNumQueries(self.FUNNEL_QUERIES):
+                self.get_analytics(f'?days={days}', endpoint='funnel/')
+
+    def test_daily_funnel_matches_per_day_counts(self):
+        self.add_history(300)
+        daily_funnel = self.get_analytics('?days=30', endpoint='funnel/').data['daily_funnel']
+        self.assertTrue(daily_funnel)
+
+        sessions = UserSession.objects.filter(url=self.url)
+        for day in daily_funnel:
+            self.assertEqual(
+                day['reached_destination'],
+                sessions.filter(reached_destination=True, last_visit__date=day['date']).count()
+            )
+            self.assertEqual(
+                day['clicks'],
+                ClickEvent.objects.filter(url=self.url, timestamp__date=day['date']).count()
+            )
+
+
+class CohortRetentionTests(AnalyticsTestCase):
+    """The cohort matrix counts each cohort's sessions still returning k weeks after their first visit."""
+
+    def test_matrix_matches_session_counts(self):
+        start = cohort_window_start(4)
+        for i, (cohort, weeks_retained) in enumerate([(0, 0), (0, 1), (0, 3), (1, 2), (2, 0), (2, 1)]):
+            first_visit = start + timedelta(weeks=cohort, hours=1)
+            UserSession.objects.create(
+                url=self.url, session_id=f'cohort-{i}', visit_count=2, first_visit=first_visit,
+                last_visit=first_visit + timedelta(weeks=weeks_retained, hours=1)
+            )
+
+        data = self.get_analytics('?weeks=4', endpoint='cohorts/').data
+        self.assertEqual(data['total_sessions'], 6)
+        self.assertEqual([cohort['sessions'] for cohort in data['cohorts']], [3, 1, 2, 0])
+        self.assertEqual(data['cohorts'][0]['retained'], [3, 2, 1, 1])
+        self.assertEqual(data['cohorts'][1]['retained'], [1, 1, 1, None])
+        self.assertEqual(data['cohorts'][2]['retention_rates'], [100.0, 50.0, None, None])
+        self.assertEqual(data['cohorts'][0]['avg_visits'], 2.0)
+        self.assertEqual(data['average_retention_rates'][1], round(4 / 6 * 100, 2))
+
+    def test_invalid_window_is_rejected(self):
+        response = self.client.get(f'/api/analytics/{self.url.id}/cohorts/?weeks=0')
+        self.assertEqual(response.status_code, 400)
+
+
+class AnalyticsSummaryTests(AnalyticsTestCase):
+    """Batch summaries cost a fixed number of queries however many links they cover."""
+
+    # URLs, watermark, daily rollups, daily raw tail, country rollups, country raw tail,
+    # locations, visitor sketches
+    SUMMARY_QUERIES = 8
+
+    def get_summaries(self, query):
+        response = self.client.get(f'/api/analytics/summaries/{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.data['summaries']
+
+    def test_query_count_does_not_depend_on_links(self):
+        self.add_history(100)
+        other = ShortenedURL.objects.create(original_url='https://example.com/other', user=self.user)
+        ClickEvent.objects.update(timestamp=timezone.now() - timedelta(days=1))
+        compact_click_rollups()
+        ClickEvent.objects.create(url=other, location=location_dimension('FR', 'Paris'))
+
+        with self.assertNumQueries(self.SUMMARY_QUERIES):
+            summaries = self.get_summaries(f'?ids={other.id},{self.url.id}')
+        self.assertEqual([summary['id'] for summary in summaries], [other.id, self.url.id])
+        self.assertEqual(summaries[0]['top_country'], {'country': 'FR', 'count': 1})
+        self.assertEqual(summaries[0]['clicks_by_date'][-1]['count'], 1)
+        self.assertEqual(summaries[1]['clicks_last_7d'], 100)
+        self.assertEqual(summaries[1]['top_country']['count'], 50)
+        self.assertEqual(len(summaries[1]['clicks_by_date']), 7)
+
+        for i in range(5):
+            ShortenedURL.objects.create(original_url=f'https://example.com/{i}', user=self.user)
+        with self.assertNumQueries(self.SUMMARY_QUERIES):
+            self.assertEqual(len(self.get_summaries('?search=example.com')), 7)
+
+    def test_links_of_other_users_are_not_found(self):
+        stranger = User.objects.create_user(email='stranger@example.com', password='password')
+        theirs = ShortenedURL.objects.create(original_url='https://example.com', user=stranger)
+        response = self.client.get(f'/api/analytics/summaries/?ids={self.url.id},{theirs.id}')
+        self.assertEqual(response.status_code, 404)
+
+
+class AnalyticsCompareTests(AnalyticsTestCase):
+    """Comparing links costs a fixed number of queries and lines every series up across them."""
+
+    # URLs, watermark, daily rollups, daily raw tail, dimension rollups,
+    # dimension raw tail, user agents, locations, A/B variants
+    COMPARE_QUERIES = 9
+
+    def test_links_are_compared_in_fixed_queries(self):
+        self.add_history(60)
+        ClickEvent.objects.update(timestamp=timezone.now() - timedelta(days=1))
+        compact_click_rollups()
+        other = ShortenedURL.objects.create(original_url='https://example.com/other', user=self.user, is_ab_test=True)
+        ClickEvent.objects.create(url=other, agent=self.agent('Firefox'), location=location_dimension('FR', 'Paris'))
+        ABTestVariant.objects.create(shortened_url=other, destination_url='https://example.com/a', access_count=4, conversion_count=1)
+
+        urls = [self.url.id, other.id]
+        for i in range(3):
+            urls.append(ShortenedURL.objects.create(original_url=f'https://example.com/{i}', user=self.user).id)
+            with self.assertNumQueries(self.COMPARE_QUERIES):
+                response = self.client.get(f"/api/analytics/compare/?days=7&ids={','.join(map(str, urls))}")
+            self.assertEqual(response.status_code, 200)
+
+        data = response.data
+        self.assertEqual(len(data['dates']), 7)
+        mine, theirs = data['urls'][:2]
+        self.assertEqual(mine['clicks'], 60)
+        self.assertEqual(theirs['clicks_by_date'][-1], 1)
+        self.assertEqual(dict(zip(data['dimensions']['browser'], mine['clicks_by_browser'])), {
+            'Chrome': 20, 'Safari': 20, None: 20, 'Firefox': 0
+        })
+        self.assertEqual(dict(zip(data['dimensions']['country'], theirs['clicks_by_country'])), {
+            'US': 0, 'DE': 0, 'FR': 1
+        })
+        self.assertEqual(theirs['variants'][0]['conversion_rate'], 25.0)
+        self.assertEqual(mine['variants'], [])
+
+    def test_number_of_links_is_checked(self):
+        response = self.client.get(f'/api/analytics/compare/?ids={self.url.id}')
+        self.assertEqual(response.status_code, 400)
+
+
+class ClickExportTests(AnalyticsTestCase):
+    """Exports stream raw and archived clicks of the requested links only."""
+
+    def setUp(self):
+        super().setUp()
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        settings_override = override_settings(CLICK_ARCHIVE_DIR=archive_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def export(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def archive_history(self, count):
+        """Add clicks five days old and move them to the archive."""
+        self.add_history(count)
+        ClickEvent.objects.update(timestamp=timezone.now() - timedelta(days=5))
+        archive_clicks(retention_days=1)
+
+    def test_csv_with_selected_columns(self):
+        self.add_history(6)
+        lines = self.export(f'/api/analytics/{self.url.id}/export/?columns=short_code,browser,country').splitlines()
+        self.assertEqual(lines[0], 'short_code,browser,country')
+        self.assertEqual(len(lines), 7)
+        self.assertEqual(Counter(line.split(',')[1] for line in lines[1:]), {'Chrome': 2, 'Safari': 2, '': 2})
+        self.assertTrue(all(line.startswith(f'{self.url.short_code},') for line in lines[1:]))
+
+    def test_ndjson_merges_archived_and_raw_clicks(self):
+        self.archive_history(4)
+        self.assertEqual(ClickEvent.objects.count(), 0)
+        ClickEvent.objects.create(url=self.url, ip_address='10.1.1.1')
+
+        lines = self.export(f'/api/analytics/{self.url.id}/export/?file_format=ndjson&columns=ip_address,weight')
+        clicks = [json.loads(line) for line in lines.splitlines()]
+        self.assertEqual(len(clicks), 5)
+        self.assertEqual(set(clicks[0]), {'ip_address', 'weight'})
+        # Archived clicks come first
+        self.assertEqual(clicks[-1]['ip_address'], '10.1.1.1')
+
+    def test_exports_never_include_other_users_archived_clicks(self):
+        self.archive_history(4)
+        stranger = User.objects.create_user(email='stranger@example.com', password='password')
+        client = APIClient()
+        client.force_authenticate(stranger)
+
+        # Without any links
+        response = client.get('/api/analytics/export/?file_format=ndjson')
+        self.assertEqual(b''.join(response.streaming_content), b'')
+
+        # With links of their own
+        ShortenedURL.objects.create(original_url='https://example.com/theirs', user=stranger)
+        response = client.get('/api/analytics/export/?file_format=ndjson')
+        self.assertEqual(b''.join(response.streaming_content), b'')
+
+    def test_export_jobs_are_left_for_a_worker(self):
+        self.add_history(3)
+        response = self.client.post('/api/click-exports/', {'url': self.url.id}, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], 'pending')
+
+        export_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(export_dir.cleanup)
+        with override_settings(CLICK_EXPORT_DIR=export_dir.name):
+            call_command('run_click_exports', stdout=io.StringIO())
+        job = self.client.get(f"/api/click-exports/{response.data['id']}/").data
+        self.assertEqual((job['status'], job['row_count']), ('completed', 3))
+
+
+class AnalyticsReportTests(AnalyticsTestCase):
+    """Reports are generated outside the request and reused by identical requests."""
+
+    def setUp(self):
+        super().setUp()
+        report_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(report_dir.cleanup)
+        settings_override = override_settings(ANALYTICS_REPORT_DIR=report_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def request_report(self, **data):
+        with mock.patch('analytics.views.start_report_job') as start_report_job:
+            response = self.client.post('/api/analytics-reports/', {'urls': [self.url.id], **data}, format='json')
+        return response, start_report_job
+
+    def test_report_is_queued_then_reused(self):
+        self.add_history(30)
+        response, start_report_job = self.request_report()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], 'pending')
+        start_report_job.assert_called_once()
+
+        run_report_job(AnalyticsReportJob.objects.get(pk=response.data['id']))
+        job = self.client.get(f"/api/analytics-reports/{response.data['id']}/").data
+        self.assertEqual(job['status'], 'completed')
+
+        download = self.client.get(job['download_url'])
+        self.assertEqual(download.status_code, 200)
+        workbook = openpyxl.load_workbook(io.BytesIO(b''.join(download.streaming_content)), read_only=True)
+        self.assertEqual(workbook.sheetnames, ['Summary', 'Daily clicks', 'Breakdowns', 'Raw sample'])
+        summary = list(workbook['Summary'].values)
+        self.assertEqual(summary[1][0], self.url.short_code)
+        self.assertEqual(summary[1][4], 30)
+        self.assertEqual(len(list(workbook['Raw sample'].values)), 31)
+        workbook.close()
+
+        response, start_report_job = self.request_report()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], job['id'])
+        start_report_job.assert_not_called()
+
+        # New clicks make a new report
+        self.url.increment_counter()
+        response, start_report_job = self.request_report()
+        self.assertEqual(response.status_code, 202)
+
+    def test_csv_report_is_a_zip_of_sheets(self):
+        self.add_history(10)
+        response, _ = self.request_report(file_format='csv')
+        run_report_job(AnalyticsReportJob.objects.get(pk=response.data['id']))
+        download = self.client.get(f"/api/analytics-reports/{response.data['id']}/download/")
+        with zipfile.ZipFile(io.BytesIO(b''.join(download.streaming_content))) as archive:
+            self.assertEqual(archive.namelist(), ['summary.csv', 'daily_clicks.csv', 'breakdowns.csv', 'raw_sample.csv'])
+            self.assertEqual(len(archive.read('raw_sample.csv').decode().splitlines()), 11)
+
+    def test_links_of_other_users_are_not_found(self):
+        stranger = User.objects.create_user(email='stranger@example.com', password='password')
+        theirs = ShortenedURL.objects.create(original_url='https://example.com', user=stranger)
+        response, start_report_job = self.request_report(urls=[theirs.id])
+        self.assertEqual(response.status_code, 404)
+        start_report_job.assert_not_called()
+
+
+class ClickLogTests(AnalyticsTestCase):
+    """The click log pages through clicks by (timestamp, id) at a fixed cost per page."""
+
+    # URL, user, page of clicks
+    PAGE_QUERIES = 3
+
+    def get_page(self, query):
+        response = self.client.get(f'/api/analytics/{self.url.id}/clicks/{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_pages_cover_every_click_once(self):
+        self.add_history(95)
+        # Clicks sharing a timestamp are told apart by id
+        ClickEvent.objects.filter(id__in=ClickEvent.objects.order_by('id').values('id')[:10]).update(
+            timestamp=timezone.now()
+        )
+
+        seen = []
+        cursor = ''
+        while True:
+            with self.assertNumQueries(self.PAGE_QUERIES):
+                page = self.get_page(f'?page_size=20&cursor={cursor}')
+            seen += [click['id'] for click in page['results']]
+            if page['next_cursor'] is None:
+                break
+            cursor = page['next_cursor']
+
+        self.assertEqual(len(seen), 95)
+        self.assertEqual(seen, list(ClickEvent.objects.order_by('-timestamp', '-id').values_list('id', flat=True)))
+
+    def test_filters(self):
+        self.add_history(40)
+        self.assertEqual(len(self.get_page('?country=DE&page_size=200')['results']), 20)
+        self.assertEqual(len(self.get_page('?browser=Chrome&ip_prefix=10.0.0.1')['results']), 3)
+        since = (timezone.now() - timedelta(hours=9, minutes=30)).isoformat()
+        self.assertEqual(len(self.get_page(f'?start={since.replace("+", "%2B")}')['results']), 10)
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get(f'/api/analytics/{self.url.id}/clicks/?cursor=nonsense')
+        self.assertEqual(response.status_code, 400)
+
+
+class FunnelBatchTests(AnalyticsTestCase):
+    """Batched funnel events cost a fixed number of queries however many there are."""
+
+    # Short codes, existing sessions, session insert, one update per step
+    BATCH_QUERIES = 5
+
+    def test_batch_sets_flags_and_creates_sessions(self):
+        other = ShortenedURL.objects.create(original_url='https://example.com/other', user=self.user)
+        UserSession.objects.create(url=self.url, session_id='existing')
+        events = [
+            {'short_code': self.url.short_code, 'session_id': 'existing', 'step': 'reached_destination'},
+            {'short_code': self.url.short_code, 'session_id': 'existing', 'step': 'completed_action'},
+            {'short_code': other.short_code, 'session_id': 'new', 'step': 'reached_destination'},
+            {'short_code': 'missing', 'session_id': 'new', 'step': 'completed_action'},
+        ]
+        events += [
+            {'short_code': other.short_code, 'session_id': f'session-{i}', 'step': 'completed_action'}
+            for i in range(50)
+        ]
+
+        with self.assertNumQueries(self.BATCH_QUERIES):
+            response = APIClient().post('/api/analytics/track_funnel/batch/', events, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['applied'], 53)
+        self.assertEqual(response.data['unknown_short_codes'], ['missing'])
+
+        existing = UserSession.objects.get(url=self.url, session_id='existing')
+        self.assertTrue(existing.reached_destination and existing.completed_action)
+        self.assertTrue(UserSession.objects.get(url=other, session_id='new').reached_destination)
+        self.assertEqual(UserSession.objects.filter(url=other, completed_action=True).count(), 50)
+
+    def test_beacon_payloads_are_accepted(self):
+        body = json.dumps({'events': [{'short_code': self.url.short_code, 'session_id': 'a', 'step': 'completed_action'}]})
+        response = APIClient().post('/api/analytics/track_funnel/batch/', body, content_type='text/plain')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(UserSession.objects.get(session_id='a').completed_action)
+
+    def test_invalid_steps_are_rejected(self):
+        events = [{'short_code': self.url.short_code, 'session_id': 'a', 'step': 'bought_a_boat'}]
+        response = APIClient().post('/api/analytics/track_funnel/batch/', events, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(UserSession.objects.exists())
+
+
+class VisitorSketchTests(TestCase):
+    """Unique visitor estimates from the daily HyperLogLog sketches."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='owner@example.com', password='password', first_name='Link', last_name='Owner'
+        )
+        self.urls = [
+            ShortenedURL.objects.create(original_url=f'https://example.com/{i}', user=self.user)
+            for i in range(2)
+        ]
+
+    def test_estimate_is_within_error_bounds(self):
+        sketch = HyperLogLog()
+        for i in range(50000):
+            sketch.add(f'visitor-{i}')
+        # Four standard errors; a failure here is a bug, not bad luck
+        self.assertAlmostEqual(sketch.count(), 50000, delta=50000 * 4 * STANDARD_ERROR)
+
+    def test_small_counts_use_linear_counting(self):
+        sketch = HyperLogLog()
+        for i in range(200):
+            sketch.add(f'10.0.{i // 256}.{i % 256}')
+            sketch.add(f'10.0.{i // 256}.{i % 256}')
+        self.assertAlmostEqual(sketch.count(), 200, delta=9)
+
+    def test_merge_matches_single_sketch(self):
+        combined, first, second = HyperLogLog(), HyperLogLog(), HyperLogLog()
+        for i in range(3000):
+            combined.add(i)
+            (first if i % 2 else second).add(i)
+        self.assertEqual(first.merge(second).registers, combined.registers)
+        self.assertEqual(HyperLogLog.from_bytes(combined.to_bytes()).registers, combined.registers)
+
+    def test_estimates_merge_across_days_and_links(self):
+        today = timezone.now()
+        yesterday = today - timedelta(days=1)
+        for i in range(100):
+            VisitorSketch.record_visitor(self.urls[0].id, self.user.id, f'192.0.2.{i}', today)
+            # The same visitors return the next day, plus some new ones on the other link
+            VisitorSketch.record_visitor(self.urls[0].id, self.user.id, f'192.0.2.{i}', yesterday)
+            VisitorSketch.record_visitor(self.urls[1].id, self.user.id, f'198.51.100.{i}', yesterday)
+
+        self.assertAlmostEqual(VisitorSketch.estimate(url_id=self.urls[0].id), 100, delta=5)
+        self.assertAlmostEqual(VisitorSketch.estimate(user_id=self.user.id), 200, delta=9)
+        self.assertAlmostEqual(VisitorSketch.estimate(start=timezone.localdate(today), user_id=self.user.id), 100, delta=5)
+        self.assertAlmostEqual(VisitorSketch.estimate(url_id__in=[url.id for url in self.urls]), 200, delta=9)
+        # One sketch per URL and per user for each day
+        self.assertEqual(VisitorSketch.objects.count(), 5)
+
+    def test_site_sketches_are_merged_off_the_click_path(self):
+        anonymous = ShortenedURL.objects.create(original_url='https://example.com/anonymous')
+        today = timezone.now()
+        VisitorSketch.record_visitor(self.urls[0].id, self.user.id, '192.0.2.1', today)
+        # A visitor the sketches have seen is checked against both in one query
+        with self.assertNumQueries(1):
+            VisitorSketch.record_visitor(self.urls[0].id, self.user.id, '192.0.2.1', today)
+        for i in range(100):
+            VisitorSketch.record_visitor(self.urls[i % 2].id, self.user.id, f'192.0.2.{i}', today)
+            VisitorSketch.record_visitor(anonymous.id, None, f'198.51.100.{i}', today)
+        self.assertEqual(VisitorSketch.estimate(), 0)
+
+        VisitorSketch.merge_site_sketch(timezone.localdate(today))
+        self.assertAlmostEqual(VisitorSketch.estimate(), 200, delta=9)
+        self.assertEqual(VisitorSketch.objects.filter(url__isnull=True, user__isnull=True).count(), 1)
+
+
+class HeavyHitterTests(TestCase):
+    """Space-Saving summaries keep the heavy hitters and bound their counts."""
+
+    def zipf_stream(self):
+        # Value i occurs 1000 // i times, so the first few dominate a long tail
+        return [(f'value-{i}', '') for i in range(1, 2000) for _ in range(max(1000 // i, 1))]
+
+    def test_bounds_hold_for_a_single_stream(self):
+        stream = self.zipf_stream()
+        summary = SpaceSaving(capacity=50)
+        for key in stream:
+            summary.add(key)
+
+        exact = Counter(stream)
+        for key, (count, error) in summary.counters.items():
+            self.assertLessEqual(count - error, exact[key])
+            self.assertGreaterEqual(count, exact[key])
+        # Anything above total / capacity must be monitored
+        for key, count in exact.items():
+            if count > len(stream) / 50:
+                self.assertIn(key, summary.counters)
+        self.assertEqual([value for value, parent, count in summary.top(3)], ['value-1', 'value-2', 'value-3'])
+
+    def test_merged_summaries_keep_their_bounds(self):
+        stream = self.zipf_stream()
+        parts = [stream[i::4] for i in range(4)]
+        summaries = [SpaceSaving.from_counts(Counter(part), capacity=50) for part in parts]
+        merged = SpaceSaving.merge_all(summaries, capacity=50)
+
+        exact = Counter(stream)
+        for key, (count, error) in merged.counters.items():
+            self.assertLessEqual(count - error, exact[key])
+            self.assertGreaterEqual(count, exact[key])
+        self.assertEqual([value for value, parent, count in merged.top(3)], ['value-1', 'value-2', 'value-3'])
+
+    def test_sketch_summaries_cover_the_window_with_guaranteed_counts(self):
+        user = User.objects.create_user(email='owner@example.com', password='password')
+        url = ShortenedURL.objects.create(original_url='https://example.com', user=user)
+        today = timezone.localdate()
+        # Full summaries whose floor of 1 could belong to any city they don't monitor
+        tail = {(f'city-{i}', 'DE'): 1 for i in range(HEAVY_HITTER_CAPACITY)}
+        for days_ago, berlin in ((0, 5), (1, 3), (40, 100)):
+            HeavyHitterSketch.objects.create(
+                url=url, day=today - timedelta(days=days_ago), dimension='city',
+                entries=SpaceSaving.from_counts({**tail, ('Berlin', 'DE'): berlin}).to_entries()
+            )
+
+        summary = HeavyHitterSketch.summaries(['city'], since=today - timedelta(days=30), url=url)['city']
+        self.assertEqual(len(summary.counters), HEAVY_HITTER_CAPACITY)
+        self.assertEqual(summary.top(1), [('Berlin', 'DE', 8)])
+
+    def test_small_streams_are_exact(self):
+        summary = SpaceSaving.from_entries(SpaceSaving.from_counts({('a', ''): 3, ('b', 'x'): 1}).to_entries())
+        summary.add(('b', 'x'))
+        self.assertEqual(summary.top(), [('a', '', 3), ('b', 'x', 2)])
+
+
+class RollupCompactionTests(AnalyticsTestCase):
+    """Compaction folds each raw click into the rollups exactly once, behind a watermark."""
+
+    def add_old_history(self, count):
+        self.add_history(count)
+        ClickEvent.objects.update(timestamp=timezone.now() - timedelta(days=1))
+
+    def rolled_up(self):
+        return ClickRollup.objects.filter(granularity='day', dimension='total').aggregate(total=Sum('clicks'))['total'] or 0
+
+    def test_watermark_advances_per_batch(self):
+        self.add_old_history(30)
+        ids = list(ClickEvent.objects.order_by('id').values_list('id', flat=True))
+
+        self.assertEqual(compact_click_rollups(batch_size=10, max_batches=1), 10)
+        self.assertEqual(RollupWatermark.current(CLICK_ROLLUP_WATERMARK), ids[9])
+        self.assertEqual(compact_click_rollups(batch_size=10), 20)
+        self.assertEqual(RollupWatermark.current(CLICK_ROLLUP_WATERMARK), ids[-1])
+        self.assertEqual(self.rolled_up(), 30)
+
+    def test_reruns_fold_nothing_twice(self):
+        self.add_old_history(20)
+        compact_click_rollups()
+        rollups = list(ClickRollup.objects.order_by('id').values_list('id', 'clicks'))
+        sketches = list(HeavyHitterSketch.objects.order_by('id').values_list('id', 'entries'))
+
+        self.assertEqual(compact_click_rollups(), 0)
+        self.assertEqual(list(ClickRollup.objects.order_by('id').values_list('id', 'clicks')), rollups)
+        self.assertEqual(list(HeavyHitterSketch.objects.order_by('id').values_list('id', 'entries')), sketches)
+
+    def test_recent_clicks_stay_in_the_raw_tail(self):
+        self.add_old_history(10)
+        ClickEvent.objects.create(url=self.url)
+        self.assertEqual(compact_click_rollups(), 10)
+        self.assertEqual(self.rolled_up(), 10)
+        # Readers add the unrolled tail to the rollups
+        self.assertEqual(sum(row['count'] for row in self.get_analytics().data['clicks_by_date']), 11)
+
+    def test_rebuild_matches_incremental_rollups(self):
+        self.add_old_history(25)
+        compact_click_rollups(batch_size=7)
+        incremental = sorted(ClickRollup.objects.values_list('granularity', 'bucket', 'dimension', 'value', 'clicks'))
+
+        for i in range(2):
+            call_command('backfill_click_rollups', '--rebuild', stdout=io.StringIO())
+            self.assertEqual(sorted(ClickRollup.objects.values_list('granularity', 'bucket', 'dimension', 'value', 'clicks')), incremental)
+
+
+class ClickArchiveTests(AnalyticsTestCase):
+    """Archiving recovers from runs interrupted between exporting and deleting a day."""
+
+    def setUp(self):
+        super().setUp()
+        archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(archive_dir.cleanup)
+        self.archive_dir = archive_dir.name
+        self.add_history(12)
+        ClickEvent.objects.update(timestamp=timezone.now() - timedelta(days=5))
+        self.day = timezone.localdate(ClickEvent.objects.first().timestamp)
+
+    def archived_ids(self):
+        return sorted(click['id'] for click in read_archived_clicks(archive_dir=self.archive_dir))
+
+    def test_interrupted_delete_is_finished_without_exporting_again(self):
+        ids = sorted(ClickEvent.objects.values_list('id', flat=True))
+        with mock.patch('analytics.archive.delete_in_chunks', side_effect=RuntimeError('connection lost')):
+            with self.assertRaises(RuntimeError):
+                archive_clicks(retention_days=1, archive_dir=self.archive_dir)
+        self.assertEqual(ClickEvent.objects.count(), 12)
+
+        # The next run deletes the exported rows and only exports clicks that arrived since
+        late = ClickEvent.objects.create(url=self.url, timestamp=timezone.now() - timedelta(days=5))
+        self.assertEqual(archive_clicks(retention_days=1, archive_dir=self.archive_dir), (1, 1))
+        self.assertFalse(ClickEvent.objects.exists())
+        self.assertEqual(self.archived_ids(), ids + [late.id])
+        self.assertEqual(archived_last_id(self.day, self.archive_dir), late.id)
+
+    def test_interrupted_export_leaves_nothing_behind(self):
+        with mock.patch('analytics.archive.os.replace', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                archive_clicks(retention_days=1, archive_dir=self.archive_dir)
+        # The temporary file is never visible to readers and no rows were deleted
+        self.assertEqual(self.archived_ids(), [])
+        self.assertEqual(ClickEvent.objects.count(), 12)
+
+        self.assertEqual(archive_clicks(retention_days=1, archive_dir=self.archive_dir), (1, 12))
+        self.assertEqual(len(self.archived_ids()), 12)
+        self.assertEqual(archive_clicks(retention_days=1, archive_dir=self.archive_dir), (0, 0))
+        self.assertEqual(len(self.archived_ids()), 12)
@@ -1,9 +1,11 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import AnalyticsViewSet
+from .views import AnalyticsReportJobViewSet, AnalyticsViewSet, ClickExportJobViewSet
 
 router = DefaultRouter()
 router.register(r'analytics', AnalyticsViewSet, basename='analytics')
+router.register(r'click-exports', ClickExportJobViewSet, basename='click-export')
+router.register(r'analytics-reports', AnalyticsReportJobViewSet, basename='analytics-report')
 
 urlpatterns = [
     # API endpoints
@@ -1,20 +1,274 @@
+import logging
+import os
+from collections import Counter
+
+from django.conf import settings
+from django.http import FileResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404
 from rest_framework import viewsets, permissions, status
 from rest_framework.response import Response
 from rest_framework.decorators import action, api_view, permission_classes
-from django.db.models import Count, F, Sum, Case, When, IntegerField, Value, DateTimeField, ExpressionWrapper, DurationField, Q
-from django.db.models.functions import TruncDate, TruncHour, ExtractHour, Coalesce, Now
-from shortener.models import ShortenedURL
-from .models import ClickEvent, UserSession
+from rest_framework.parsers import JSONParser
+from django.db.models import Avg, Count, F, Sum, Case, When, IntegerField, DateTimeField, ExpressionWrapper, DurationField, Q
+from django.db.models.functions import TruncDate, TruncHour, Now
+from shortener.models import ABTestVariant, ShortenedURL, URLStats, HourlyClickCount
+from .models import AnalyticsReportJob, ClickEvent, UserSession, VisitorSketch, ClickExportJob
+from .export import (
+    EXPORT_FORMATS, parse_export_options, export_source, iter_export_clicks, render_export, export_filename
+)
+from .serializers import AnalyticsReportJobSerializer, ClickExportJobSerializer
+from .click_log import click_log_page
+from .cache import ANALYTICS_RESULT_BUCKET, cached_analytics, get_analytics_cache_stats
+from .cohorts import DEFAULT_COHORT_WEEKS, MAX_COHORT_WEEKS, cohort_matrix
+from .funnel import apply_funnel_events, parse_funnel_events
+from .hyperloglog import STANDARD_ERROR
+from .reports import REPORT_FORMATS, parse_report_options, report_content_key, report_filename
+from .rollups import ROLLUP_DIMENSIONS, ClickHistogram, ClickSource
+from .sampling import current_sample_rate
 from shortener.serializers import ShortenedURLSerializer
+from shortener.cache import get_user_cache_version, bump_user_cache_version
+from urlbriefr.conditional import conditional_response, time_bucket
+from urlbriefr.renderers import PlainTextJSONParser
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 from datetime import timedelta
 
+logger = logging.getLogger(__name__)
+
+# Time-windowed figures (last 24h, retention cutoffs) may lag by at most this many seconds
+ANALYTICS_ETAG_TIME_BUCKET = ANALYTICS_RESULT_BUCKET
+
+# Default window for unique visitor estimates
+UNIQUE_VISITOR_DAYS = 90
+
+# Visit count buckets reported by the retention endpoint
+RETURN_VISIT_BUCKETS = (
+    ('1_visit', Q(visit_count=1)),
+    ('2_visits', Q(visit_count=2)),
+    ('3_5_visits', Q(visit_count__gte=3, visit_count__lte=5)),
+    ('6_10_visits', Q(visit_count__gte=6, visit_count__lte=10)),
+    ('more_than_10', Q(visit_count__gt=10)),
+)
+
+# Periods a session must span to count as retained
+RETENTION_PERIODS = (
+    ('1_day', 1),
+    ('7_days', 7),
+    ('30_days', 30),
+    ('90_days', 90),
+)
+
+# Funnel history window, in days
+DEFAULT_FUNNEL_DAYS = 30
+MAX_FUNNEL_DAYS = 365
+
+# Endpoints served from the analytics result cache
+CACHED_ANALYTICS_ENDPOINTS = ('retrieve', 'dashboard', 'cohorts', 'account_cohorts', 'summaries', 'compare')
+
+# Links summarised in one request, and the days of clicks in each summary
+MAX_SUMMARY_URLS = 100
+SUMMARY_DAYS = 7
+
+# Links compared side by side, the comparison window in days and the values kept per breakdown
+MIN_COMPARE_URLS = 2
+MAX_COMPARE_URLS = 20
+DEFAULT_COMPARE_DAYS = 30
+MAX_COMPARE_DAYS = 365
+COMPARE_DIMENSION_VALUES = 10
+
+RECENT_CLICK_FIELDS = ('timestamp', 'browser', 'device', 'os', 'country', 'city', 'ip_address', 'referrer')
+
+# Time between a session's first and last visit, computed in the database
+RETURN_TIME = ExpressionWrapper(F('last_visit') - F('first_visit'), output_field=DurationField())
+
+
+def is_admin_user(user):
+    """Check whether a user can see analytics for every URL."""
+    return user.is_superuser or (hasattr(user, 'is_admin') and user.is_admin)
+
+
+def parse_url_ids(value):
+    """Parse a comma separated list of URL ids, in order and without repeats. Raises ValueError."""
+    return list(dict.fromkeys(int(url_id) for url_id in value.split(',') if url_id))
+
+
+def urls_in_order(urls, url_ids, *fields):
+    """
+    Load the given fields of the URLs with some ids from a queryset, in the order of the ids.
+    
+    Returns None when any of them isn't in the queryset, so ownership of the
+    whole list is checked by the one query that loads it.
+    """
+    rows = list(urls.filter(pk__in=url_ids).values('id', *fields))
+    if len(rows) != len(url_ids):
+        return None
+    rows.sort(key=lambda row: url_ids.index(row['id']))
+    return rows
+
+
+def url_analytics_scope(view, request, pk=None, **kwargs):
+    """
+    Result cache scope of a URL's analytics: the URL and its owner's cache
+    version, bumped by every click. None without a shared cache, where
+    other processes' clicks never bump this process's version.
+    """
+    if not settings.SHARED_CACHE:
+        return None
+    # Looked up once per request for both the ETag and the result cache
+    if not hasattr(request, '_analytics_owner'):
+        owner = ShortenedURL.objects.filter(pk=pk).values_list('user_id', flat=True)[:1]
+        request._analytics_owner = owner[0] if owner else None
+    owner_id = request._analytics_owner
+    if owner_id is None or (owner_id != request.user.id and not is_admin_user(request.user)):
+        return None
+    return (f'url_{pk}', get_user_cache_version(owner_id))
+
+
+def url_analytics_etag(view, request, pk=None, **kwargs):
+    """ETag parts for a URL's analytics: the owner's cache version, bumped by every click."""
+    scope = url_analytics_scope(view, request, pk)
+    if scope is None:
+        return None
+    return (*scope, time_bucket(ANALYTICS_ETAG_TIME_BUCKET))
+
+
+def stream_click_breakdowns(clicks, since, recent_limit=20):
+    """
+    Build every click breakdown, the unique IP count and the recent clicks
+    from a single streamed pass over raw clicks, newest first.
+    """
+    histogram = ClickHistogram(since)
+    ips = set()
+    recent_clicks = []
+    fields = set(ClickHistogram.CLICK_FIELDS) | set(RECENT_CLICK_FIELDS)
+    for click in clicks.order_by('-timestamp').attribute_values(*fields).iterator(chunk_size=2000):
+        histogram.add_click(click)
+        ips.add(click['ip_address'])
+        if len(recent_clicks) < recent_limit:
+            recent_clicks.append({field: click[field] for field in RECENT_CLICK_FIELDS})
+    return histogram, len(ips), recent_clicks
+
+
+def dimension_breakdown(histogram, dimension, limit=None):
+    """Format click counts for a dimension the way the analytics responses expect."""
+    rows = histogram.dimension_counts(dimension)
+    if dimension == 'referrer':
+        rows = [row for row in rows if row[0]]
+    if limit is not None:
+        rows = rows[:limit]
+    
+    if dimension == 'city':
+        return [{'city': value or 'Unknown', 'country': parent or 'Unknown', 'count': count}
+                for value, parent, count in rows]
+    if dimension == 'country':
+        return [{'country': value or 'Unknown', 'count': count} for value, parent, count in rows]
+    return [{dimension: value or None, 'count': count} for value, parent, count in rows]
+
+
+def breakdown_window(since, fields):
+    """
+    The response's window field: the breakdowns that only count clicks from
+    the start of the analytics window on. The rest cover all time.
+    """
+    return {'since': timezone.localdate(since), 'fields': fields}
+
+
+def streaming_export(request, user, url=None):
+    """Stream a URL's clicks, or all of a user's, as a CSV or NDJSON download."""
+    try:
+        options = parse_export_options(request.query_params)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    clicks, url_ids, short_codes = export_source(user, url)
+    rows = iter_export_clicks(clicks, url_ids, short_codes, options['columns'], options['start'], options['end'])
+    file_format = options['file_format']
+    
+    response = StreamingHttpResponse(
+        render_export(rows, options['columns'], file_format),
+        content_type=EXPORT_FORMATS[file_format]
+    )
+    filename = export_filename(url.short_code if url else 'all', file_format)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def cohort_response(request, sessions):
+    """Build a cohort retention matrix response for the window in the weeks query param."""
+    try:
+        weeks = int(request.query_params.get('weeks', DEFAULT_COHORT_WEEKS))
+    except ValueError:
+        return Response({"error": "weeks must be a whole number"}, status=status.HTTP_400_BAD_REQUEST)
+    if not 1 <= weeks <= MAX_COHORT_WEEKS:
+        return Response({"error": f"weeks must be between 1 and {MAX_COHORT_WEEKS}"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    return Response(cohort_matrix(sessions, weeks))
+
+
+def start_export_job(job):
+    """
+    Queue an export job for Celery. Exports are never written in the request:
+    without Celery the job stays pending for the run_click_exports command.
+    """
+    try:
+        from .tasks import run_click_export_task, CELERY_AVAILABLE
+        if CELERY_AVAILABLE and hasattr(run_click_export_task, 'delay'):
+            run_click_export_task.delay(job.id)
+    except Exception as e:
+        logger.warning(f"Failed to queue click export job {job.id}: {str(e)}")
+
+
+def start_report_job(job):
+    """
+    Queue a report job for Celery. Reports are never generated in the request:
+    without Celery the job stays pending for the run_analytics_reports command.
+    """
+    try:
+        from .tasks import run_analytics_report_task, CELERY_AVAILABLE
+        if CELERY_AVAILABLE and hasattr(run_analytics_report_task, 'delay'):
+            run_analytics_report_task.delay(job.id)
+    except Exception as e:
+        logger.warning(f"Failed to queue analytics report job {job.id}: {str(e)}")
+
+
+def start_funnel_events_task(events):
+    """Queue a batch of funnel events for Celery, returning False if it isn't available."""
+    try:
+        from .tasks import apply_funnel_events_task, CELERY_AVAILABLE
+        if CELERY_AVAILABLE and hasattr(apply_funnel_events_task, 'delay'):
+            apply_funnel_events_task.delay(events)
+            return True
+    except Exception as e:
+        logger.warning(f"Failed to queue {len(events)} funnel events: {str(e)}")
+    return False
+
+
+def dashboard_scope(view, request, **kwargs):
+    """
+    Result cache scope of the dashboard: the user and their cache version, or
+    all users for admins. None without a shared cache, as for URL analytics.
+    """
+    if not settings.SHARED_CACHE:
+        return None
+    scope = None if is_admin_user(request.user) else request.user.id
+    return (f'user_{scope or "all"}', get_user_cache_version(scope))
+
+
+def dashboard_etag(view, request, **kwargs):
+    """ETag parts for the dashboard: the user's cache version, or the global one for admins."""
+    scope = dashboard_scope(view, request)
+    if scope is None:
+        return None
+    return (*scope, time_bucket(ANALYTICS_ETAG_TIME_BUCKET))
+
+
 class AnalyticsViewSet(viewsets.ViewSet):
     """ViewSet for URL analytics."""
     
     permission_classes = [permissions.IsAuthenticated]
     
+    @conditional_response(url_analytics_etag)
+    @cached_analytics('retrieve', url_analytics_scope)
     def retrieve(self, request, pk=None):
         """Get analytics for a specific URL."""
         user = request.user
@@ -30,100 +284,50 @@ class AnalyticsViewSet(viewsets.ViewSet):
         # Get all click events
         clicks = ClickEvent.objects.filter(url=url)
         
-        # Get clicks by date (last 30 days)
         thirty_days_ago = timezone.now() - timedelta(days=30)
-        clicks_by_date = clicks.filter(timestamp__gte=thirty_days_ago) \
-                              .annotate(date=TruncDate('timestamp')) \
-                              .values('date') \
-                              .annotate(count=Count('id')) \
-                              .order_by('date')
-        
-        # Get clicks by hour (for time distribution)
-        clicks_by_hour = clicks.annotate(hour=ExtractHour('timestamp')) \
-                              .values('hour') \
-                              .annotate(count=Count('id')) \
-                              .order_by('hour')
-        
-        # Get clicks by browser
-        clicks_by_browser = clicks.values('browser') \
-                                 .annotate(count=Count('id')) \
-                                 .order_by('-count')
-        
-        # Get clicks by device
-        clicks_by_device = clicks.values('device') \
-                                .annotate(count=Count('id')) \
-                                .order_by('-count')
-        
-        # Get clicks by country - handle NULL values with Coalesce
-        clicks_by_country = clicks.annotate(
-                                country_name=Coalesce('country', Value('Unknown'))
-                            ) \
-                            .values('country_name') \
-                            .annotate(count=Count('id')) \
-                            .order_by('-count')
-        
-        # Format the results to match expected structure
-        clicks_by_country = [{'country': item['country_name'], 'count': item['count']} 
-                             for item in clicks_by_country]
-        
-        # Get clicks by city - handle NULL values for both city and country
-        clicks_by_city = clicks.annotate(
-                              city_name=Coalesce('city', Value('Unknown')),
-                              country_name=Coalesce('country', Value('Unknown'))
-                          ) \
-                          .values('city_name', 'country_name') \
-                          .annotate(count=Count('id')) \
-                          .order_by('-count')[:15]
-        
-        # Format the results to match expected structure
-        clicks_by_city = [{'city': item['city_name'], 'country': item['country_name'], 'count': item['count']} 
-                          for item in clicks_by_city]
-        
-        # Get clicks by OS
-        clicks_by_os = clicks.values('os') \
-                            .annotate(count=Count('id')) \
-                            .order_by('-count')
-        
-        # Get referrers
-        clicks_by_referrer = clicks.exclude(referrer__isnull=True).exclude(referrer='') \
-                                  .values('referrer') \
-                                  .annotate(count=Count('id')) \
-                                  .order_by('-count')[:10]
-        
-        # Get recent clicks with more details
-        recent_clicks = clicks.order_by('-timestamp')[:20].values(
-            'timestamp', 'browser', 'device', 'os', 'country', 'city', 'ip_address', 'referrer'
-        )
         
-        # Get unique IP addresses
-        unique_ips = clicks.values('ip_address').distinct().count()
-        
-        # Get retention metrics (new)
+        if request.query_params.get('mode') == 'stream':
+            # Build every breakdown from one pass over the raw clicks
+            histogram, unique_ips, recent_clicks = stream_click_breakdowns(clicks, thirty_days_ago)
+        else:
+            # Breakdowns come from the click rollups plus the raw clicks not rolled up yet
+            histogram = ClickSource(url=url).histogram(thirty_days_ago)
+            
+            # Get recent clicks with more details
+            recent_clicks = clicks.order_by('-timestamp').attribute_values(*RECENT_CLICK_FIELDS)[:20]
+            
+            # Get unique IP addresses, estimated from the daily visitor sketches
+            unique_ips = VisitorSketch.estimate(url_id=url.id)
+        
+        clicks_by_date = histogram.clicks_by_date()
+        clicks_by_hour = histogram.clicks_by_hour()
+        clicks_by_browser = dimension_breakdown(histogram, 'browser')
+        clicks_by_device = dimension_breakdown(histogram, 'device')
+        clicks_by_country = dimension_breakdown(histogram, 'country')
+        clicks_by_city = dimension_breakdown(histogram, 'city', limit=15)
+        clicks_by_os = dimension_breakdown(histogram, 'os')
+        clicks_by_referrer = dimension_breakdown(histogram, 'referrer', limit=10)
+        clicks_by_user_agent = dimension_breakdown(histogram, 'user_agent', limit=10)
+        
+        # Get retention and funnel metrics in a single aggregate over the sessions
         sessions = UserSession.objects.filter(url=url)
-        
-        # Calculate retention rates for different time periods
-        total_sessions = sessions.count()
-        
-        # 1-day retention
-        one_day_ago = timezone.now() - timedelta(days=1)
-        one_day_retention = sessions.filter(
-            first_visit__lt=one_day_ago,
-            last_visit__gte=one_day_ago
-        ).count()
-        
-        # 7-day retention
-        seven_days_ago = timezone.now() - timedelta(days=7)
-        seven_day_retention = sessions.filter(
-            first_visit__lt=seven_days_ago,
-            last_visit__gte=seven_days_ago
-        ).count()
-        
-        # 30-day retention
-        thirty_days_ago = timezone.now() - timedelta(days=30)
-        thirty_day_retention = sessions.filter(
-            first_visit__lt=thirty_days_ago,
-            last_visit__gte=thirty_days_ago
-        ).count()
+        now = timezone.now()
+        one_day_ago = now - timedelta(days=1)
+        seven_days_ago = now - timedelta(days=7)
+        session_stats = sessions.aggregate(
+            total_sessions=Count('id'),
+            one_day_retention=Count('id', filter=Q(first_visit__lt=one_day_ago, last_visit__gte=one_day_ago)),
+            seven_day_retention=Count('id', filter=Q(first_visit__lt=seven_days_ago, last_visit__gte=seven_days_ago)),
+            thirty_day_retention=Count('id', filter=Q(first_visit__lt=thirty_days_ago, last_visit__gte=thirty_days_ago)),
+            reached_destination=Count('id', filter=Q(reached_destination=True)),
+            completed_action=Count('id', filter=Q(completed_action=True)),
+            # Time between first and last visit, for sessions with > 1 visit
+            avg_return_time=Avg(RETURN_TIME, filter=Q(visit_count__gt=1))
+        )
+        total_sessions = session_stats['total_sessions']
+        one_day_retention = session_stats['one_day_retention']
+        seven_day_retention = session_stats['seven_day_retention']
+        thirty_day_retention = session_stats['thirty_day_retention']
         
         # Return visit distribution
         return_visit_distribution = sessions.filter(
@@ -132,22 +336,15 @@ class AnalyticsViewSet(viewsets.ViewSet):
             session_count=Count('id')
         ).order_by('visit_count')[:10]
         
-        # Time between visits (for sessions with > 1 visit)
         avg_return_time_hours = 0
-        if sessions.filter(visit_count__gt=1).exists():
-            # Calculate average time between first and last visit for sessions with multiple visits
-            multi_visit_sessions = sessions.filter(visit_count__gt=1)
-            total_hours = sum(
-                (session.last_visit - session.first_visit).total_seconds() / 3600
-                for session in multi_visit_sessions
-            )
-            avg_return_time_hours = total_hours / multi_visit_sessions.count()
+        if session_stats['avg_return_time'] is not None:
+            avg_return_time_hours = session_stats['avg_return_time'].total_seconds() / 3600
         
         # Get funnel metrics (new)
         funnel_stages = {
             'total_clicks': total_clicks,
-            'reached_destination': sessions.filter(reached_destination=True).count(),
-            'completed_action': sessions.filter(completed_action=True).count()
+            'reached_destination': session_stats['reached_destination'],
+            'completed_action': session_stats['completed_action']
         }
         
         # Calculate drop-off rates
@@ -172,6 +369,8 @@ class AnalyticsViewSet(viewsets.ViewSet):
         return Response({
             'url': ShortenedURLSerializer(url).data,
             'total_clicks': total_clicks,
+            # Identical clicks within the dedup window, left out of every figure
+            'suppressed_clicks': url.suppressed_clicks,
             'unique_visitors': unique_ips,
             'clicks_by_date': clicks_by_date,
             'clicks_by_hour': clicks_by_hour,
@@ -181,6 +380,13 @@ class AnalyticsViewSet(viewsets.ViewSet):
             'clicks_by_city': clicks_by_city,
             'clicks_by_os': clicks_by_os,
             'clicks_by_referrer': clicks_by_referrer,
+            'clicks_by_user_agent': clicks_by_user_agent,
+            # Top cities, referrers and user agents come from the window's heavy-hitter sketches
+            'window': breakdown_window(
+                thirty_days_ago, ['clicks_by_date', 'clicks_by_city', 'clicks_by_referrer', 'clicks_by_user_agent']
+            ),
+            # Breakdowns of sampled clicks are estimates; this says how precise they are
+            'sampling': {**histogram.sampling(), 'current_sample_rate': current_sample_rate(url.id)},
             'recent_clicks': recent_clicks,
             # Retention metrics (new)
             'retention': {
@@ -202,89 +408,53 @@ class AnalyticsViewSet(viewsets.ViewSet):
         })
     
     @action(detail=False, methods=['get'])
+    @conditional_response(dashboard_etag)
+    @cached_analytics('dashboard', dashboard_scope)
     def dashboard(self, request):
         """Get dashboard analytics for all user's URLs."""
         user = request.user
         
         # Get user's URLs
-        if user.is_superuser or (hasattr(user, 'is_admin') and user.is_admin):
+        is_admin = is_admin_user(user)
+        if is_admin:
             urls = ShortenedURL.objects.all()
         else:
             urls = ShortenedURL.objects.filter(user=user)
         
-        # Get total stats
-        total_urls = urls.count()
-        active_urls = urls.filter(is_active=True).count()
-        expired_urls = urls.filter(is_active=True).filter(expires_at__lt=timezone.now()).count()
-        total_clicks = sum(url.access_count for url in urls)
+        # Get total stats from the incrementally maintained counters
+        stats_scope = None if is_admin else user.id
+        stats = URLStats.for_user(stats_scope)
+        total_urls = stats.total_urls
+        active_urls = stats.active_urls
+        # Expiry depends on the clock rather than on writes, so it is counted via the (is_active, expires_at) index
+        expired_urls = urls.filter(is_active=True, expires_at__lt=timezone.now()).count()
+        total_clicks = stats.total_clicks
         
         # Get clicks in last 24 hours
-        day_ago = timezone.now() - timedelta(days=1)
-        clicks_last_24h = ClickEvent.objects.filter(url__in=urls, timestamp__gte=day_ago).count()
+        clicks_last_24h = HourlyClickCount.clicks_last_24h(stats_scope)
+        
+        # Get approximate unique visitors across all the user's links
+        unique_visitors_90d = VisitorSketch.estimate(
+            start=timezone.localdate() - timedelta(days=UNIQUE_VISITOR_DAYS - 1), user_id=stats_scope
+        )
         
         # Get top URLs
         top_urls = urls.order_by('-access_count')[:10]
         top_urls_data = ShortenedURLSerializer(top_urls, many=True).data
         
-        # Get clicks over time (last 30 days)
+        # Breakdowns come from the click rollups plus the raw clicks not rolled up yet
+        source = ClickSource() if is_admin else ClickSource(url__user=user)
+        
+        # Get clicks over time (last 30 days), by hour and by device, browser, OS and location
         thirty_days_ago = timezone.now() - timedelta(days=30)
-        clicks_by_date = ClickEvent.objects.filter(url__in=urls, timestamp__gte=thirty_days_ago) \
-                                         .annotate(date=TruncDate('timestamp')) \
-                                         .values('date') \
-                                         .annotate(count=Count('id')) \
-                                         .order_by('date')
-        
-        # Get clicks by hour (time distribution)
-        clicks_by_hour = ClickEvent.objects.filter(url__in=urls) \
-                                        .annotate(hour=ExtractHour('timestamp')) \
-                                        .values('hour') \
-                                        .annotate(count=Count('id')) \
-                                        .order_by('hour')
-        
-        # Get clicks by device
-        clicks_by_device = ClickEvent.objects.filter(url__in=urls) \
-                                           .values('device') \
-                                           .annotate(count=Count('id')) \
-                                           .order_by('-count')[:5]
-        
-        # Get clicks by browser
-        clicks_by_browser = ClickEvent.objects.filter(url__in=urls) \
-                                            .values('browser') \
-                                            .annotate(count=Count('id')) \
-                                            .order_by('-count')[:5]
-        
-        # Get clicks by OS
-        clicks_by_os = ClickEvent.objects.filter(url__in=urls) \
-                                       .values('os') \
-                                       .annotate(count=Count('id')) \
-                                       .order_by('-count')[:5]
-        
-        # Get clicks by country - handle NULL or empty values properly
-        clicks_by_country = ClickEvent.objects.filter(url__in=urls) \
-                                            .annotate(
-                                                country_name=Coalesce('country', Value('Unknown'))
-                                            ) \
-                                            .values('country_name') \
-                                            .annotate(count=Count('id')) \
-                                            .order_by('-count')[:10]
-        
-        # Format the results to match expected structure
-        clicks_by_country = [{'country': item['country_name'], 'count': item['count']} 
-                            for item in clicks_by_country]
-        
-        # Get clicks by city - handle NULL or empty values for both city and country
-        clicks_by_city = ClickEvent.objects.filter(url__in=urls) \
-                                        .annotate(
-                                            city_name=Coalesce('city', Value('Unknown')),
-                                            country_name=Coalesce('country', Value('Unknown'))
-                                        ) \
-                                        .values('city_name', 'country_name') \
-                                        .annotate(count=Count('id')) \
-                                        .order_by('-count')[:15]
-        
-        # Format the results to match expected structure
-        clicks_by_city = [{'city': item['city_name'], 'country': item['country_name'], 'count': item['count']} 
-                         for item in clicks_by_city]
+        histogram = source.histogram(thirty_days_ago)
+        clicks_by_date = histogram.clicks_by_date()
+        clicks_by_hour = histogram.clicks_by_hour()
+        clicks_by_device = dimension_breakdown(histogram, 'device', limit=5)
+        clicks_by_browser = dimension_breakdown(histogram, 'browser', limit=5)
+        clicks_by_os = dimension_breakdown(histogram, 'os', limit=5)
+        clicks_by_country = dimension_breakdown(histogram, 'country', limit=10)
+        clicks_by_city = dimension_breakdown(histogram, 'city', limit=15)
         
         # Get retention metrics across all URLs
         sessions = UserSession.objects.filter(url__in=urls)
@@ -295,7 +465,6 @@ class AnalyticsViewSet(viewsets.ViewSet):
         returning_rate = round(returning_sessions / total_sessions * 100, 2) if total_sessions > 0 else 0
         
         # Get funnel metrics across all URLs
-        total_clicks = ClickEvent.objects.filter(url__in=urls).count()
         reached_destination = sessions.filter(reached_destination=True).count()
         completed_action = sessions.filter(completed_action=True).count()
         
@@ -308,6 +477,7 @@ class AnalyticsViewSet(viewsets.ViewSet):
             'expired_urls': expired_urls,
             'total_clicks': total_clicks,
             'clicks_last_24h': clicks_last_24h,
+            'unique_visitors_90d': unique_visitors_90d,
             'top_urls': top_urls_data,
             'clicks_by_date': clicks_by_date,
             'clicks_by_hour': clicks_by_hour,
@@ -316,6 +486,8 @@ class AnalyticsViewSet(viewsets.ViewSet):
             'clicks_by_os': clicks_by_os,
             'clicks_by_country': clicks_by_country,
             'clicks_by_city': clicks_by_city,
+            'window': breakdown_window(thirty_days_ago, ['clicks_by_date', 'clicks_by_city']),
+            'sampling': histogram.sampling(),
             # New retention and funnel metrics
             'retention': {
                 'total_sessions': total_sessions,
@@ -331,6 +503,7 @@ class AnalyticsViewSet(viewsets.ViewSet):
         })
         
     @action(detail=True, methods=['get'])
+    @conditional_response(url_analytics_etag)
     def retention(self, request, pk=None):
         """Get detailed retention metrics for a specific URL."""
         user = request.user
@@ -341,66 +514,75 @@ class AnalyticsViewSet(viewsets.ViewSet):
             return Response(status=status.HTTP_403_FORBIDDEN)
         
         sessions = UserSession.objects.filter(url=url)
-        total_sessions = sessions.count()
         
-        # Return visit counts
-        return_visit_counts = {
-            '1_visit': sessions.filter(visit_count=1).count(),
-            '2_visits': sessions.filter(visit_count=2).count(),
-            '3_5_visits': sessions.filter(visit_count__gte=3, visit_count__lte=5).count(),
-            '6_10_visits': sessions.filter(visit_count__gte=6, visit_count__lte=10).count(),
-            'more_than_10': sessions.filter(visit_count__gt=10).count(),
-        }
-        
-        # Time periods for retention
-        periods = [
-            {'name': '1_day', 'days': 1},
-            {'name': '7_days', 'days': 7},
-            {'name': '30_days', 'days': 30},
-            {'name': '90_days', 'days': 90}
-        ]
+        # Return visit counts, totals and the average return time in one aggregate
+        visit_stats = sessions.aggregate(
+            total_sessions=Count('id'),
+            returning_sessions=Count('id', filter=Q(visit_count__gt=1)),
+            # Time between first and last visit for returning visitors
+            avg_return_time=Avg(RETURN_TIME, filter=Q(visit_count__gt=1)),
+            **{name: Count('id', filter=condition) for name, condition in RETURN_VISIT_BUCKETS}
+        )
+        total_sessions = visit_stats['total_sessions']
+        return_visit_counts = {name: visit_stats[name] for name, condition in RETURN_VISIT_BUCKETS}
+        
+        # Retention for every period in one aggregate
+        now = timezone.now()
+        cutoffs = {name: now - timedelta(days=days) for name, days in RETENTION_PERIODS}
+        period_stats = sessions.aggregate(**{
+            name: Count('id', filter=Q(first_visit__lt=cutoff, last_visit__gte=cutoff))
+            for name, cutoff in cutoffs.items()
+        })
         
         retention_by_period = {}
-        
-        for period in periods:
-            cutoff_date = timezone.now() - timedelta(days=period['days'])
-            retained_sessions = sessions.filter(
-                first_visit__lt=cutoff_date,
-                last_visit__gte=cutoff_date
-            ).count()
-            
+        for name, days in RETENTION_PERIODS:
+            retained_sessions = period_stats[name]
             retention_rate = round(retained_sessions / total_sessions * 100, 2) if total_sessions > 0 else 0
-            
-            retention_by_period[period['name']] = {
+            retention_by_period[name] = {
                 'sessions': retained_sessions,
                 'rate': retention_rate
             }
         
-        # Time between first and last visit for returning visitors
-        returning_sessions = sessions.filter(visit_count__gt=1)
-        
         avg_return_time = None
-        if returning_sessions.exists():
-            # Calculate the average time between first and last visit
-            total_seconds = sum(
-                (session.last_visit - session.first_visit).total_seconds()
-                for session in returning_sessions
-            )
-            avg_seconds = total_seconds / returning_sessions.count()
-            
+        if visit_stats['avg_return_time'] is not None:
             # Convert to hours for better readability
-            avg_return_time = round(avg_seconds / 3600, 2)
+            avg_return_time = round(visit_stats['avg_return_time'].total_seconds() / 3600, 2)
         
         return Response({
             'url': ShortenedURLSerializer(url).data,
             'total_sessions': total_sessions,
-            'returning_sessions': sessions.filter(visit_count__gt=1).count(),
+            'returning_sessions': visit_stats['returning_sessions'],
             'return_visit_counts': return_visit_counts,
             'retention_by_period': retention_by_period,
             'avg_return_time_hours': avg_return_time
         })
     
     @action(detail=True, methods=['get'])
+    @conditional_response(url_analytics_etag)
+    @cached_analytics('cohorts', url_analytics_scope)
+    def cohorts(self, request, pk=None):
+        """Get the weekly cohort retention matrix for a specific URL."""
+        user = request.user
+        url = get_object_or_404(ShortenedURL, pk=pk)
+        
+        # Ensure user owns the URL or is an admin
+        if url.user != user and not is_admin_user(user):
+            return Response(status=status.HTTP_403_FORBIDDEN)
+        
+        return cohort_response(request, UserSession.objects.filter(url=url))
+    
+    @action(detail=False, methods=['get'], url_path='cohorts', url_name='cohorts-account')
+    @conditional_response(dashboard_etag)
+    @cached_analytics('account_cohorts', dashboard_scope)
+    def cohorts_account(self, request):
+        """Get the weekly cohort retention matrix across all the user's URLs."""
+        sessions = UserSession.objects.all()
+        if not is_admin_user(request.user):
+            sessions = sessions.filter(url__user=request.user)
+        return cohort_response(request, sessions)
+    
+    @action(detail=True, methods=['get'])
+    @conditional_response(url_analytics_etag)
     def funnel(self, request, pk=None):
         """Get detailed funnel analysis for a specific URL."""
         user = request.user
@@ -413,12 +595,22 @@ class AnalyticsViewSet(viewsets.ViewSet):
         # Total clicks
         total_clicks = url.access_count
         
+        try:
+            days = int(request.query_params.get('days', DEFAULT_FUNNEL_DAYS))
+        except ValueError:
+            return Response({"error": "days must be a whole number"}, status=status.HTTP_400_BAD_REQUEST)
+        days = max(1, min(days, MAX_FUNNEL_DAYS))
+        
         # Session data for funnel analysis
         sessions = UserSession.objects.filter(url=url)
         
         # Funnel stages
-        reached_destination = sessions.filter(reached_destination=True).count()
-        completed_action = sessions.filter(completed_action=True).count()
+        stage_counts = sessions.aggregate(
+            reached_destination=Count('id', filter=Q(reached_destination=True)),
+            completed_action=Count('id', filter=Q(completed_action=True))
+        )
+        reached_destination = stage_counts['reached_destination']
+        completed_action = stage_counts['completed_action']
         
         # Calculate conversion rates
         destination_rate = round(reached_destination / total_clicks * 100, 2) if total_clicks > 0 else 0
@@ -430,41 +622,34 @@ class AnalyticsViewSet(viewsets.ViewSet):
         destination_to_action_drop = round(100 - action_rate, 2)
         overall_drop = round(100 - overall_rate, 2)
         
-        # Daily funnel metrics for the last 30 days
-        thirty_days_ago = timezone.now() - timedelta(days=30)
+        # Daily funnel metrics for the requested window
+        since = timezone.now() - timedelta(days=days)
         
         # Get daily clicks
-        daily_clicks = ClickEvent.objects.filter(
-            url=url, 
-            timestamp__gte=thirty_days_ago
-        ).annotate(
-            date=TruncDate('timestamp')
-        ).values('date').annotate(
-            count=Count('id')
-        ).order_by('date')
+        daily_clicks = ClickSource(url=url).clicks_by_date(since)
+        
+        # Get destination and action counts per day in one grouped query
+        daily_stages = {
+            row['date']: row
+            for row in sessions.filter(last_visit__gte=since.replace(hour=0, minute=0, second=0, microsecond=0)).annotate(
+                date=TruncDate('last_visit')
+            ).values('date').annotate(
+                reached_destination=Count('id', filter=Q(reached_destination=True)),
+                completed_action=Count('id', filter=Q(completed_action=True))
+            ).order_by()
+        }
         
         # Format for the response
         daily_funnel = []
         
         for day_data in daily_clicks:
             date = day_data['date']
-            
-            # Get destination and action counts for this day
-            day_destinations = sessions.filter(
-                reached_destination=True,
-                last_visit__date=date
-            ).count()
-            
-            day_actions = sessions.filter(
-                completed_action=True,
-                last_visit__date=date
-            ).count()
-            
+            day_stages = daily_stages.get(date, {})
             daily_funnel.append({
                 'date': date.strftime('%Y-%m-%d'),
                 'clicks': day_data['count'],
-                'reached_destination': day_destinations,
-                'completed_action': day_actions
+                'reached_destination': day_stages.get('reached_destination', 0),
+                'completed_action': day_stages.get('completed_action', 0)
             })
         
         return Response({
@@ -488,6 +673,237 @@ class AnalyticsViewSet(viewsets.ViewSet):
             'daily_funnel': daily_funnel
         })
 
+    @action(detail=True, methods=['get'], url_path='clicks', url_name='clicks')
+    def click_log(self, request, pk=None):
+        """Page through a URL's raw clicks, newest first, optionally filtered."""
+        user = request.user
+        url = get_object_or_404(ShortenedURL, pk=pk)
+        
+        # Ensure user owns the URL or is an admin
+        if url.user != user and not is_admin_user(user):
+            return Response(status=status.HTTP_403_FORBIDDEN)
+        
+        try:
+            clicks, next_cursor = click_log_page(ClickEvent.objects.filter(url=url), request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({'results': clicks, 'next_cursor': next_cursor})
+    
+    @action(detail=True, methods=['get'])
+    def export(self, request, pk=None):
+        """Stream a URL's raw clicks as CSV or NDJSON."""
+        user = request.user
+        url = get_object_or_404(ShortenedURL, pk=pk)
+        
+        # Ensure user owns the URL or is an admin
+        if url.user != user and not is_admin_user(user):
+            return Response(status=status.HTTP_403_FORBIDDEN)
+        
+        return streaming_export(request, user, url)
+    
+    @action(detail=False, methods=['get'], url_path='export', url_name='export-account')
+    def export_account(self, request):
+        """Stream the raw clicks of every link the user owns as CSV or NDJSON."""
+        return streaming_export(request, request.user)
+    
+    @action(detail=False, methods=['get'])
+    def unique_visitors(self, request):
+        """Estimate unique visitors for a date range across some or all of the user's links."""
+        user = request.user
+        is_admin = is_admin_user(user)
+        
+        try:
+            end = parse_date(request.query_params.get('end', '')) or timezone.localdate()
+            start = parse_date(request.query_params.get('start', '')) or end - timedelta(days=UNIQUE_VISITOR_DAYS - 1)
+        except ValueError:
+            return Response({"error": "Dates must be valid and in YYYY-MM-DD format"}, status=status.HTTP_400_BAD_REQUEST)
+        if start > end:
+            return Response({"error": "start must not be after end"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        url_ids = request.query_params.get('urls')
+        if url_ids:
+            try:
+                url_ids = {int(url_id) for url_id in url_ids.split(',') if url_id}
+            except ValueError:
+                return Response({"error": "urls must be a comma separated list of URL ids"}, status=status.HTTP_400_BAD_REQUEST)
+            
+            urls = ShortenedURL.objects.filter(pk__in=url_ids)
+            if not is_admin:
+                urls = urls.filter(user=user)
+            if urls.count() != len(url_ids):
+                return Response({"error": "One or more URLs were not found"}, status=status.HTTP_404_NOT_FOUND)
+            estimate = VisitorSketch.estimate(start, end, url_id__in=url_ids)
+        else:
+            estimate = VisitorSketch.estimate(start, end, user_id=None if is_admin else user.id)
+        
+        return Response({
+            'unique_visitors': estimate,
+            'start': start,
+            'end': end,
+            # Roughly 95% of estimates fall within this many visitors of the true count
+            'margin_of_error': round(estimate * 2 * STANDARD_ERROR),
+            'standard_error': round(STANDARD_ERROR, 4)
+        })
+    
+    @action(detail=False, methods=['get'])
+    @conditional_response(dashboard_etag)
+    @cached_analytics('summaries', dashboard_scope)
+    def summaries(self, request):
+        """Get compact analytics summaries for a list of URL ids, or for the URLs matching some filters."""
+        user = request.user
+        is_admin = is_admin_user(user)
+        urls = ShortenedURL.objects.all() if is_admin else ShortenedURL.objects.filter(user=user)
+        
+        url_ids = request.query_params.get('ids')
+        if url_ids:
+            try:
+                url_ids = parse_url_ids(url_ids)
+            except ValueError:
+                return Response({"error": "ids must be a comma separated list of URL ids"}, status=status.HTTP_400_BAD_REQUEST)
+            if len(url_ids) > MAX_SUMMARY_URLS:
+                return Response({"error": f"At most {MAX_SUMMARY_URLS} URLs can be summarised at once"}, status=status.HTTP_400_BAD_REQUEST)
+            
+            urls = urls_in_order(urls, url_ids, 'short_code', 'title', 'access_count', 'last_accessed')
+            if urls is None:
+                return Response({"error": "One or more URLs were not found"}, status=status.HTTP_404_NOT_FOUND)
+        else:
+            folder = request.query_params.get('folder')
+            if folder is not None:
+                urls = urls.filter(folder=folder)
+            tag_ids = request.query_params.getlist('tag_id')
+            if tag_ids:
+                urls = urls.filter(tags__id__in=tag_ids).distinct()
+            search = request.query_params.get('search')
+            if search:
+                urls = urls.filter(
+                    Q(original_url__icontains=search) | Q(short_code__icontains=search) | Q(title__icontains=search)
+                )
+            urls = list(urls.order_by('-access_count', '-id').values(
+                'id', 'short_code', 'title', 'access_count', 'last_accessed'
+            )[:MAX_SUMMARY_URLS])
+        
+        url_ids = [url['id'] for url in urls]
+        if not url_ids:
+            return Response({'summaries': []})
+        
+        # Every figure is grouped by URL, so the cost doesn't grow with the number of links
+        source = ClickSource(url_id__in=url_ids)
+        since = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=SUMMARY_DAYS - 1)
+        days = [since.date() + timedelta(days=day) for day in range(SUMMARY_DAYS)]
+        clicks_by_date = source.clicks_by_url_and_date(since)
+        top_countries = source.top_value_by_url('country')
+        unique_visitors = VisitorSketch.estimates_by_url(
+            url_ids, start=timezone.localdate() - timedelta(days=UNIQUE_VISITOR_DAYS - 1)
+        )
+        
+        summaries = []
+        for url in urls:
+            daily = clicks_by_date.get(url['id'], {})
+            top_country = top_countries.get(url['id'])
+            summaries.append({
+                'id': url['id'],
+                'short_code': url['short_code'],
+                'title': url['title'],
+                'total_clicks': url['access_count'],
+                'last_accessed': url['last_accessed'],
+                'unique_visitors_90d': unique_visitors[url['id']],
+                'clicks_last_7d': sum(daily.get(day, 0) for day in days),
+                'clicks_by_date': [{'date': day, 'count': daily.get(day, 0)} for day in days],
+                'top_country': {'country': top_country[0] or 'Unknown', 'count': top_country[1]} if top_country else None,
+            })
+        
+        return Response({'summaries': summaries})
+    
+    @action(detail=False, methods=['get'])
+    @conditional_response(dashboard_etag)
+    @cached_analytics('compare', dashboard_scope)
+    def compare(self, request):
+        """Compare the clicks, breakdowns and A/B variants of several URLs over the same window."""
+        user = request.user
+        urls = ShortenedURL.objects.all() if is_admin_user(user) else ShortenedURL.objects.filter(user=user)
+        
+        try:
+            url_ids = parse_url_ids(request.query_params.get('ids', ''))
+        except ValueError:
+            return Response({"error": "ids must be a comma separated list of URL ids"}, status=status.HTTP_400_BAD_REQUEST)
+        if not MIN_COMPARE_URLS <= len(url_ids) <= MAX_COMPARE_URLS:
+            return Response(
+                {"error": f"Between {MIN_COMPARE_URLS} and {MAX_COMPARE_URLS} URLs can be compared"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            days = int(request.query_params.get('days', DEFAULT_COMPARE_DAYS))
+        except ValueError:
+            return Response({"error": "days must be a whole number"}, status=status.HTTP_400_BAD_REQUEST)
+        days = max(1, min(days, MAX_COMPARE_DAYS))
+        
+        urls = urls_in_order(urls, url_ids, 'short_code', 'title', 'access_count', 'is_ab_test')
+        if urls is None:
+            return Response({"error": "One or more URLs were not found"}, status=status.HTTP_404_NOT_FOUND)
+        
+        # Every figure comes from one query grouped by URL, so the cost doesn't grow with the number of links
+        source = ClickSource(url_id__in=url_ids)
+        since = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days - 1)
+        dates = [since.date() + timedelta(days=day) for day in range(days)]
+        clicks_by_date = source.clicks_by_url_and_date(since)
+        dimension_counts = source.dimension_counts_by_url(ROLLUP_DIMENSIONS, since)
+        variants = {}
+        for variant in ABTestVariant.objects.filter(shortened_url_id__in=url_ids).values(
+            'id', 'shortened_url_id', 'name', 'weight', 'destination_url', 'access_count', 'conversion_count'
+        ):
+            variant['conversion_rate'] = (
+                round(variant['conversion_count'] / variant['access_count'] * 100, 2) if variant['access_count'] else 0
+            )
+            variants.setdefault(variant.pop('shortened_url_id'), []).append(variant)
+        
+        # Breakdowns share the values clicked most across all the links, in the same order for each
+        no_counts = {dimension: Counter() for dimension in ROLLUP_DIMENSIONS}
+        dimension_values = {}
+        for dimension in ROLLUP_DIMENSIONS:
+            totals = sum((counts[dimension] for counts in dimension_counts.values()), Counter())
+            dimension_values[dimension] = [value for value, count in totals.most_common(COMPARE_DIMENSION_VALUES)]
+        
+        compared = []
+        for url in urls:
+            daily = clicks_by_date.get(url['id'], {})
+            counts = dimension_counts.get(url['id'], no_counts)
+            compared.append({
+                'id': url['id'],
+                'short_code': url['short_code'],
+                'title': url['title'],
+                'total_clicks': url['access_count'],
+                'clicks': sum(daily.get(date, 0) for date in dates),
+                'clicks_by_date': [daily.get(date, 0) for date in dates],
+                **{
+                    f'clicks_by_{dimension}': [counts[dimension][value] for value in dimension_values[dimension]]
+                    for dimension in ROLLUP_DIMENSIONS
+                },
+                'is_ab_test': url['is_ab_test'],
+                'variants': variants.get(url['id'], []),
+            })
+        
+        return Response({
+            'start': dates[0],
+            'end': dates[-1],
+            'dates': dates,
+            # The values each link's clicks_by_<dimension> counts line up with, reported
+            # the way the single-link breakdowns report missing values
+            'dimensions': {
+                dimension: [value or ('Unknown' if dimension == 'country' else None) for value in values]
+                for dimension, values in dimension_values.items()
+            },
+            'urls': compared,
+        })
+    
+    @action(detail=False, methods=['get'])
+    def cache_stats(self, request):
+        """Get hit rates and compute times for the analytics result cache (admin only)."""
+        if not is_admin_user(request.user):
+            return Response(status=status.HTTP_403_FORBIDDEN)
+        
+        return Response(get_analytics_cache_stats(CACHED_ANALYTICS_ENDPOINTS))
+    
     @action(detail=False, methods=['post'], permission_classes=[permissions.AllowAny])
     def track_funnel(self, request):
         """Track funnel steps for analytics."""
@@ -530,6 +946,9 @@ class AnalyticsViewSet(viewsets.ViewSet):
                 session.completed_action = True
                 session.save(update_fields=['completed_action'])
             
+            # Funnel figures are part of the owner's analytics responses
+            bump_user_cache_version(url.user_id)
+            
             return Response({"success": True}, status=status.HTTP_200_OK)
             
         except ShortenedURL.DoesNotExist:
@@ -542,3 +961,151 @@ class AnalyticsViewSet(viewsets.ViewSet):
                 {"error": str(e)}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+    
+    @action(
+        detail=False, methods=['post'], permission_classes=[permissions.AllowAny],
+        parser_classes=[JSONParser, PlainTextJSONParser], url_path='track_funnel/batch', url_name='track-funnel-batch'
+    )
+    def track_funnel_batch(self, request):
+        """
+        Track many funnel steps at once, e.g. from navigator.sendBeacon.
+        
+        With ?buffered=true (or "buffered": true in the body) the events are
+        acknowledged straight away and applied by Celery when it's available.
+        """
+        try:
+            events = parse_funnel_events(request.data)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        buffered = request.query_params.get('buffered') == 'true' or (
+            isinstance(request.data, dict) and request.data.get('buffered') is True
+        )
+        if buffered and start_funnel_events_task(events):
+            return Response({"success": True, "queued": len(events)}, status=status.HTTP_202_ACCEPTED)
+        
+        applied, unknown_short_codes = apply_funnel_events(events)
+        return Response({
+            "success": True,
+            "applied": applied,
+            "unknown_short_codes": unknown_short_codes
+        }, status=status.HTTP_200_OK)
+
+
+class ClickExportJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """ViewSet for background click exports, written to a compressed file for later download."""
+    
+    serializer_class = ClickExportJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        """Get export jobs for the current user."""
+        return ClickExportJob.objects.filter(user=self.request.user)
+    
+    def create(self, request):
+        """Start an export of a URL's clicks, or of all the user's clicks when no URL is given."""
+        user = request.user
+        try:
+            options = parse_export_options(request.data)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        url = None
+        if request.data.get('url'):
+            url = ShortenedURL.objects.filter(pk=request.data.get('url')).first()
+            if url is None or (url.user_id != user.id and not is_admin_user(user)):
+                return Response({"error": "URL not found"}, status=status.HTTP_404_NOT_FOUND)
+        
+        job = ClickExportJob.objects.create(
+            user=user,
+            url=url,
+            file_format=options['file_format'],
+            columns=options['columns'],
+            start_date=options['start'],
+            end_date=options['end']
+        )
+        start_export_job(job)
+        job.refresh_from_db()
+        
+        return Response(self.get_serializer(job).data, status=status.HTTP_202_ACCEPTED)
+    
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """Download a finished export as a gzip file."""
+        job = self.get_object()
+        if job.status != 'completed':
+            return Response({"error": "Export is not ready", "status": job.status}, status=status.HTTP_409_CONFLICT)
+        if not os.path.exists(job.file_path):
+            return Response({"error": "Export file is no longer available"}, status=status.HTTP_410_GONE)
+        
+        label = job.url.short_code if job.url else 'all'
+        return FileResponse(
+            open(job.file_path, 'rb'),
+            as_attachment=True,
+            filename=export_filename(label, job.file_format, compressed=True),
+            content_type='application/gzip'
+        )
+
+
+class AnalyticsReportJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """ViewSet for analytics report workbooks, generated in the background and polled for."""
+    
+    serializer_class = AnalyticsReportJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        """Get report jobs for the current user."""
+        return AnalyticsReportJob.objects.filter(user=self.request.user)
+    
+    def create(self, request):
+        """Request a report on some or all of the user's links, reusing an identical one if there is one."""
+        user = request.user
+        try:
+            options = parse_report_options(request.data)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        scope_user_id = user.id
+        if options['url_ids']:
+            urls = ShortenedURL.objects.filter(pk__in=options['url_ids'])
+            if is_admin_user(user):
+                # The links may belong to anyone, so the report follows every user's data
+                scope_user_id = None
+            else:
+                urls = urls.filter(user=user)
+            if urls.count() != len(options['url_ids']):
+                return Response({"error": "One or more URLs were not found"}, status=status.HTTP_404_NOT_FOUND)
+        
+        content_key = report_content_key(user, options, scope_user_id)
+        existing = self.get_queryset().filter(content_key=content_key).exclude(status='failed').first()
+        if existing is not None and (existing.status != 'completed' or os.path.exists(existing.file_path)):
+            return Response(self.get_serializer(existing).data, status=status.HTTP_200_OK)
+        
+        job = AnalyticsReportJob.objects.create(
+            user=user,
+            url_ids=options['url_ids'],
+            file_format=options['file_format'],
+            start_date=options['start'],
+            end_date=options['end'],
+            content_key=content_key
+        )
+        start_report_job(job)
+        job.refresh_from_db()
+        
+        return Response(self.get_serializer(job).data, status=status.HTTP_202_ACCEPTED)
+    
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """Download a finished report."""
+        job = self.get_object()
+        if job.status != 'completed':
+            return Response({"error": "Report is not ready", "status": job.status}, status=status.HTTP_409_CONFLICT)
+        if not os.path.exists(job.file_path):
+            return Response({"error": "Report file is no longer available"}, status=status.HTTP_410_GONE)
+        
+        return FileResponse(
+            open(job.file_path, 'rb'),
+            as_attachment=True,
+            filename=report_filename(job),
+            content_type=REPORT_FORMATS[job.file_format][1]
+        )
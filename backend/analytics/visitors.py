@@ -0,0 +1,222 @@
+"""
+Visitor identification and batched session visits.
+
+A visitor is identified by a signed first-party cookie, falling back to a
+hash of their IP address and user agent when the cookie is missing (the
+cookie is then set to that same id, so both agree on later visits). Each
+visitor has one UserSession per URL, whose session id is derived from the
+visitor id and the URL.
+
+A visitor's first click on a URL creates their session straight away, so
+funnel tracking can find it. With a shared cache (settings.SHARED_CACHE),
+repeat clicks are counted in the cache, under keys for the
+SESSION_FLUSH_INTERVAL they fall in, so every process sees them and none are
+lost when a process exits. A periodic task writes each interval once it has
+ended, in batched updates that fold all the clicks a session got in the
+interval into a single row update. Intervals the task hasn't written within
+SESSION_VISIT_RETENTION expire from the cache.
+
+A per-process cache would hide the buffered clicks from the task, so without
+a shared cache each repeat click updates its session straight away.
+"""
+import hashlib
+import logging
+import time
+import uuid
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+
+from .models import UserSession
+
+logger = logging.getLogger(__name__)
+
+VISITOR_COOKIE = 'urlbriefr_visitor'
+VISITOR_COOKIE_SALT = 'analytics.visitor'
+VISITOR_COOKIE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Seconds of visits buffered under one set of cache keys
+SESSION_FLUSH_INTERVAL = 60
+
+# How long buffered visits wait in the cache to be written
+SESSION_VISIT_RETENTION = 60 * 60
+
+# Sessions read from the cache and written per batch
+SESSION_FLUSH_SIZE = 500
+
+# How long a session is remembered as existing, sparing the lookup on repeat clicks
+KNOWN_SESSION_TIMEOUT = 24 * 60 * 60
+
+
+def identify_visitor(request, ip_address, user_agent):
+    """
+    Get the visitor id for a request.
+
+    Returns (visitor_id, is_new), where is_new means the visitor cookie
+    should be set on the response.
+    """
+    visitor_id = request.get_signed_cookie(VISITOR_COOKIE, default=None, salt=VISITOR_COOKIE_SALT)
+    if visitor_id:
+        return visitor_id, False
+    if ip_address or user_agent:
+        return hashlib.sha256(f"{ip_address}|{user_agent}".encode()).hexdigest()[:32], True
+    return uuid.uuid4().hex, True
+
+
+def set_visitor_cookie(request, response, visitor_id):
+    """Remember a visitor id in a signed cookie."""
+    response.set_signed_cookie(
+        VISITOR_COOKIE, visitor_id, salt=VISITOR_COOKIE_SALT, max_age=VISITOR_COOKIE_MAX_AGE,
+        httponly=True, samesite='Lax', secure=request.is_secure()
+    )
+
+
+def visitor_session_id(visitor_id, url_id):
+    """Session id of a visitor's session on a URL."""
+    return hashlib.sha256(f"{visitor_id}:{url_id}".encode()).hexdigest()[:32]
+
+
+def _interval(timestamp):
+    return int(timestamp // SESSION_FLUSH_INTERVAL)
+
+
+def _visit_count_key(interval, url_id, session_id):
+    return f"session_visits_{interval}_{url_id}_{session_id}"
+
+
+def _last_visit_key(interval, url_id, session_id):
+    return f"session_last_visit_{interval}_{url_id}_{session_id}"
+
+
+def _slot_count_key(interval):
+    return f"session_visit_slots_{interval}"
+
+
+def _slot_key(interval, slot):
+    return f"session_visit_slot_{interval}_{slot}"
+
+
+def buffer_session_visit(url_id, session_id, when):
+    """Count a repeat visit to a session in the cache, under the current interval's keys."""
+    interval = _interval(time.time())
+    cache.set(_last_visit_key(interval, url_id, session_id), when, SESSION_VISIT_RETENTION)
+    if cache.add(_visit_count_key(interval, url_id, session_id), 1, SESSION_VISIT_RETENTION):
+        # A session's first visit in the interval takes a numbered slot, so the flush can find it
+        slots_key = _slot_count_key(interval)
+        cache.add(slots_key, 0, SESSION_VISIT_RETENTION)
+        cache.set(_slot_key(interval, cache.incr(slots_key)), (url_id, session_id), SESSION_VISIT_RETENTION)
+        return
+    try:
+        cache.incr(_visit_count_key(interval, url_id, session_id))
+    except ValueError:
+        # Evicted from the cache since the add, which loses the session's visits in this interval
+        logger.warning(f"Buffered visits of session {session_id} were evicted before being written")
+
+
+def write_session_visits(visits):
+    """
+    Add visits to their sessions in one lookup and one batched update.
+
+    visits maps (url_id, session_id) to (count, last_visit). Returns the
+    sessions updated.
+    """
+    if not visits:
+        return 0
+
+    sessions = UserSession.objects.filter(
+        url_id__in={url_id for url_id, session_id in visits},
+        session_id__in={session_id for url_id, session_id in visits}
+    ).values_list('id', 'url_id', 'session_id')
+
+    updates = []
+    for session_pk, url_id, session_id in sessions:
+        pending = visits.get((url_id, session_id))
+        if pending:
+            count, last_visit = pending
+            updates.append(UserSession(pk=session_pk, visit_count=F('visit_count') + count, last_visit=last_visit))
+    UserSession.objects.bulk_update(updates, ['visit_count', 'last_visit'], batch_size=SESSION_FLUSH_SIZE)
+    return len(updates)
+
+
+def _flush_interval(interval):
+    """Write and forget the visits buffered under an interval's keys. Returns the sessions updated."""
+    slot_count = cache.get(_slot_count_key(interval), 0)
+    updated = 0
+    for first_slot in range(1, slot_count + 1, SESSION_FLUSH_SIZE):
+        slot_keys = [_slot_key(interval, slot) for slot in range(first_slot, min(first_slot + SESSION_FLUSH_SIZE, slot_count + 1))]
+        sessions = list(cache.get_many(slot_keys).values())
+        count_keys = {session: _visit_count_key(interval, *session) for session in sessions}
+        last_visit_keys = {session: _last_visit_key(interval, *session) for session in sessions}
+        counts = cache.get_many(list(count_keys.values()))
+        last_visits = cache.get_many(list(last_visit_keys.values()))
+
+        # A session whose last visit was evicted is counted as last seen when the interval ended
+        interval_end = datetime.fromtimestamp((interval + 1) * SESSION_FLUSH_INTERVAL, tz=dt_timezone.utc)
+        updated += write_session_visits({
+            session: (counts[count_keys[session]], last_visits.get(last_visit_keys[session], interval_end))
+            for session in sessions if count_keys[session] in counts
+        })
+        cache.delete_many(slot_keys + list(count_keys.values()) + list(last_visit_keys.values()))
+    cache.delete(_slot_count_key(interval))
+    return updated
+
+
+def flush_session_visits(now=None):
+    """
+    Write the session visits buffered in every interval that has ended. Returns the sessions updated.
+
+    Runs from a periodic task. Each interval is claimed by one flush, so
+    overlapping runs never count a visit twice, and an interval whose write
+    fails is left for the next run.
+    """
+    now = time.time() if now is None else now
+    # The interval that just ended is left a little longer for clicks still being recorded in it
+    last = _interval(now) - 1
+    updated = 0
+    for interval in range(_interval(now - SESSION_VISIT_RETENTION), last):
+        claim_key = f"session_visits_claimed_{interval}"
+        if not cache.add(claim_key, True, SESSION_VISIT_RETENTION * 2):
+            continue
+        try:
+            updated += _flush_interval(interval)
+        except Exception:
+            cache.delete(claim_key)
+            raise
+    return updated
+
+
+def record_session_visit(url, session_id, visitor_id, ip_address=None, user_agent=None, device_info=None, when=None):
+    """
+    Count a visit to a URL towards the visitor's session.
+
+    The first visit creates the session; later ones are buffered in the
+    cache and written in batches by flush_session_visits, or written at once
+    without a shared cache. device_info holds the browser, device and os
+    fields stored with a new session.
+    """
+    when = when or timezone.now()
+    if cache.add(f"known_session_{url.id}_{session_id}", True, KNOWN_SESSION_TIMEOUT):
+        _, created = UserSession.objects.get_or_create(
+            url=url,
+            session_id=session_id,
+            defaults={
+                'visitor_id': visitor_id,
+                'ip_address': ip_address,
+                'user_agent': user_agent,
+                'first_visit': when,
+                'last_visit': when,
+                **(device_info or {})
+            }
+        )
+        if created:
+            return
+
+    if not settings.SHARED_CACHE:
+        UserSession.objects.filter(url_id=url.id, session_id=session_id).update(
+            visit_count=F('visit_count') + 1, last_visit=when
+        )
+        return
+    buffer_session_visit(url.id, session_id, when)
@@ -12,4 +12,16 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'shortener.tasks.deactivate_expired_urls',
         'schedule': 60 * 60,  # Run every hour
     },
+    'flush-session-visits': {
+        'task': 'analytics.tasks.flush_session_visits_task',
+        'schedule': 60,  # Run every minute, before buffered visits expire from the cache
+    },
+    'merge-site-visitor-sketches': {
+        'task': 'analytics.tasks.merge_site_visitor_sketches_task',
+        'schedule': 5 * 60,  # Run every five minutes
+    },
+    'compact-click-rollups': {
+        'task': 'analytics.tasks.compact_click_rollups_task',
+        'schedule': 5 * 60,  # Run every five minutes, keeping the raw tail short
+    },
 } 
\ No newline at end of file
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import ShortenedURL, Tag, ABTestVariant
+from .models import ShortenedURL, Tag, Folder, ABTestVariant
 
 @admin.register(ShortenedURL)
 class ShortenedURLAdmin(admin.ModelAdmin):
@@ -48,6 +48,15 @@ class TagAdmin(admin.ModelAdmin):
     
     url_count.short_description = 'URLs Count'
 
+@admin.register(Folder)
+class FolderAdmin(admin.ModelAdmin):
+    """Admin interface for Folder model."""
+    
+    list_display = ('name', 'user', 'url_count', 'created_at')
+    list_filter = ('created_at',)
+    search_fields = ('name', 'user__email')
+    readonly_fields = ('url_count', 'created_at')
+
 @admin.register(ABTestVariant)
 class ABTestVariantAdmin(admin.ModelAdmin):
     """Admin interface for ABTestVariant model."""
@@ -0,0 +1,145 @@
+"""
+Per-user versioned response cache.
+
+Every user has a version counter in the cache. Cached responses are keyed by
+that version, so bumping it on any write to the user's URLs, folders, tags or
+IP restrictions invalidates all of their cached responses at once. A global
+version is bumped alongside it for responses that span every user's data.
+
+Responses are only cached with a shared cache (settings.SHARED_CACHE). In a
+per-process cache a write would only bump the version of the process that
+handled it, and the others would keep serving what they had cached.
+"""
+import functools
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+from urlbriefr.conditional import make_etag, etag_matches, set_validator_headers, time_bucket
+
+logger = logging.getLogger(__name__)
+
+# How long cached responses are kept if the version never changes
+USER_RESPONSE_CACHE_TIMEOUT = 60 * 60
+
+# Version counters must outlive the responses keyed by them
+USER_CACHE_VERSION_TIMEOUT = USER_RESPONSE_CACHE_TIMEOUT * 24
+
+
+def _version_key(user_id):
+    if user_id is None:
+        return "global_cache_version"
+    return f"user_cache_version_{user_id}"
+
+
+def get_user_cache_version(user_id):
+    """Get the current cache version for a user, or the global version when user_id is None."""
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        # Start from the current time so a counter lost to eviction can never
+        # line up with versions that were handed out before it
+        cache.add(key, int(time.time() * 1000), USER_CACHE_VERSION_TIMEOUT)
+        version = cache.get(key)
+    return version
+
+
+def _bump_version(user_id):
+    try:
+        cache.incr(_version_key(user_id))
+    except ValueError:
+        # The counter was never set or has been evicted
+        get_user_cache_version(user_id)
+
+
+def bump_user_cache_version(user_id):
+    """Invalidate every cached response for a user, and those spanning all users."""
+    if user_id:
+        _bump_version(user_id)
+    _bump_version(None)
+
+
+def bump_user_cache_versions(user_ids):
+    """Invalidate cached responses for several users, e.g. after a bulk update."""
+    for user_id in set(user_ids):
+        if user_id:
+            _bump_version(user_id)
+    _bump_version(None)
+
+
+def record_cache_event(name, hit):
+    """Count a hit or miss for a cached endpoint."""
+    key = f"user_response_cache_{'hits' if hit else 'misses'}_{name}"
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def get_cache_stats(names):
+    """Get hit/miss counts and hit rate for cached endpoints."""
+    stats = {}
+    for name in names:
+        hits = cache.get(f"user_response_cache_hits_{name}", 0)
+        misses = cache.get(f"user_response_cache_misses_{name}", 0)
+        total = hits + misses
+        stats[name] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / total * 100, 2) if total > 0 else 0
+        }
+    return stats
+
+
+def _is_admin(user):
+    return user.is_superuser or (hasattr(user, 'is_admin') and user.is_admin)
+
+
+def cached_user_response(name, bucket_seconds=None):
+    """
+    Cache a viewset method's response data per user until their version changes.
+
+    Responses carry an ETag derived from the user's version, so clients that
+    send If-None-Match get a 304 without any database work. Responses that
+    also depend on the clock pass bucket_seconds, which adds the current time
+    bucket to the cache key and ETag. Admin responses span other users' data
+    and are never cached, and nothing is cached without a shared cache.
+    """
+    def decorator(view_method):
+        @functools.wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            user = request.user
+            if request.method != 'GET' or not user.is_authenticated or _is_admin(user) or not settings.SHARED_CACHE:
+                return view_method(self, request, *args, **kwargs)
+
+            version = get_user_cache_version(user.id)
+            path_hash = hashlib.md5(request.get_full_path().encode()).hexdigest()
+            cache_key = f"user_response_{user.id}_{version}_{name}_{path_hash}"
+            if bucket_seconds:
+                cache_key = f"{cache_key}_{time_bucket(bucket_seconds)}"
+            etag = make_etag(cache_key, request.accepted_media_type)
+
+            if etag_matches(request, etag):
+                record_cache_event(name, hit=True)
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            else:
+                data = cache.get(cache_key)
+                if data is not None:
+                    record_cache_event(name, hit=True)
+                    response = Response(data)
+                else:
+                    record_cache_event(name, hit=False)
+                    response = view_method(self, request, *args, **kwargs)
+                    if response.status_code != status.HTTP_200_OK:
+                        return response
+                    cache.set(cache_key, response.data, USER_RESPONSE_CACHE_TIMEOUT)
+
+            return set_validator_headers(response, etag)
+        return wrapper
+    return decorator
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+from shortener.models import URLStats, HourlyClickCount
+from analytics.models import ClickEvent
+
+class Command(BaseCommand):
+    help = 'Recompute the incrementally maintained URL stats and hourly click counts'
+
+    def handle(self, *args, **options):
+        stats_count = URLStats.reconcile_all()
+        self.stdout.write(self.style.SUCCESS(f'Reconciled {stats_count} URL stats rows'))
+        
+        # Rebuild the hourly click buckets from the raw click events, estimated for sampled links
+        since = (timezone.now() - HourlyClickCount.RETENTION).replace(minute=0, second=0, microsecond=0)
+        recent_clicks = ClickEvent.objects.filter(timestamp__gte=since).annotate(hour=TruncHour('timestamp'))
+        
+        # Clicks on URLs without an owner go to the buckets with no user
+        buckets = [
+            HourlyClickCount(user_id=row['url__user_id'], hour=row['hour'], clicks=row['clicks'])
+            for row in recent_clicks.values('url__user_id', 'hour')
+                                    .annotate(clicks=Sum('weight'))
+                                    .order_by()
+        ]
+        
+        with transaction.atomic():
+            HourlyClickCount.objects.all().delete()
+            HourlyClickCount.objects.bulk_create(buckets)
+        
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(buckets)} hourly click buckets'))
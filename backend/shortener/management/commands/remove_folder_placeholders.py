@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from shortener.models import ShortenedURL
+
+# Title the frontend used for placeholder URLs that only existed to keep a folder alive
+FOLDER_PLACEHOLDER_TITLE = 'Temporary URL for folder creation'
+
+class Command(BaseCommand):
+    help = 'Delete the placeholder URLs that kept empty folders alive before folders were stored on their own'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='Only remove placeholders owned by this user id')
+        parser.add_argument('--dry-run', action='store_true', help='Report how many placeholders would be removed')
+
+    def handle(self, *args, **options):
+        placeholders = ShortenedURL.objects.filter(title=FOLDER_PLACEHOLDER_TITLE, access_count=0)
+        if options['user']:
+            placeholders = placeholders.filter(user_id=options['user'])
+
+        if options['dry_run']:
+            self.stdout.write(f'{placeholders.count()} folder placeholder URLs would be removed')
+            return
+
+        # Deleted through the ORM so the delete signals keep folder and stats counters in sync
+        count = placeholders.delete()[1].get('shortener.ShortenedURL', 0)
+        self.stdout.write(self.style.SUCCESS(f'Removed {count} folder placeholder URLs'))
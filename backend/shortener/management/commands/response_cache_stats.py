@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from shortener.cache import get_cache_stats
+
+class Command(BaseCommand):
+    help = 'Show hit rates for the per-user response cache'
+
+    def handle(self, *args, **options):
+        stats = get_cache_stats(['url_list', 'url_stats', 'folders', 'tag_list'])
+        
+        for name, counts in stats.items():
+            self.stdout.write(
+                f"{name}: {counts['hits']} hits, {counts['misses']} misses ({counts['hit_rate']}% hit rate)"
+            )
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.2 on 2026-10-19 04:23
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_folders(apps, schema_editor):
+    """
+    Create Folder rows from the existing folder strings on ShortenedURL.
+    
+    Placeholder URLs the frontend made to keep empty folders alive are
+    counted like any other URL; the remove_folder_placeholders command
+    deletes them explicitly.
+    """
+    ShortenedURL = apps.get_model('shortener', 'ShortenedURL')
+    Folder = apps.get_model('shortener', 'Folder')
+    
+    folder_rows = ShortenedURL.objects.filter(
+        user__isnull=False
+    ).exclude(
+        folder__isnull=True
+    ).exclude(
+        folder=''
+    ).values('user_id', 'folder').annotate(
+        url_count=Count('id')
+    )
+    
+    Folder.objects.bulk_create([
+        Folder(user_id=row['user_id'], name=row['folder'][:100], url_count=row['url_count'])
+        for row in folder_rows
+    ], ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0011_malwaredetectionresult_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Folder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('url_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='folders', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['name'],
+                'unique_together': {('name', 'user')},
+            },
+        ),
+        migrations.RunPython(populate_folders, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.2 on 2026-10-19 04:27
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0012_folder'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HourlyClickCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('clicks', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-hour'],
+            },
+        ),
+        migrations.CreateModel(
+            name='URLStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_urls', models.IntegerField(default=0)),
+                ('active_urls', models.IntegerField(default=0)),
+                ('secured_urls', models.IntegerField(default=0)),
+                ('cloned_urls', models.IntegerField(default=0)),
+                ('total_clicks', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'URL stats',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='shortenedurl',
+            index=models.Index(fields=['is_active', 'expires_at'], name='shortener_s_is_acti_3ffe01_idx'),
+        ),
+        migrations.AddField(
+            model_name='hourlyclickcount',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='hourly_click_counts', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='urlstats',
+            name='user',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='url_stats', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name='hourlyclickcount',
+            unique_together={('user', 'hour')},
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.2 on 2026-10-19 05:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0013_urlstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shortenedurl',
+            name='daily_clicks',
+            field=models.BinaryField(default=bytes),
+        ),
+        migrations.AddField(
+            model_name='shortenedurl',
+            name='daily_clicks_day',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+    ]
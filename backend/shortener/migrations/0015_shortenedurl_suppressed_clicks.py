@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-19 05:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0014_shortenedurl_daily_clicks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shortenedurl',
+            name='suppressed_clicks',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
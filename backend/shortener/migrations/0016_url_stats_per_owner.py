@@ -0,0 +1,54 @@
+# Generated by Django 5.2.2 on 2026-10-19 05:42
+
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count, Q, Sum
+
+
+def split_global_rows(apps, schema_editor):
+    """
+    Turn the rows that held totals for all URLs into rows for URLs without an
+    owner, and build every user's stats row, since totals for all URLs now add
+    up the rows.
+    """
+    ShortenedURL = apps.get_model('shortener', 'ShortenedURL')
+    URLStats = apps.get_model('shortener', 'URLStats')
+    HourlyClickCount = apps.get_model('shortener', 'HourlyClickCount')
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+
+    aggregates = {
+        'total_urls': Count('id'),
+        'active_urls': Count('id', filter=Q(is_active=True)),
+        'secured_urls': Count('id', filter=Q(enable_ip_restrictions=True) | Q(spoofing_protection=True)),
+        'cloned_urls': Count('id', filter=Q(cloned_from__isnull=False)),
+        'total_clicks': Sum('access_count'),
+    }
+    # URLs of users that no longer exist have nowhere to be counted
+    owned = Q(user__isnull=True) | Q(user_id__in=User.objects.values('pk'))
+    URLStats.objects.all().delete()
+    URLStats.objects.bulk_create([
+        URLStats(user_id=row.pop('user_id'), **{field: value or 0 for field, value in row.items()})
+        for row in ShortenedURL.objects.filter(owned).values('user_id').annotate(**aggregates).order_by()
+    ])
+
+    # What is left of an hour's global count once its owners' buckets are taken out
+    owned_clicks = dict(
+        HourlyClickCount.objects.filter(user__isnull=False).values('hour').annotate(
+            clicks=Sum('clicks')
+        ).order_by().values_list('hour', 'clicks')
+    )
+    for bucket in HourlyClickCount.objects.filter(user__isnull=True):
+        bucket.clicks = max(bucket.clicks - owned_clicks.get(bucket.hour, 0), 0)
+        bucket.save(update_fields=['clicks'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shortener', '0015_shortenedurl_suppressed_clicks'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(split_global_rows, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,21 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Q, Count, Sum
 from django.conf import settings
 import string
 import random
+from collections import Counter
+from datetime import timedelta
 from django.utils import timezone
 import hashlib
 import ipaddress
+from . import sparkline
+from .cache import bump_user_cache_version, bump_user_cache_versions
+
+# ShortenedURL fields whose changes feed the folder and stats counters
+TRACKED_FIELDS = (
+    'user_id', 'folder', 'is_active', 'enable_ip_restrictions',
+    'spoofing_protection', 'cloned_from_id', 'access_count'
+)
 
 def generate_short_code(length=6):
     """Generate a random short code for URL."""
@@ -31,6 +42,223 @@ class Tag(models.Model):
         return self.name
 
 
+class Folder(models.Model):
+    """Model to store folders for organizing URLs."""
+    name = models.CharField(max_length=100)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='folders'
+    )
+    # Denormalised number of URLs filed in this folder
+    url_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        unique_together = ('name', 'user')
+        ordering = ['name']
+    
+    def __str__(self):
+        return self.name
+    
+    @classmethod
+    def adjust_url_count(cls, user_id, name, delta):
+        """Adjust the URL count of a user's folder, creating the folder if needed."""
+        if not user_id or not name:
+            return
+        
+        if delta > 0:
+            folder, _ = cls.objects.get_or_create(user_id=user_id, name=name)
+            cls.objects.filter(pk=folder.pk).update(url_count=F('url_count') + delta)
+        else:
+            # Never let the counter drop below zero
+            cls.objects.filter(
+                user_id=user_id, name=name, url_count__gte=-delta
+            ).update(url_count=F('url_count') + delta)
+        
+        bump_user_cache_version(user_id)
+
+
+class URLStats(models.Model):
+    """
+    Incrementally maintained URL statistics for a user, or for URLs without an
+    owner when user is null. Totals for all URLs add up every row, so no
+    single row is written by every change.
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='url_stats',
+        null=True,
+        blank=True
+    )
+    total_urls = models.IntegerField(default=0)
+    active_urls = models.IntegerField(default=0)
+    secured_urls = models.IntegerField(default=0)
+    cloned_urls = models.IntegerField(default=0)
+    total_clicks = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name_plural = 'URL stats'
+    
+    def __str__(self):
+        return f"Stats for {self.user or 'all URLs'}"
+    
+    @staticmethod
+    def aggregates():
+        """Aggregate expressions that compute every counter from ShortenedURL rows."""
+        return {
+            'total_urls': Count('id'),
+            'active_urls': Count('id', filter=Q(is_active=True)),
+            'secured_urls': Count('id', filter=Q(enable_ip_restrictions=True) | Q(spoofing_protection=True)),
+            'cloned_urls': Count('id', filter=Q(cloned_from__isnull=False)),
+            'total_clicks': Sum('access_count'),
+        }
+    
+    @staticmethod
+    def contribution(values):
+        """What a single URL with the given tracked values adds to each counter."""
+        return {
+            'total_urls': 1,
+            'active_urls': int(bool(values['is_active'])),
+            'secured_urls': int(bool(values['enable_ip_restrictions'] or values['spoofing_protection'])),
+            'cloned_urls': int(values['cloned_from_id'] is not None),
+            'total_clicks': values['access_count'] or 0,
+        }
+    
+    @classmethod
+    def scope(cls, user_id):
+        """Queryset for a user's stats row, or the row for URLs without an owner when user_id is None."""
+        if user_id is None:
+            return cls.objects.filter(user__isnull=True)
+        return cls.objects.filter(user_id=user_id)
+    
+    @classmethod
+    def for_user(cls, user_id):
+        """Get the stats for a user, building their row if it doesn't exist, or the totals for all URLs when None."""
+        if user_id is None:
+            totals = cls.objects.aggregate(**{field: Sum(field) for field in cls.aggregates()})
+            return cls(**{field: value or 0 for field, value in totals.items()})
+        return cls.scope(user_id).first() or cls.reconcile(user_id)
+    
+    @classmethod
+    def record_change(cls, previous, current):
+        """Apply the difference between a URL's previous and current tracked values."""
+        deltas = {}
+        for values, sign in ((previous, -1), (current, 1)):
+            if not values:
+                continue
+            delta = deltas.setdefault(values['user_id'], Counter())
+            for field, amount in cls.contribution(values).items():
+                delta[field] += sign * amount
+        
+        for user_id, delta in deltas.items():
+            # A deleted URL may be going with its owner, whose row is already gone
+            cls.apply_delta(user_id, delta, reconcile_missing=current is not None)
+    
+    @classmethod
+    def apply_delta(cls, user_id, delta, reconcile_missing=True):
+        """
+        Add amounts to the counters of a user's stats row (or the one for URLs
+        without an owner). A missing row is rebuilt unless reconcile_missing is
+        False, in which case the delta is dropped.
+        """
+        changes = {field: F(field) + amount for field, amount in delta.items() if amount}
+        if changes and not cls.scope(user_id).update(**changes) and reconcile_missing:
+            # The change is already stored, so a missing row is built from the URLs as they are now
+            cls.reconcile(user_id)
+    
+    @classmethod
+    def reconcile(cls, user_id):
+        """Recompute the stats for a user (None for URLs without an owner) with aggregate queries."""
+        urls = ShortenedURL.objects.filter(user__isnull=True) if user_id is None else ShortenedURL.objects.filter(user_id=user_id)
+        totals = {field: value or 0 for field, value in urls.aggregate(**cls.aggregates()).items()}
+        try:
+            with transaction.atomic():
+                stats, _ = cls.objects.update_or_create(user_id=user_id, defaults=totals)
+        except IntegrityError:
+            # Another request built the row first
+            stats = cls.scope(user_id).first()
+        return stats
+    
+    @classmethod
+    def reconcile_all(cls):
+        """Recompute every user's stats and those of URLs without an owner. Returns the number of rows written."""
+        user_totals = ShortenedURL.objects.filter(
+            user__isnull=False
+        ).values('user_id').annotate(**cls.aggregates()).order_by()
+        
+        seen_users = set()
+        for row in user_totals:
+            user_id = row.pop('user_id')
+            seen_users.add(user_id)
+            cls.objects.update_or_create(
+                user_id=user_id,
+                defaults={field: value or 0 for field, value in row.items()}
+            )
+        
+        # Users whose URLs have all been deleted
+        zeroes = {field: 0 for field in cls.aggregates()}
+        cls.objects.filter(user__isnull=False).exclude(user_id__in=seen_users).update(**zeroes)
+        
+        cls.reconcile(None)
+        return len(seen_users) + 1
+
+
+class HourlyClickCount(models.Model):
+    """Clicks per hour on a user's URLs, or on URLs without an owner when user is null."""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='hourly_click_counts',
+        null=True,
+        blank=True
+    )
+    hour = models.DateTimeField()
+    clicks = models.PositiveIntegerField(default=0)
+    
+    # Buckets older than this are pruned as new ones are created
+    RETENTION = timedelta(hours=48)
+    
+    class Meta:
+        unique_together = ('user', 'hour')
+        ordering = ['-hour']
+    
+    def __str__(self):
+        return f"{self.user or 'All URLs'} - {self.hour}: {self.clicks}"
+    
+    @classmethod
+    def scope(cls, user_id):
+        if user_id is None:
+            return cls.objects.filter(user__isnull=True)
+        return cls.objects.filter(user_id=user_id)
+    
+    @classmethod
+    def record_click(cls, user_id, when=None):
+        """Count a click in the current hour for the URL owner."""
+        hour = (when or timezone.now()).replace(minute=0, second=0, microsecond=0)
+        bucket = cls.scope(user_id).filter(hour=hour)
+        if bucket.update(clicks=F('clicks') + 1):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(user_id=user_id, hour=hour, clicks=1)
+        except IntegrityError:
+            # Another request created the bucket first
+            bucket.update(clicks=F('clicks') + 1)
+            return
+        cls.scope(user_id).filter(hour__lt=hour - cls.RETENTION).delete()
+    
+    @classmethod
+    def clicks_last_24h(cls, user_id):
+        """Clicks in the last 24 hours (hourly resolution) for a user, or on all URLs when None."""
+        since = timezone.now() - timedelta(hours=24)
+        buckets = cls.objects.all() if user_id is None else cls.scope(user_id)
+        total = buckets.filter(hour__gt=since - timedelta(hours=1)).aggregate(total=Sum('clicks'))['total']
+        return total or 0
+
+
 class IPRestriction(models.Model):
     """Model to store IP restrictions for URLs."""
     TYPE_CHOICES = [
@@ -111,6 +339,12 @@ class ShortenedURL(models.Model):
     
     # Counters
     access_count = models.PositiveIntegerField(default=0)
+    # Duplicate clicks left out of every other count, see analytics/dedup.py
+    suppressed_clicks = models.PositiveIntegerField(default=0)
+    
+    # Ring buffer of daily clicks for sparklines, see sparkline.py
+    daily_clicks = models.BinaryField(default=bytes, editable=False)
+    daily_clicks_day = models.DateField(null=True, blank=True, editable=False)
     
     # Custom settings
     title = models.CharField(max_length=255, blank=True, null=True)
@@ -182,9 +416,22 @@ class ShortenedURL(models.Model):
         help_text="The original URL this was cloned from"
     )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['is_active', 'expires_at']),
+        ]
+
     def __str__(self):
         return f"{self.short_code} -> {self.original_url[:50]}..."
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored values so save() can keep folder and stats counters in sync
+        if all(field in field_names for field in TRACKED_FIELDS):
+            instance._loaded_values = {field: getattr(instance, field) for field in TRACKED_FIELDS}
+        return instance
+    
     def save(self, *args, **kwargs):
         # Generate a random short code if one is not provided
         if not self.short_code:
@@ -193,12 +440,42 @@ class ShortenedURL(models.Model):
         # Generate integrity hash if it's enabled but not set
         if self.spoofing_protection and not self.integrity_hash:
             self.generate_integrity_hash()
+        
+        previous = None
+        if not self._state.adding:
+            previous = getattr(self, '_loaded_values', None)
+            if previous is None:
+                previous = ShortenedURL.objects.filter(pk=self.pk).values(*TRACKED_FIELDS).first()
             
         super().save(*args, **kwargs)
+        
+        current = {field: getattr(self, field) for field in TRACKED_FIELDS}
+        update_fields = kwargs.get('update_fields')
+        if previous is not None and update_fields is not None:
+            # Only the listed fields were written, the rest keep their stored values
+            saved = {self._meta.get_field(name).attname for name in update_fields}
+            current = {field: current[field] if field in saved else previous[field] for field in TRACKED_FIELDS}
+        
+        self._record_tracked_changes(previous, current)
+        self._loaded_values = current
+        
         # Refresh from database to ensure we have the latest state
         if 'update_fields' not in kwargs:
             self.refresh_from_db()
     
+    @staticmethod
+    def _record_tracked_changes(previous, current):
+        """Update folder and stats counters for a change between two sets of tracked values."""
+        previous_folder = (previous['user_id'], previous['folder'] or None) if previous else None
+        current_folder = (current['user_id'], current['folder'] or None) if current else None
+        if previous_folder != current_folder:
+            if previous_folder:
+                Folder.adjust_url_count(*previous_folder, -1)
+            if current_folder:
+                Folder.adjust_url_count(*current_folder, 1)
+        
+        URLStats.record_change(previous, current)
+    
     def generate_unique_code(self):
         """Generate a unique short code that doesn't exist yet."""
         code = generate_short_code()
@@ -241,10 +518,43 @@ class ShortenedURL(models.Model):
             print(f"No expiration type provided: {getattr(self, 'expiration_type', 'None')}")
     
     def increment_counter(self):
-        """Increment access counter and update last accessed time."""
-        self.access_count += 1
+        """
+        Increment access counter and update last accessed time.
+        
+        The row is locked and its stored counter and daily click buffer are
+        built on, so concurrent clicks through stale instances don't
+        overwrite each other.
+        
+        Every click on an owner's links also updates their URLStats and
+        HourlyClickCount rows, so those are single-statement increments run
+        once the URL's lock is released: clicks on one owner's links only
+        contend on them for one UPDATE each.
+        """
         self.last_accessed = timezone.now()
-        self.save(update_fields=['access_count', 'last_accessed'])
+        today = timezone.localdate(self.last_accessed)
+        with transaction.atomic():
+            stored = ShortenedURL.objects.select_for_update().values(
+                'access_count', 'daily_clicks', 'daily_clicks_day'
+            ).get(pk=self.pk)
+            self.access_count = stored['access_count'] + 1
+            self.daily_clicks = sparkline.record_click(stored['daily_clicks'], stored['daily_clicks_day'], today)
+            self.daily_clicks_day = today
+            ShortenedURL.objects.filter(pk=self.pk).update(
+                access_count=self.access_count,
+                last_accessed=self.last_accessed,
+                daily_clicks=self.daily_clicks,
+                daily_clicks_day=today
+            )
+        if getattr(self, '_loaded_values', None) is not None:
+            self._loaded_values = {**self._loaded_values, 'access_count': self.access_count}
+        
+        URLStats.apply_delta(self.user_id, {'total_clicks': 1})
+        HourlyClickCount.record_click(self.user_id, self.last_accessed)
+        bump_user_cache_version(self.user_id)
+    
+    def daily_click_series(self, days=sparkline.SPARKLINE_DAYS):
+        """Daily clicks for the last `days` days, oldest first."""
+        return sparkline.daily_series(self.daily_clicks, self.daily_clicks_day, timezone.localdate(), days)
     
     def generate_integrity_hash(self):
         """Generate SHA-256 hash for tamper-proof verification."""
@@ -437,10 +747,18 @@ class ShortenedURL(models.Model):
             is_active=True
         )
         
-        count = expired_urls.count()
+        expired_by_user = list(
+            expired_urls.values('user_id').annotate(count=Count('id')).order_by()
+        )
+        count = sum(row['count'] for row in expired_by_user)
         if count > 0:
             expired_urls.update(is_active=False)
             
+            # Keep the active counters in step with the bulk update
+            for row in expired_by_user:
+                URLStats.apply_delta(row['user_id'], {'active_urls': -row['count']})
+            bump_user_cache_versions(row['user_id'] for row in expired_by_user)
+            
         return count
 
 
@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from .models import ShortenedURL, ABTestVariant, Tag, IPRestriction, SpoofingAttempt, MalwareDetectionResult
+from .models import ShortenedURL, ABTestVariant, Tag, Folder, IPRestriction, SpoofingAttempt, MalwareDetectionResult
+from .sparkline import SPARKLINE_LENGTHS
 from analytics.models import ClickEvent
 from django.conf import settings
 from django.utils import timezone
@@ -32,6 +33,34 @@ class TagSerializer(serializers.ModelSerializer):
             
         return super().create(validated_data)
 
+class FolderSerializer(serializers.ModelSerializer):
+    """Serializer for folders."""
+    
+    class Meta:
+        model = Folder
+        fields = ['id', 'name', 'url_count', 'created_at']
+        read_only_fields = ['id', 'url_count', 'created_at']
+    
+    def validate_name(self, value):
+        """Validate that the user doesn't already have a folder with this name."""
+        value = value.strip()
+        if not value:
+            raise serializers.ValidationError("Folder name cannot be empty.")
+        
+        user = self.context['request'].user
+        existing = Folder.objects.filter(user=user, name=value)
+        if self.instance:
+            existing = existing.exclude(pk=self.instance.pk)
+        if existing.exists():
+            raise serializers.ValidationError("A folder with this name already exists.")
+        
+        return value
+    
+    def create(self, validated_data):
+        """Create a new folder."""
+        validated_data['user'] = self.context['request'].user
+        return super().create(validated_data)
+
 class IPRestrictionSerializer(serializers.ModelSerializer):
     """Serializer for IP restrictions."""
     
@@ -137,12 +166,15 @@ class ShortenedURLSerializer(serializers.ModelSerializer):
     malware_detection = MalwareDetectionResultSerializer(read_only=True)
     malware_status = serializers.SerializerMethodField()
     
+    # Daily clicks for the last 7 or 30 days, only included when asked for with ?sparkline=7 or 30
+    sparkline = serializers.SerializerMethodField()
+    
     class Meta:
         model = ShortenedURL
         fields = [
             'id', 'original_url', 'short_code', 'full_short_url',
             'created_at', 'last_accessed', 'expires_at', 'user',
-            'access_count', 'title', 'is_custom_code', 'is_active',
+            'access_count', 'suppressed_clicks', 'title', 'is_custom_code', 'is_active',
             'is_expired', 'clicks_count', 'qr_code_url', 'is_ab_test',
             'variants', 'tags', 'tag_ids', 'folder',
             'use_redirect_page', 'redirect_page_type', 'redirect_delay',
@@ -159,14 +191,16 @@ class ShortenedURLSerializer(serializers.ModelSerializer):
             # Favorite field
             'is_favorite',
             # Malware detection fields
-            'malware_detection', 'malware_status'
+            'malware_detection', 'malware_status',
+            # Click trend
+            'sparkline'
         ]
         read_only_fields = [
             'id', 'created_at', 'last_accessed',
-            'access_count', 'full_short_url', 'is_expired',
+            'access_count', 'suppressed_clicks', 'full_short_url', 'is_expired',
             'clicks_count', 'qr_code_url', 'integrity_hash',
             'is_tampered', 'cloned_from_info', 'preview_updated_at',
-            'malware_detection', 'malware_status'
+            'malware_detection', 'malware_status', 'sparkline'
         ]
         extra_kwargs = {
             'user': {'required': False},
@@ -188,10 +222,29 @@ class ShortenedURLSerializer(serializers.ModelSerializer):
             'is_favorite': {'required': False}
         }
     
+    def get_fields(self):
+        """Leave the sparkline out unless the request asked for one."""
+        fields = super().get_fields()
+        if self.sparkline_days() is None:
+            fields.pop('sparkline')
+        return fields
+    
+    def sparkline_days(self):
+        """The sparkline length requested with ?sparkline=, or None."""
+        request = self.context.get('request')
+        days = request.query_params.get('sparkline') if request is not None and hasattr(request, 'query_params') else None
+        if days and days.isdigit() and int(days) in SPARKLINE_LENGTHS:
+            return int(days)
+        return None
+    
     def get_full_short_url(self, obj):
         """Get the full shortened URL."""
         return f"{settings.URL_SHORTENER_DOMAIN}/s/{obj.short_code}"
     
+    def get_sparkline(self, obj):
+        """Get the daily click counts from the URL's ring buffer."""
+        return obj.daily_click_series(self.sparkline_days())
+    
     def get_is_expired(self, obj):
         """Check if URL is expired."""
         return obj.is_expired()
@@ -0,0 +1,80 @@
+"""
+Signal handlers that keep denormalised shortener data in sync.
+"""
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .models import (
+    ShortenedURL, Folder, Tag, IPRestriction, ABTestVariant, MalwareDetectionResult,
+    TRACKED_FIELDS
+)
+from .cache import bump_user_cache_version, bump_user_cache_versions
+from urlbriefr.events import publish_scan_result
+
+
+@receiver(post_delete, sender=ShortenedURL)
+def release_deleted_url_counts(sender, instance, **kwargs):
+    """Remove the deleted URL from its folder's URL count and the stats counters."""
+    previous = getattr(instance, '_loaded_values', None)
+    if previous is None:
+        previous = {field: getattr(instance, field) for field in TRACKED_FIELDS}
+    ShortenedURL._record_tracked_changes(previous, None)
+
+
+@receiver(post_save, sender=ShortenedURL)
+@receiver(post_delete, sender=ShortenedURL)
+@receiver(post_save, sender=Folder)
+@receiver(post_delete, sender=Folder)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=IPRestriction)
+@receiver(post_delete, sender=IPRestriction)
+def invalidate_owner_cache(sender, instance, **kwargs):
+    """Invalidate the owner's cached responses when one of their rows changes."""
+    bump_user_cache_version(instance.user_id)
+
+
+@receiver(post_save, sender=ABTestVariant)
+@receiver(post_delete, sender=ABTestVariant)
+def invalidate_variant_owner_cache(sender, instance, **kwargs):
+    """Variants are nested in URL responses, so changes invalidate the URL owner's cache."""
+    user_id = ShortenedURL.objects.filter(
+        pk=instance.shortened_url_id
+    ).values_list('user_id', flat=True).first()
+    bump_user_cache_version(user_id)
+
+
+@receiver(post_save, sender=MalwareDetectionResult)
+def invalidate_scanned_url_owner_cache(sender, instance, **kwargs):
+    """Scan results are nested in URL responses, so new verdicts invalidate the owner's cache."""
+    bump_user_cache_versions(
+        ShortenedURL.objects.filter(malware_detection=instance).values_list('user_id', flat=True)
+    )
+
+
+@receiver(post_save, sender=MalwareDetectionResult)
+def publish_scan_status(sender, instance, update_fields=None, **kwargs):
+    """Push scan status changes to the owners of the scanned URLs."""
+    if update_fields is not None and 'status' not in update_fields:
+        return
+    for url_id, user_id in ShortenedURL.objects.filter(
+        malware_detection=instance, user__isnull=False
+    ).values_list('id', 'user_id'):
+        publish_scan_result(url_id, user_id, instance)
+
+
+@receiver(m2m_changed, sender=ShortenedURL.tags.through)
+@receiver(m2m_changed, sender=ShortenedURL.ip_restrictions.through)
+def invalidate_relation_owner_cache(sender, instance, action, reverse, pk_set, **kwargs):
+    """Invalidate cached responses when URLs gain or lose tags or IP restrictions."""
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        bump_user_cache_version(instance.user_id)
+    elif pk_set:
+        bump_user_cache_versions(
+            ShortenedURL.objects.filter(pk__in=pk_set).values_list('user_id', flat=True)
+        )
+    else:
+        # post_clear from the tag/restriction side: the owner is the same user
+        bump_user_cache_version(instance.user_id)
@@ -0,0 +1,43 @@
+"""
+Per-URL daily click ring buffers for list view sparklines.
+
+Each URL stores its last SPARKLINE_DAYS daily click counts as packed
+little-endian uint32s, oldest first, along with the day of the last slot.
+A click adds to the last slot, after shifting the buffer along by however
+many days passed since the previous click; reads shift a copy the same way,
+so days without clicks cost nothing.
+"""
+import numpy as np
+
+SPARKLINE_DAYS = 30
+
+# Series lengths clients can ask for
+SPARKLINE_LENGTHS = (7, 30)
+
+_DTYPE = np.dtype('<u4')
+
+
+def _counts(data, last_day, today):
+    """The buffer as an array whose last slot is today."""
+    counts = np.zeros(SPARKLINE_DAYS, dtype=_DTYPE)
+    if data and last_day is not None:
+        # A clock that went backwards counts towards the last slot
+        shift = max((today - last_day).days, 0)
+        if shift < SPARKLINE_DAYS:
+            end = SPARKLINE_DAYS - shift
+            # Buffers stored with another SPARKLINE_DAYS are aligned on their last day
+            stored = np.frombuffer(bytes(data), dtype=_DTYPE)[-end:]
+            counts[end - len(stored):end] = stored
+    return counts
+
+
+def record_click(data, last_day, today, clicks=1):
+    """Add clicks to today's slot, returning the packed buffer to store with today as its last day."""
+    counts = _counts(data, last_day, today)
+    counts[-1] += clicks
+    return counts.tobytes()
+
+
+def daily_series(data, last_day, today, days=SPARKLINE_DAYS):
+    """Daily click counts for the `days` days up to today, oldest first."""
+    return _counts(data, last_day, today)[-days:].tolist()
@@ -1,3 +1,541 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import time
+from unittest import mock
 
-# Create your tests here.
+import brotli
+import msgpack
+
+from asgiref.sync import sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from authentication.models import User
+from urlbriefr.events import publish_click
+from urlbriefr.middleware import CompressionMiddleware
+from urlbriefr.routing import websocket_urlpatterns
+from urlbriefr.streams import JWTQueryAuthMiddleware, event_stream
+from .cache import bump_user_cache_version, get_cache_stats, get_user_cache_version
+from .models import Folder, HourlyClickCount, MalwareDetectionResult, ShortenedURL, Tag, URLStats
+from .views import MAX_FOLDERS_PER_USER, URL_LIST_TIME_BUCKET
+
+IN_MEMORY_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class UserEventStreamTests(TestCase):
+    """Link events reach their owner's streams batched into one frame per interval."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='owner@example.com', password='password', first_name='Link', last_name='Owner', is_active=True
+        )
+        self.urls = [
+            ShortenedURL.objects.create(original_url=f'https://example.com/{i}', user=self.user)
+            for i in range(2)
+        ]
+        self.token = str(AccessToken.for_user(self.user))
+        self.application = JWTQueryAuthMiddleware(URLRouter(websocket_urlpatterns))
+
+    async def test_websocket_requires_a_token(self):
+        communicator = WebsocketCommunicator(self.application, '/ws/events/?token=not-a-token')
+        connected, code = await communicator.connect()
+        self.assertFalse(connected)
+        self.assertEqual(code, 4401)
+
+    async def test_clicks_are_coalesced_per_link(self):
+        communicator = WebsocketCommunicator(self.application, f'/ws/events/?token={self.token}')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+
+        for url in [self.urls[0]] * 5 + [self.urls[1]] * 2:
+            await sync_to_async(publish_click)(url)
+
+        frame = await communicator.receive_json_from(timeout=3)
+        self.assertEqual(frame['clicks'], {str(self.urls[0].id): 5, str(self.urls[1].id): 2})
+        self.assertTrue(await communicator.receive_nothing(timeout=1.5))
+        await communicator.disconnect()
+
+    async def test_scan_verdicts_are_pushed(self):
+        communicator = WebsocketCommunicator(self.application, f'/ws/events/?token={self.token}')
+        await communicator.connect()
+
+        def scan():
+            result = MalwareDetectionResult.objects.create(url=self.urls[0].original_url)
+            self.urls[0].malware_detection = result
+            self.urls[0].save(update_fields=['malware_detection'])
+            result.status = 'clean'
+            result.details = 'No threats found'
+            result.save()
+
+        await sync_to_async(scan)()
+        frame = await communicator.receive_json_from(timeout=3)
+        self.assertEqual(frame['scans'][str(self.urls[0].id)]['status'], 'clean')
+        await communicator.disconnect()
+
+    async def test_server_sent_events_fallback(self):
+        request = AsyncRequestFactory().get(f'/api/events/stream/?token={self.token}')
+        response = await event_stream(request)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        frames = response.streaming_content
+        self.assertTrue((await anext(frames)).startswith(b'retry:'))
+        await sync_to_async(publish_click)(self.urls[1])
+        frame = await anext(frames)
+        self.assertEqual(json.loads(frame.decode()[len('data: '):])['clicks'], {str(self.urls[1].id): 1})
+        await frames.aclose()
+
+    async def test_server_sent_events_require_a_token(self):
+        response = await event_stream(AsyncRequestFactory().get('/api/events/stream/'))
+        self.assertEqual(response.status_code, 401)
+
+    async def test_server_sent_events_are_refused_under_wsgi(self):
+        response = await event_stream(RequestFactory().get(f'/api/events/stream/?token={self.token}'))
+        self.assertEqual(response.status_code, 503)
+
+    async def test_streams_are_refused_without_a_channel_layer(self):
+        with self.settings(CHANNEL_LAYERS={}):
+            response = await event_stream(AsyncRequestFactory().get(f'/api/events/stream/?token={self.token}'))
+            self.assertEqual(response.status_code, 503)
+
+            communicator = WebsocketCommunicator(self.application, f'/ws/events/?token={self.token}')
+            connected, code = await communicator.connect()
+            self.assertFalse(connected)
+            self.assertEqual(code, 4503)
+
+
+class SparklineTests(TestCase):
+    """Daily click ring buffers are kept up to date by clicks and served without extra queries."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='owner@example.com', password='password')
+        self.url = ShortenedURL.objects.create(original_url='https://example.com', user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_clicks_fill_the_buffer_and_days_roll_over(self):
+        self.url.increment_counter()
+        self.url.increment_counter()
+        self.assertEqual(self.url.daily_click_series(7), [0, 0, 0, 0, 0, 0, 2])
+
+        # Three days without clicks
+        self.url.daily_clicks_day -= timedelta(days=3)
+        self.url.save(update_fields=['daily_clicks_day'])
+        self.url.increment_counter()
+        self.assertEqual(self.url.daily_click_series(7), [0, 0, 0, 2, 0, 0, 1])
+        self.assertEqual(self.url.daily_clicks_day, timezone.localdate())
+
+        self.url.daily_clicks_day -= timedelta(days=40)
+        self.assertEqual(self.url.daily_click_series(), [0] * 30)
+
+    def test_concurrent_clicks_are_all_counted(self):
+        first = ShortenedURL.objects.get(pk=self.url.pk)
+        second = ShortenedURL.objects.get(pk=self.url.pk)
+        first.increment_counter()
+        second.increment_counter()
+
+        self.url.refresh_from_db()
+        self.assertEqual(self.url.access_count, 2)
+        self.assertEqual(self.url.daily_click_series(7)[-1], 2)
+        self.assertEqual(URLStats.for_user(self.user.id).total_clicks, 2)
+
+    def test_list_includes_sparkline_only_when_asked(self):
+        for i in range(5):
+            ShortenedURL.objects.create(original_url=f'https://example.com/{i}', user=self.user).increment_counter()
+
+        with CaptureQueriesContext(connection) as without_sparkline:
+            response = self.client.get('/api/urls/')
+        self.assertNotIn('sparkline', response.json()[0])
+
+        with CaptureQueriesContext(connection) as with_sparkline:
+            response = self.client.get('/api/urls/?sparkline=7')
+        urls = response.json()
+        self.assertEqual(len(with_sparkline), len(without_sparkline))
+        self.assertEqual(sorted(url['sparkline'][-1] for url in urls), [0, 1, 1, 1, 1, 1])
+        self.assertTrue(all(len(url['sparkline']) == 7 for url in urls))
+
+
+class FolderCountTests(TestCase):
+    """Folder URL counts follow URLs as they are filed, moved, expired and deleted."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='owner@example.com', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def counts(self):
+        return dict(Folder.objects.filter(user=self.user).values_list('name', 'url_count'))
+
+    def test_adjust_url_count(self):
+        Folder.adjust_url_count(self.user.id, 'Work', 2)
+        self.assertEqual(self.counts(), {'Work': 2})
+        Folder.adjust_url_count(self.user.id, 'Work', -3)
+        self.assertEqual(self.counts(), {'Work': 2})
+        Folder.adjust_url_count(self.user.id, 'Work', -2)
+        Folder.adjust_url_count(self.user.id, 'Missing', -1)
+        Folder.adjust_url_count(None, 'Work', 1)
+        self.assertEqual(self.counts(), {'Work': 0})
+
+    def test_counts_follow_moves_expiry_and_deletes(self):
+        urls = [
+            ShortenedURL.objects.create(original_url=f'https://example.com/{i}', user=self.user, folder='Work')
+            for i in range(3)
+        ]
+        self.assertEqual(self.counts(), {'Work': 3})
+
+        self.client.patch(f'/api/urls/{urls[0].id}/', {'folder': 'Home'}, format='json')
+        self.assertEqual(self.counts(), {'Home': 1, 'Work': 2})
+
+        ShortenedURL.objects.filter(pk=urls[1].pk).update(expires_at=timezone.now() - timedelta(days=1))
+        ShortenedURL.deactivate_expired_urls()
+        self.assertEqual(self.counts(), {'Home': 1, 'Work': 2})
+
+        urls[1].delete()
+        self.client.delete(f'/api/urls/{urls[2].id}/')
+        self.assertEqual(self.counts(), {'Home': 1, 'Work': 0})
+
+    def test_folder_limit_applies_to_moves_and_clones(self):
+        url = ShortenedURL.objects.create(original_url='https://example.com', user=self.user)
+        for i in range(MAX_FOLDERS_PER_USER):
+            Folder.objects.create(user=self.user, name=f'Folder {i}')
+
+        response = self.client.patch(f'/api/urls/{url.id}/', {'folder': 'One too many'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(f'/api/urls/{url.id}/clone/', {'folder': 'One too many'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.patch(f'/api/urls/{url.id}/', {'folder': 'Folder 0'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Folder.objects.filter(name='One too many').exists())
+
+    def test_placeholders_are_only_removed_on_request(self):
+        ShortenedURL.objects.create(
+            original_url='https://example.com', user=self.user, folder='Empty',
+            title='Temporary URL for folder creation'
+        )
+        call_command('remove_folder_placeholders', '--dry-run', stdout=io.StringIO())
+        self.assertEqual(self.counts(), {'Empty': 1})
+        call_command('remove_folder_placeholders', stdout=io.StringIO())
+        self.assertEqual(self.counts(), {'Empty': 0})
+        self.assertFalse(ShortenedURL.objects.exists())
+
+
+class URLStatsTests(TestCase):
+    """Stats counters follow URL changes and add up to the totals for all URLs."""
+
+    FIELDS = ('total_urls', 'active_urls', 'secured_urls', 'cloned_urls', 'total_clicks')
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='owner@example.com', password='password')
+        self.other = User.objects.create_user(email='other@example.com', password='password')
+
+    def stats(self, user_id):
+        stats = URLStats.for_user(user_id)
+        return tuple(getattr(stats, field) for field in self.FIELDS)
+
+    def test_saves_apply_the_tracked_field_changes(self):
+        url = ShortenedURL.objects.create(original_url='https://example.com', user=self.user)
+        self.assertEqual(self.stats(self.user.id), (1, 1, 0, 0, 0))
+
+        url.spoofing_protection = True
+        url.save()
+        url.increment_counter()
+        url.clone(modifications={'is_active': False})
+        self.assertEqual(self.stats(self.user.id), (2, 1, 2, 1, 1))
+
+        # Saving only some fields leaves the stored values of the others in place
+        url.is_active = False
+        url.access_count = 100
+        url.save(update_fields=['is_active'])
+        self.assertEqual(self.stats(self.user.id), (2, 0, 2, 1, 1))
+
+        url.user = self.other
+        url.save()
+        self.assertEqual(self.stats(self.user.id), (1, 0, 1, 1, 0))
+        self.assertEqual(self.stats(self.other.id), (1, 0, 1, 0, 100))
+
+    def test_clicks_only_write_the_owners_rows(self):
+        url = ShortenedURL.objects.create(original_url='https://example.com', user=self.user)
+        ShortenedURL.objects.create(original_url='https://example.com/anonymous').increment_counter()
+        URLStats.for_user(self.user.id)
+
+        url.increment_counter()
+        self.assertEqual(URLStats.objects.filter(user__isnull=True).get().total_clicks, 1)
+        self.assertEqual(list(HourlyClickCount.objects.filter(user__isnull=True).values_list('clicks', flat=True)), [1])
+        self.assertEqual(self.stats(None), (2, 2, 0, 0, 2))
+        self.assertEqual(HourlyClickCount.clicks_last_24h(None), 2)
+        self.assertEqual(HourlyClickCount.clicks_last_24h(self.user.id), 1)
+
+    def test_clicks_update_the_owners_rows_after_releasing_the_url(self):
+        url = ShortenedURL.objects.create(original_url='https://example.com', user=self.user)
+        url.increment_counter()
+
+        with CaptureQueriesContext(connection) as queries:
+            url.increment_counter()
+        statements = [query['sql'] for query in queries.captured_queries]
+        owner_writes = [i for i, sql in enumerate(statements) if 'shortener_urlstats' in sql or 'shortener_hourlyclickcount' in sql]
+        # One increment per owner row, none of them inside the URL's transaction
+        self.assertEqual([statements[i].split()[0] for i in owner_writes], ['UPDATE', 'UPDATE'])
+        release = max(i for i, sql in enumerate(statements) if sql.startswith('RELEASE SAVEPOINT'))
+        self.assertGreater(min(owner_writes), release)
+        self.assertEqual(self.stats(self.user.id)[-1], 2)
+
+    def test_bulk_expiry_and_reconciliation(self):
+        for i in range(3):
+            ShortenedURL.objects.create(
+                original_url=f'https://example.com/{i}', user=self.user if i else None,
+                expires_at=timezone.now() - timedelta(days=1)
+            )
+        ShortenedURL.objects.create(original_url='https://example.com/other', user=self.other)
+
+        self.assertEqual(ShortenedURL.deactivate_expired_urls(), 3)
+        self.assertEqual(self.stats(self.user.id), (2, 0, 0, 0, 0))
+        self.assertEqual(self.stats(None), (4, 1, 0, 0, 0))
+
+        # Writes that skip save() drift until the counters are reconciled
+        ShortenedURL.objects.filter(user=self.other).update(access_count=7)
+        self.assertEqual(self.stats(self.other.id), (1, 1, 0, 0, 0))
+        call_command('reconcile_url_stats', stdout=io.StringIO())
+        self.assertEqual(self.stats(self.other.id), (1, 1, 0, 0, 7))
+        self.assertEqual(self.stats(None), (4, 1, 0, 0, 7))
+
+    def test_deleting_an_owner_drops_their_row(self):
+        for i in range(2):
+            ShortenedURL.objects.create(original_url=f'https://example.com/{i}', user=self.user)
+        ShortenedURL.objects.create(original_url='https://example.com/other', user=self.other)
+
+        user_id = self.user.id
+        self.user.delete()
+        self.assertFalse(URLStats.objects.filter(user_id=user_id).exists())
+        self.assertEqual(self.stats(None), (1, 1, 0, 0, 0))
+
+
+@override_settings(SHARED_CACHE=True)
+class UserResponseCacheTests(TestCase):
+    """Cached list, stats and folder responses are served until one of the owner's rows changes."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='owner@example.com', password='password')
+        self.other = User.objects.create_user(email='other@example.com', password='password')
+        self.url = ShortenedURL.objects.create(original_url='https://example.com', user=self.user, folder='Work')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def assertCached(self, path):
+        with self.assertNumQueries(0):
+            return self.get(path)
+
+    def test_responses_are_cached_per_user_version(self):
+        for path in ('/api/urls/', '/api/urls/stats/', '/api/urls/folders/', '/api/tags/'):
+            first = self.get(path)
+            self.assertEqual(self.assertCached(path), first)
+
+        # Another user's writes leave this user's responses alone
+        ShortenedURL.objects.create(original_url='https://example.com/other', user=self.other)
+        self.assertCached('/api/urls/')
+        self.assertEqual(get_cache_stats(['url_list'])['url_list']['hits'], 2)
+
+    def test_writes_invalidate_the_owners_responses(self):
+        self.get('/api/urls/stats/')
+        self.client.post('/api/urls/', {'original_url': 'https://example.com/new'}, format='json')
+        self.assertEqual(self.get('/api/urls/stats/')['total_urls'], 2)
+
+        self.get('/api/urls/')
+        self.url.tags.add(Tag.objects.create(user=self.user, name='News'))
+        self.assertEqual([tag['name'] for tag in self.get('/api/urls/')[-1]['tags']], ['News'])
+
+    def test_folder_renames_and_deletes_invalidate_url_responses(self):
+        folder = Folder.objects.get(user=self.user, name='Work')
+        self.get('/api/urls/')
+        self.get('/api/urls/folders/')
+
+        # Renaming moves the URLs with a queryset update, which sends no signals
+        self.client.patch(f'/api/folders/{folder.id}/', {'name': 'Office'}, format='json')
+        self.assertEqual(self.get('/api/urls/folders/'), ['Office'])
+        self.assertEqual(self.get('/api/urls/')[0]['folder'], 'Office')
+
+        self.client.delete(f'/api/folders/{folder.id}/')
+        self.assertEqual(self.get('/api/urls/folders/'), [])
+        self.assertIsNone(self.get('/api/urls/')[0]['folder'])
+
+    def test_url_lists_follow_the_clock(self):
+        first = self.client.get('/api/urls/')
+        # Expiry changes nothing stored, so the version stays the same
+        ShortenedURL.objects.filter(pk=self.url.pk).update(expires_at=timezone.now() + timedelta(seconds=1))
+        self.assertFalse(self.get('/api/urls/')[0]['is_expired'])
+
+        later = time.time() + URL_LIST_TIME_BUCKET
+        with mock.patch('urlbriefr.conditional.time.time', return_value=later), \
+                mock.patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(seconds=URL_LIST_TIME_BUCKET)):
+            response = self.client.get('/api/urls/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()[0]['is_expired'])
+
+    @override_settings(SHARED_CACHE=False)
+    def test_responses_are_not_cached_without_a_shared_cache(self):
+        self.assertNotIn('ETag', self.client.get('/api/urls/'))
+
+        # A write that bumps no version here, like one handled by another process
+        ShortenedURL.objects.filter(pk=self.url.pk).update(original_url='https://example.com/changed')
+        self.assertEqual(self.get('/api/urls/')[0]['original_url'], 'https://example.com/changed')
+
+    def test_version_survives_eviction(self):
+        version = get_user_cache_version(self.user.id)
+        cache.delete(f'user_cache_version_{self.user.id}')
+        bump_user_cache_version(self.user.id)
+        self.assertNotEqual(get_user_cache_version(self.user.id), version)
+
+
+@override_settings(SHARED_CACHE=True)
+class ConditionalResponseTests(TestCase):
+    """URL detail responses carry ETags that answer unchanged revalidations with a 304."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='owner@example.com', password='password')
+        self.url = ShortenedURL.objects.create(original_url='https://example.com', user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.path = f'/api/urls/{self.url.id}/'
+
+    def test_matching_etag_gets_a_304(self):
+        etag = self.client.get(self.path)['ETag']
+        # Only the ETag parts are looked up
+        with self.assertNumQueries(1):
+            response = self.client.get(self.path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+        response = self.client.get(self.path, HTTP_IF_NONE_MATCH=f'"stale", W/{etag}')
+        self.assertEqual(response.status_code, 304)
+
+    def test_changed_resource_gets_a_200(self):
+        etag = self.client.get(self.path)['ETag']
+        self.client.patch(self.path, {'title': 'Renamed'}, format='json')
+
+        response = self.client.get(self.path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['title'], 'Renamed')
+        self.assertNotEqual(response['ETag'], etag)
+
+    @override_settings(SHARED_CACHE=False)
+    def test_no_etag_without_a_shared_cache(self):
+        response = self.client.get(self.path)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+        # Another process's write bumps no version this process could see
+        ShortenedURL.objects.filter(pk=self.url.pk).update(title='Renamed')
+        response = self.client.get(self.path, HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['title'], 'Renamed')
+
+    def test_etag_is_stable_across_compression_and_formats(self):
+        etag = self.client.get(self.path)['ETag']
+
+        # A compressed body is a different representation of the same version, marked weak
+        compressed = self.client.get(self.path, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertEqual(compressed['ETag'], f'W/{etag}')
+        response = self.client.get(self.path, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=compressed['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        msgpack_etag = self.client.get(self.path, HTTP_ACCEPT='application/msgpack')['ETag']
+        self.assertNotEqual(msgpack_etag, etag)
+        self.assertEqual(self.client.get(self.path, HTTP_ACCEPT='application/msgpack')['ETag'], msgpack_etag)
+        response = self.client.get(self.path, HTTP_ACCEPT='application/msgpack', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class CompressionAndMessagePackTests(TestCase):
+    """API responses are compressed with the best encoding a client accepts and can be sent as msgpack."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='owner@example.com', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def compress(self, response, accept_encoding):
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept_encoding)
+        return CompressionMiddleware(lambda request: response)(request)
+
+    def test_encoding_negotiation(self):
+        body = json.dumps([{'short_code': f'code{i}'} for i in range(200)])
+
+        response = self.compress(HttpResponse(body, content_type='application/json'), 'gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content).decode(), body)
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+        response = self.compress(HttpResponse(body, content_type='application/json'), 'br;q=0, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content).decode(), body)
+
+        response = self.compress(HttpResponse(body, content_type='application/json'), 'identity')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_small_binary_and_streaming_responses_pass_through(self):
+        body = 'x' * 2000
+        self.assertFalse(self.compress(HttpResponse('{}', content_type='application/json'), 'gzip').has_header('Content-Encoding'))
+        self.assertFalse(self.compress(HttpResponse(body, content_type='image/png'), 'gzip').has_header('Content-Encoding'))
+
+        streaming = StreamingHttpResponse(iter([body.encode()]), content_type='text/csv')
+        response = self.compress(streaming, 'gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(response.streaming_content), body.encode())
+
+    def test_compressed_bodies_are_reused_for_an_etag(self):
+        body = 'y' * 2000
+        first = HttpResponse(body, content_type='application/json')
+        first['ETag'] = '"version-1"'
+        compressed = self.compress(first, 'gzip').content
+
+        # Same ETag, so the cached compression is served without compressing again
+        second = HttpResponse(body, content_type='application/json')
+        second['ETag'] = '"version-1"'
+        with mock.patch('urlbriefr.middleware.compress_body') as compress_body:
+            response = self.compress(second, 'gzip')
+        compress_body.assert_not_called()
+        self.assertEqual(response.content, compressed)
+        self.assertEqual(response['ETag'], 'W/"version-1"')
+
+    def test_msgpack_round_trip(self):
+        payload = msgpack.packb({'original_url': 'https://example.com/packed', 'title': 'Packed'})
+        response = self.client.post(
+            '/api/urls/', payload, content_type='application/msgpack',
+            HTTP_ACCEPT='application/msgpack', HTTP_ACCEPT_ENCODING='br'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+
+        body = brotli.decompress(response.content) if response.get('Content-Encoding') == 'br' else response.content
+        data = msgpack.unpackb(body, raw=False)
+        self.assertEqual((data['original_url'], data['title']), ('https://example.com/packed', 'Packed'))
+        # Datetimes are rendered as the JSON renderer renders them
+        self.assertEqual(data['created_at'], self.client.get(f"/api/urls/{data['id']}/").json()['created_at'])
+
+    def test_invalid_msgpack_is_rejected(self):
+        response = self.client.post('/api/urls/', b'\xc1', content_type='application/msgpack')
+        self.assertEqual(response.status_code, 400)
@@ -1,7 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
-    ShortenedURLViewSet, TagViewSet, redirect_to_original, 
+    ShortenedURLViewSet, TagViewSet, FolderViewSet, redirect_to_original, 
     generate_qr_code, IPRestrictionViewSet, SpoofingAttemptViewSet,
     MalwareDetectionResultViewSet
 )
@@ -9,6 +9,7 @@ from .views import (
 router = DefaultRouter()
 router.register(r'urls', ShortenedURLViewSet, basename='url')
 router.register(r'tags', TagViewSet, basename='tag')
+router.register(r'folders', FolderViewSet, basename='folder')
 router.register(r'ip-restrictions', IPRestrictionViewSet, basename='ip-restriction')
 router.register(r'spoofing-attempts', SpoofingAttemptViewSet, basename='spoofing-attempt')
 router.register(r'malware-detection', MalwareDetectionResultViewSet, basename='malware-detection')
@@ -3,16 +3,22 @@ from rest_framework import viewsets, permissions, status, filters
 from rest_framework.response import Response
 from rest_framework.decorators import action, api_view, permission_classes
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import ShortenedURL, Tag, ABTestVariant, IPRestriction, SpoofingAttempt, MalwareDetectionResult
+from .cache import cached_user_response, bump_user_cache_version, get_cache_stats, get_user_cache_version
+from urlbriefr.conditional import conditional_response
+from urlbriefr.events import publish_click, publish_preview
+from .models import ShortenedURL, Tag, Folder, URLStats, ABTestVariant, IPRestriction, SpoofingAttempt, MalwareDetectionResult
 from .serializers import (
-    ShortenedURLSerializer, CreateShortenedURLSerializer, TagSerializer, 
+    ShortenedURLSerializer, CreateShortenedURLSerializer, TagSerializer, FolderSerializer,
     ABTestVariantSerializer, IPRestrictionSerializer, SpoofingAttemptSerializer,
     CloneURLSerializer, MalwareDetectionResultSerializer
 )
-from analytics.models import ClickEvent, UserSession
+from analytics.models import ClickEvent, VisitorSketch
+from analytics.dimensions import location_dimension, referrer_dimension, user_agent_dimension
+from analytics.dedup import is_duplicate_click, record_suppressed_click
+from analytics.sampling import sample_click
+from analytics.visitors import identify_visitor, record_session_visit, set_visitor_cookie, visitor_session_id
 from django.http import HttpResponseRedirect, HttpResponse
 from django.utils import timezone
-from user_agents import parse
 from ipware import get_client_ip
 import qrcode
 import io
@@ -20,7 +26,6 @@ from django.conf import settings
 import base64
 import requests
 import random
-import uuid
 import hashlib
 from django.db.models import Count, Q
 from bs4 import BeautifulSoup
@@ -78,6 +83,33 @@ def get_location_from_ip(ip_address):
 MAX_TAGS_PER_USER = 10
 MAX_IP_RESTRICTIONS_PER_USER = 20
 
+# URL lists show is_expired and daily sparklines, so cached lists are kept for at
+# most this many seconds; it divides a day, so no bucket spans midnight UTC
+URL_LIST_TIME_BUCKET = 60
+
+
+def url_detail_etag(view, request, pk=None, **kwargs):
+    """
+    ETag parts for a URL detail response: the owner's cache version and expiry
+    state. The version is only seen by every process with a shared cache, so
+    responses carry no ETag without one.
+    """
+    if not settings.SHARED_CACHE:
+        return None
+    url_data = view.get_queryset().filter(pk=pk).values('user_id', 'expires_at').first()
+    if url_data is None:
+        return None
+    is_expired = url_data['expires_at'] is not None and timezone.now() > url_data['expires_at']
+    return (pk, get_user_cache_version(url_data['user_id']), is_expired)
+
+
+def folder_limit_reached(user, folder_name):
+    """Check whether filing a URL under folder_name would create a folder past the user's limit."""
+    user_folders = Folder.objects.filter(user=user)
+    if user_folders.filter(name=folder_name).exists():
+        return False
+    return user_folders.count() >= MAX_FOLDERS_PER_USER
+
 
 class TagViewSet(viewsets.ModelViewSet):
     """ViewSet for managing tags."""
@@ -88,6 +120,11 @@ class TagViewSet(viewsets.ModelViewSet):
         """Get tags for the current user."""
         return Tag.objects.filter(user=self.request.user)
     
+    @cached_user_response('tag_list')
+    def list(self, request, *args, **kwargs):
+        """List the user's tags."""
+        return super().list(request, *args, **kwargs)
+    
     @action(detail=True, methods=['get'])
     def urls(self, request, pk=None):
         """Get all URLs with this tag."""
@@ -112,6 +149,40 @@ class TagViewSet(viewsets.ModelViewSet):
         return super().create(request, *args, **kwargs)
 
 
+class FolderViewSet(viewsets.ModelViewSet):
+    """ViewSet for managing folders."""
+    serializer_class = FolderSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def get_queryset(self):
+        """Get folders for the current user."""
+        return Folder.objects.filter(user=self.request.user)
+    
+    def create(self, request, *args, **kwargs):
+        """Create a new folder with limit check."""
+        if Folder.objects.filter(user=request.user).count() >= MAX_FOLDERS_PER_USER:
+            return Response(
+                {"error": f"You have reached the maximum limit of {MAX_FOLDERS_PER_USER} folders. Please delete some folders before creating new ones."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+            
+        return super().create(request, *args, **kwargs)
+    
+    def perform_update(self, serializer):
+        """Rename the folder on all of its URLs in one query."""
+        old_name = serializer.instance.name
+        folder = serializer.save()
+        if folder.name != old_name:
+            ShortenedURL.objects.filter(user=folder.user, folder=old_name).update(folder=folder.name)
+            bump_user_cache_version(folder.user_id)
+    
+    def perform_destroy(self, instance):
+        """Remove the folder from its URLs before deleting it."""
+        ShortenedURL.objects.filter(user=instance.user, folder=instance.name).update(folder=None)
+        instance.delete()
+        bump_user_cache_version(instance.user_id)
+
+
 class IPRestrictionViewSet(viewsets.ModelViewSet):
     """ViewSet for managing IP restrictions."""
     serializer_class = IPRestrictionSerializer
@@ -178,6 +249,12 @@ class ShortenedURLViewSet(viewsets.ModelViewSet):
         partial = kwargs.pop('partial', True)  # Always use partial updates to avoid requiring all fields
         instance = self.get_object()
         
+        # Moving the URL to a new folder creates it, so the folder limit applies
+        if request.data.get('folder') != instance.folder:
+            limit_response = self.folder_limit_response(request, request.data.get('folder'))
+            if limit_response:
+                return limit_response
+        
         # For PATCH requests with expiration_type, get full URL data first
         if request.method == 'PATCH' and 'expiration_type' in request.data:
             print(f"Handling URL expiration update with expiration_type: {request.data.get('expiration_type')}")
@@ -282,6 +359,7 @@ class ShortenedURLViewSet(viewsets.ModelViewSet):
                     from django.utils import timezone
                     future_date = timezone.now() + timezone.timedelta(days=days)
                     ShortenedURL.objects.filter(pk=instance.pk).update(expires_at=future_date)
+                    bump_user_cache_version(instance.user_id)
                     print(f"Directly updated database with expires_at={future_date}")
                     # Get fresh instance again
                     fresh_instance = ShortenedURL.objects.get(pk=instance.pk)
@@ -290,6 +368,7 @@ class ShortenedURLViewSet(viewsets.ModelViewSet):
                 if date_value:
                     # Direct database update
                     ShortenedURL.objects.filter(pk=instance.pk).update(expires_at=date_value)
+                    bump_user_cache_version(instance.user_id)
                     print(f"Directly updated database with expires_at={date_value}")
                     # Get fresh instance again
                     fresh_instance = ShortenedURL.objects.get(pk=instance.pk)
@@ -336,6 +415,11 @@ class ShortenedURLViewSet(viewsets.ModelViewSet):
             modifications.pop('expiration_days', None)
             modifications.pop('expiration_date', None)
         
+        # The clone is filed in the requested folder, or the original's, which may be new to this user
+        limit_response = self.folder_limit_response(request, modifications.get('folder', instance.folder))
+        if limit_response:
+            return limit_response
+        
         # Clone the URL
         cloned_url = instance.clone(user=request.user, modifications=modifications)
         
@@ -404,6 +488,7 @@ class ShortenedURLViewSet(viewsets.ModelViewSet):
             url.preview_image = preview_image
             url.preview_updated_at = timezone.now()
             url.save()
+            publish_preview(url)
             
             return Response({
                 'success': True,
@@ -544,6 +629,16 @@ class ShortenedURLViewSet(viewsets.ModelViewSet):
         else:
             return ShortenedURL.objects.none()
     
+    @cached_user_response('url_list', bucket_seconds=URL_LIST_TIME_BUCKET)
+    def list(self, request, *args, **kwargs):
+        """List URLs, served from the per-user cache when nothing has changed."""
+        return super().list(request, *args, **kwargs)
+    
+    @conditional_response(url_detail_etag)
+    def retrieve(self, request, *args, **kwargs):
+        """Get a URL, answering unchanged conditional requests with a 304."""
+        return super().retrieve(request, *args, **kwargs)
+    
     def get_permissions(self):
         """Get permissions based on action."""
         if self.action == 'create':
@@ -561,95 +656,60 @@ class ShortenedURLViewSet(viewsets.ModelViewSet):
         return ShortenedURLSerializer
     
     @action(detail=False, methods=['get'])
+    @cached_user_response('url_stats')
     def stats(self, request):
         """Get statistics for all user's URLs."""
         user = request.user
         if not user.is_authenticated:
             return Response(status=status.HTTP_401_UNAUTHORIZED)
         
-        urls = ShortenedURL.objects.filter(user=user)
-        total_clicks = sum(url.access_count for url in urls)
-        
-        # Add security stats
-        security_enabled_count = urls.filter(
-            Q(enable_ip_restrictions=True) | Q(spoofing_protection=True)
-        ).count()
-        
-        # Add clone stats
-        cloned_count = urls.filter(cloned_from__isnull=False).count()
+        stats = URLStats.for_user(user.id)
         
         return Response({
-            'total_urls': urls.count(),
-            'total_clicks': total_clicks,
-            'active_urls': urls.filter(is_active=True).count(),
-            'security_enabled': security_enabled_count,
-            'cloned_urls': cloned_count
+            'total_urls': stats.total_urls,
+            'total_clicks': stats.total_clicks,
+            'active_urls': stats.active_urls,
+            'security_enabled': stats.secured_urls,
+            'cloned_urls': stats.cloned_urls
         })
     
     @action(detail=False, methods=['get'])
+    @cached_user_response('folders')
     def folders(self, request):
-        """Get all folders used by the user."""
+        """Get the names of all folders for the user."""
         user = request.user
         if not user.is_authenticated:
             return Response(status=status.HTTP_401_UNAUTHORIZED)
         
-        # Get all folders for this user - include folders from temporary URLs
-        folders_query = ShortenedURL.objects.filter(
-            user=user
-        ).exclude(
-            folder__isnull=True
-        ).exclude(
-            folder=''
-        ).values_list('folder', flat=True).distinct()
-        
-        # Convert to list and ensure it's not empty
-        folder_list = list(folders_query)
-        print(f"Found {len(folder_list)} folders for user {user.email}: {folder_list}")
-        
-        # Ensure we never return None
-        if folder_list is None:
-            folder_list = []
-        
-        # Debug information
-        all_urls = ShortenedURL.objects.filter(user=user)
-        print(f"Total URLs for user: {all_urls.count()}")
-        
-        temp_urls = ShortenedURL.objects.filter(user=user, title='Temporary URL for folder creation')
-        print(f"Temporary folder URLs: {temp_urls.count()}")
-        
-        urls_with_folders = ShortenedURL.objects.filter(user=user).exclude(folder='').exclude(folder__isnull=True)
-        print(f"URLs with folders: {urls_with_folders.count()}")
-        if urls_with_folders.count() > 0:
-            print(f"Sample folders: {list(urls_with_folders.values_list('folder', flat=True)[:5])}")
-            
+        folder_list = list(Folder.objects.filter(user=user).values_list('name', flat=True))
         return Response(folder_list)
     
+    @action(detail=False, methods=['get'])
+    def cache_stats(self, request):
+        """Get hit rates for the per-user response cache (admin only)."""
+        user = request.user
+        if not (user.is_superuser or (hasattr(user, 'is_admin') and user.is_admin)):
+            return Response(status=status.HTTP_403_FORBIDDEN)
+        
+        return Response(get_cache_stats(['url_list', 'url_stats', 'folders', 'tag_list']))
+    
     def create(self, request, *args, **kwargs):
         """Create a new shortened URL."""
         # Check folder limit if user is authenticated and folder is provided
-        user = request.user
-        if user.is_authenticated and 'folder' in request.data and request.data['folder']:
-            # Skip validation for temporary URL for folder creation
-            if request.data.get('title') != 'Temporary URL for folder creation':
-                # Count unique folders for this user
-                folder_count = ShortenedURL.objects.filter(
-                    user=user
-                ).exclude(folder__isnull=True).exclude(folder='').values('folder').distinct().count()
-                
-                # Check if the folder already exists for this user
-                folder_exists = ShortenedURL.objects.filter(
-                    user=user, 
-                    folder=request.data['folder']
-                ).exists()
-                
-                # If it's a new folder and the user has reached the limit
-                if not folder_exists and folder_count >= MAX_FOLDERS_PER_USER:
-                    return Response(
-                        {"error": f"You have reached the maximum limit of {MAX_FOLDERS_PER_USER} folders. Please delete some folders before creating new ones."},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
+        limit_response = self.folder_limit_response(request, request.data.get('folder'))
+        if limit_response:
+            return limit_response
         
         return super().create(request, *args, **kwargs)
+    
+    def folder_limit_response(self, request, folder_name):
+        """Error response when filing a URL under folder_name would create a folder past the limit."""
+        if request.user.is_authenticated and folder_name and folder_limit_reached(request.user, folder_name):
+            return Response(
+                {"error": f"You have reached the maximum limit of {MAX_FOLDERS_PER_USER} folders. Please delete some folders before creating new ones."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return None
 
 
 @api_view(['GET'])
@@ -663,10 +723,10 @@ def redirect_to_original(request, short_code):
         # Get client IP address for analytics and security checks
         client_ip, is_routable = get_client_ip(request)
         user_agent_string = request.META.get('HTTP_USER_AGENT', '')
-        user_agent = parse(user_agent_string)
         
-        # Generate a session ID for tracking
-        session_id = str(uuid.uuid4())
+        # One session per visitor per URL, so repeat clicks reuse it
+        visitor_id, is_new_visitor = identify_visitor(request, client_ip, user_agent_string)
+        session_id = visitor_session_id(visitor_id, url.id)
         
         # Check if URL is active
         if not url.is_active:
@@ -713,6 +773,9 @@ def redirect_to_original(request, short_code):
                     'message': 'This URL appears to have been tampered with and cannot be validated.'
                 }, status=status.HTTP_400_BAD_REQUEST)
                 
+        # Bursts of identical clicks (unfurlers, prefetchers, double clicks) are only counted once
+        is_duplicate = is_duplicate_click(url.id, client_ip, user_agent_string)
+        
         # A/B testing logic
         destination_url = url.original_url  # Default URL
         is_ab_variant = False
@@ -733,37 +796,55 @@ def redirect_to_original(request, short_code):
                         current_weight += variant.weight
                         if random_num <= current_weight:
                             destination_url = variant.destination_url
-                            variant.increment_counter()
+                            if not is_duplicate:
+                                variant.increment_counter()
                             is_ab_variant = True
                             variant_id = variant.id
                             break
         
-        # Get location data from IP address
-        location_data = get_location_from_ip(client_ip)
-        
-        # Create click event for analytics
-        event = ClickEvent.objects.create(
-            url=url,
-            ip_address=client_ip,
-            user_agent=user_agent_string,
-            browser=user_agent.browser.family,
-            os=user_agent.os.family,
-            device=user_agent.device.family,
-            country=location_data['country'],
-            city=location_data['city'],
-            session_id=session_id
-        )
-        
-        # Create user session record
-        UserSession.objects.create(
-            session_id=session_id,
-            url=url,
-            ip_address=client_ip,
-            user_agent=user_agent_string
-        )
-        
-        # Increment URL access counter
-        url.increment_counter()
+        if is_duplicate:
+            # Counted on its own, without any of the writes a click makes
+            record_suppressed_click(url)
+        else:
+            # Parsed once per distinct user agent and cached in the process, and only for clicks that are recorded
+            user_agent = user_agent_dimension(user_agent_string)
+            
+            # Create click event for analytics, unless the link is busy enough that its clicks are sampled
+            weight = sample_click(url.id)
+            if weight:
+                # Get location data from IP address
+                location_data = get_location_from_ip(client_ip)
+                
+                ClickEvent.objects.create(
+                    url=url,
+                    ip_address=client_ip,
+                    agent=user_agent,
+                    referral=referrer_dimension(request.META.get('HTTP_REFERER', '')[:2000]),
+                    location=location_dimension(location_data['country'], location_data['city']),
+                    session_id=session_id,
+                    weight=weight
+                )
+            
+            # Count the visitor towards the unique visitor sketches
+            VisitorSketch.record_visitor(url.id, url.user_id, client_ip)
+            
+            # Let the owner's open event streams know
+            publish_click(url)
+            
+            # Create the visitor's session on their first click, or count the visit towards it
+            record_session_visit(
+                url, session_id, visitor_id,
+                ip_address=client_ip,
+                user_agent=user_agent_string,
+                device_info={
+                    'browser': user_agent.browser,
+                    'os': user_agent.os,
+                    'device': user_agent.device
+                }
+            )
+            
+            # Increment URL access counter
+            url.increment_counter()
         
         # Handle one-time use links - make the link inactive after this use
         if url.one_time_use:
@@ -783,7 +864,7 @@ def redirect_to_original(request, short_code):
                 }
             
             # Return JSON with redirect info for custom page handling in frontend
-            return Response({
+            response = Response({
                 'status': 'success',
                 'redirect_type': 'custom',
                 'destination_url': destination_url,
@@ -802,9 +883,13 @@ def redirect_to_original(request, short_code):
                     'one_time_use': url.one_time_use
                 }
             })
-            
-        # For direct redirects, just redirect to the destination URL
-        return HttpResponseRedirect(destination_url)
+        else:
+            # For direct redirects, just redirect to the destination URL
+            response = HttpResponseRedirect(destination_url)
+        
+        if is_new_visitor:
+            set_visitor_cookie(request, response, visitor_id)
+        return response
         
     except Exception as e:
         print(f"Error in redirect: {str(e)}")
@@ -11,11 +11,36 @@ from .serializers import (
     TempEmailAttachmentSerializer, CreateTempEmailSessionSerializer
 )
 from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max, Q
+from urlbriefr.conditional import conditional_response, time_bucket
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def session_messages_etag(view, request, pk=None, **kwargs):
+    """ETag parts for a session's inbox: message count, read count and newest arrival."""
+    try:
+        session = TempEmailSession.objects.filter(
+            session_token=pk, is_active=True
+        ).values('id', 'expires_at').first()
+    except (ValueError, ValidationError):
+        return None
+    if session is None or timezone.now() > session['expires_at']:
+        return None
+    
+    inbox = TempEmailMessage.objects.filter(
+        session_id=session['id'], expires_at__gt=timezone.now()
+    ).aggregate(
+        count=Count('id'),
+        read_count=Count('id', filter=Q(is_read=True)),
+        latest=Max('received_at')
+    )
+    # time_ago is rendered relative to now, so validators roll over every minute
+    return (session['expires_at'], inbox['count'], inbox['read_count'], inbox['latest'], time_bucket(60))
+
+
 class TempEmailViewSet(viewsets.ViewSet):
     """ViewSet for temporary email functionality."""
     
@@ -93,6 +118,7 @@ class TempEmailViewSet(viewsets.ViewSet):
         return Response(serializer.data)
     
     @action(detail=True, methods=['get'])
+    @conditional_response(session_messages_etag)
     def messages(self, request, pk=None):
         """Get messages for a temporary email session."""
         session = get_object_or_404(TempEmailSession, session_token=pk, is_active=True)
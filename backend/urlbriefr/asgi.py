@@ -2,6 +2,8 @@
 ASGI config for urlbriefr project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP requests go to Django; WebSocket connections to the event streams are
+routed by Channels when it is installed.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +15,27 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'urlbriefr.settings')
 
-application = get_asgi_application()
+# Set up Django before importing anything that uses models
+django_asgi_app = get_asgi_application()
+
+try:
+    from channels.routing import ProtocolTypeRouter, URLRouter
+    from channels.security.websocket import OriginValidator
+except ImportError:
+    application = django_asgi_app
+else:
+    from django.conf import settings
+
+    from .routing import websocket_urlpatterns
+    from .streams import JWTQueryAuthMiddleware
+
+    # Browsers connect from the frontend's origin, so accept the same origins as CORS
+    allowed_origins = ['*'] if settings.CORS_ALLOW_ALL_ORIGINS else settings.CORS_ALLOWED_ORIGINS
+
+    application = ProtocolTypeRouter({
+        'http': django_asgi_app,
+        'websocket': OriginValidator(
+            JWTQueryAuthMiddleware(URLRouter(websocket_urlpatterns)),
+            allowed_origins
+        ),
+    })
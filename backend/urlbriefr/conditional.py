@@ -0,0 +1,89 @@
+"""
+Conditional GET support for API views.
+
+Views declare a cheap function that returns the parts an ETag is built from
+(version counters, timestamps, counts). Requests whose If-None-Match matches
+get a 304 before the view queries or serializes anything.
+"""
+import functools
+import hashlib
+import time
+
+from django.utils.cache import patch_vary_headers
+from rest_framework import status
+from rest_framework.response import Response
+
+
+def make_etag(*parts):
+    """Build a quoted ETag from the given parts."""
+    value = '|'.join(str(part) for part in parts)
+    return f'"{hashlib.md5(value.encode()).hexdigest()}"'
+
+
+def etag_matches(request, etag):
+    """Check whether the request's If-None-Match header matches an ETag."""
+    header = request.headers.get('If-None-Match')
+    if not header:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(',')]
+    # Weak validators are fine for GET comparisons
+    candidates = [candidate[2:] if candidate.startswith('W/') else candidate for candidate in candidates]
+    return '*' in candidates or etag in candidates
+
+
+def time_bucket(seconds):
+    """Current time bucket, for ETags of responses that depend on the clock."""
+    return int(time.time() // seconds)
+
+
+def set_validator_headers(response, etag):
+    """Attach an ETag and make clients revalidate before reusing the response."""
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    patch_vary_headers(response, ['Accept', 'Authorization'])
+    return response
+
+
+def mark_outdated(response):
+    """
+    Flag a response built from older data than its ETag parts describe (e.g. a
+    cached result served while a newer one is computed), so it is sent
+    without an ETag instead of one that would validate it later.
+    """
+    response.outdated = True
+    return response
+
+
+def conditional_response(etag_parts):
+    """
+    Answer matching If-None-Match requests with a 304 before a viewset method runs.
+
+    etag_parts(view, request, *args, **kwargs) returns an iterable of values
+    that change whenever the response would, or None to skip validation
+    (e.g. when the object doesn't exist, so the view can return its error).
+    """
+    def decorator(view_method):
+        @functools.wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view_method(self, request, *args, **kwargs)
+
+            parts = etag_parts(self, request, *args, **kwargs)
+            if parts is None:
+                return view_method(self, request, *args, **kwargs)
+
+            # JSON and msgpack renderings of the same data are different representations
+            etag = make_etag(request.get_full_path(), request.accepted_media_type, *parts)
+            if etag_matches(request, etag):
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            else:
+                response = view_method(self, request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                if getattr(response, 'outdated', False):
+                    response['Cache-Control'] = 'private, no-cache'
+                    return response
+
+            return set_validator_headers(response, etag)
+        return wrapper
+    return decorator
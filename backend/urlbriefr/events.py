@@ -0,0 +1,141 @@
+"""
+Real-time events for link owners.
+
+Clicks, malware scan verdicts and preview refreshes are sent to a per-user
+group on the channel layer and delivered over a WebSocket (/ws/events/) or,
+as a fallback, server-sent events (/api/events/stream/). Each stream batches
+what it receives and flushes one frame per EVENT_FLUSH_INTERVAL, with click
+deltas summed per link and only the latest scan and preview per link, so a
+link appears in at most one message per interval however busy it is.
+
+Streams mark their user as listening in the cache, and events for users
+with no open stream are dropped before touching the channel layer.
+"""
+import logging
+from collections import Counter
+
+from django.core.cache import cache
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Try to import Channels, but don't fail if it's not available
+try:
+    from asgiref.sync import async_to_sync
+    from channels.layers import get_channel_layer
+    CHANNELS_AVAILABLE = True
+except ImportError:
+    CHANNELS_AVAILABLE = False
+
+# Seconds between frames sent to a stream
+EVENT_FLUSH_INTERVAL = 1.0
+
+# A stream refreshes its listening flag every flush, so this only matters once it's gone
+LISTENER_TIMEOUT = 30
+
+
+def user_group(user_id):
+    """Channel layer group for a user's events."""
+    return f"user_events_{user_id}"
+
+
+def _listener_key(user_id):
+    return f"user_events_listening_{user_id}"
+
+
+async def mark_listening(user_id):
+    """Record that a user has an open event stream."""
+    await cache.aset(_listener_key(user_id), True, LISTENER_TIMEOUT)
+
+
+def publish_event(user_id, kind, url_id, data):
+    """
+    Send an event about one of a user's links to their open streams.
+
+    kind is 'clicks' (data is the click count delta), 'scans' or 'previews'
+    (data is a JSON-serialisable dict). Failures are logged, never raised,
+    so publishing can't break the request that triggered it.
+    """
+    if not CHANNELS_AVAILABLE or not user_id or not cache.get(_listener_key(user_id)):
+        return
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(user_group(user_id), {
+            'type': 'user.event',
+            'kind': kind,
+            'url_id': url_id,
+            'data': data,
+        })
+    except Exception as e:
+        logger.warning(f"Failed to publish {kind} event for user {user_id}: {str(e)}")
+
+
+def publish_click(url):
+    """Publish a click on a URL to its owner."""
+    publish_event(url.user_id, 'clicks', url.id, 1)
+
+
+def publish_scan_result(url_id, user_id, detection_result):
+    """Publish a URL's malware scan status to its owner."""
+    publish_event(user_id, 'scans', url_id, {
+        'status': detection_result.status,
+        'details': detection_result.details,
+        'scan_date': detection_result.scan_date.isoformat() if detection_result.scan_date else None,
+    })
+
+
+def publish_preview(url):
+    """Publish a URL's refreshed preview to its owner."""
+    publish_event(url.user_id, 'previews', url.id, {
+        'title': url.preview_title,
+        'description': url.preview_description,
+        'image': url.preview_image,
+        'updated_at': url.preview_updated_at.isoformat() if url.preview_updated_at else None,
+    })
+
+
+class EventBatcher:
+    """Coalesces the events a stream receives between flushes."""
+
+    def __init__(self):
+        self.clicks = Counter()
+        self.latest = {'scans': {}, 'previews': {}}
+
+    def add(self, message):
+        """Add a user.event message from the channel layer."""
+        url_id = str(message['url_id'])
+        if message['kind'] == 'clicks':
+            self.clicks[url_id] += message['data']
+        elif message['kind'] in self.latest:
+            self.latest[message['kind']][url_id] = message['data']
+
+    def flush(self):
+        """Get the frame for everything received since the last flush, or None if nothing was."""
+        frame = {}
+        if self.clicks:
+            frame['clicks'] = dict(self.clicks)
+        for kind, events in self.latest.items():
+            if events:
+                frame[kind] = events
+        self.clicks = Counter()
+        self.latest = {kind: {} for kind in self.latest}
+        if not frame:
+            return None
+        frame['sent_at'] = timezone.now().isoformat()
+        return frame
+
+
+def get_user_from_token(raw_token):
+    """Get the active user a JWT access token belongs to, or None if it isn't valid."""
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+    from rest_framework_simplejwt.exceptions import InvalidToken, AuthenticationFailed
+
+    if not raw_token:
+        return None
+    authentication = JWTAuthentication()
+    try:
+        return authentication.get_user(authentication.get_validated_token(raw_token))
+    except (InvalidToken, AuthenticationFailed):
+        return None
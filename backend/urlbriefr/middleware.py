@@ -0,0 +1,142 @@
+"""
+Response compression for API payloads.
+
+Prefers brotli over gzip when the client accepts it. Responses that carry an
+ETag (the cached and conditional API endpoints) have their compressed bodies
+cached under that ETag, so repeat fetches of an unchanged payload skip
+compression entirely. Streaming responses and file downloads are passed
+through untouched.
+"""
+import gzip
+import hashlib
+import logging
+
+from django.core.cache import cache
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Responses smaller than this aren't worth compressing
+COMPRESSION_MIN_SIZE = 1024
+
+# Brotli quality tuned for dynamic responses; 11 is far too slow per request
+BROTLI_QUALITY = 5
+
+GZIP_LEVEL = 6
+
+COMPRESSED_BODY_CACHE_TIMEOUT = 60 * 60
+
+# Don't fill the cache with very large compressed bodies
+COMPRESSED_BODY_CACHE_MAX_SIZE = 512 * 1024
+
+COMPRESSIBLE_CONTENT_TYPES = (
+    'application/json',
+    'application/msgpack',
+    'application/javascript',
+    'application/xml',
+    'image/svg+xml',
+    'text/',
+)
+
+
+def accepted_encodings(request):
+    """Get the encodings a client accepts from its Accept-Encoding header."""
+    encodings = set()
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, _, params = item.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = params.strip()
+        if quality.startswith('q='):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        encodings.add(name)
+    return encodings
+
+
+def choose_encoding(request):
+    """Pick brotli if the client accepts it, otherwise gzip, otherwise nothing."""
+    encodings = accepted_encodings(request)
+    if BROTLI_AVAILABLE and ('br' in encodings or '*' in encodings):
+        return 'br'
+    if 'gzip' in encodings or '*' in encodings:
+        return 'gzip'
+    return None
+
+
+def compress_body(content, encoding):
+    """Compress a response body with the given encoding."""
+    if encoding == 'br':
+        return brotli.compress(content, quality=BROTLI_QUALITY)
+    return gzip.compress(content, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def is_compressible(response):
+    content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+    return content_type.startswith(COMPRESSIBLE_CONTENT_TYPES)
+
+
+class CompressionMiddleware:
+    """Compress large API responses with brotli or gzip."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        # Streaming responses (exports, downloads) are sent as they're produced
+        if response.streaming:
+            return response
+
+        if response.has_header('Content-Encoding') or not is_compressible(response):
+            return response
+
+        if 'attachment' in response.get('Content-Disposition', ''):
+            return response
+
+        if len(response.content) < COMPRESSION_MIN_SIZE:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        encoding = choose_encoding(request)
+        if encoding is None:
+            return response
+
+        etag = response.get('ETag')
+        cache_key = None
+        compressed = None
+        if etag:
+            digest = hashlib.md5(f"{etag}|{response['Content-Type']}".encode()).hexdigest()
+            cache_key = f"compressed_body_{encoding}_{digest}"
+            compressed = cache.get(cache_key)
+
+        if compressed is None:
+            compressed = compress_body(response.content, encoding)
+            if cache_key and len(compressed) <= COMPRESSED_BODY_CACHE_MAX_SIZE:
+                cache.set(cache_key, compressed, COMPRESSED_BODY_CACHE_TIMEOUT)
+
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+
+        # The encoded body is a different representation, so a strong
+        # validator must become weak (RFC 9110 8.8.1)
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+
+        return response
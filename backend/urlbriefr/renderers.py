@@ -0,0 +1,45 @@
+"""
+MessagePack renderer and parser for the API, and a parser for JSON beacons.
+
+Clients opt in with `Accept: application/msgpack` (or `?format=msgpack`) and
+may send request bodies as `Content-Type: application/msgpack`. Values
+msgpack can't represent natively (datetimes, decimals, UUIDs) are converted
+the same way the JSON renderer converts them, so both formats carry the same
+data.
+"""
+import msgpack
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+_encoder = JSONEncoder()
+
+
+class MessagePackRenderer(BaseRenderer):
+    """Render response data as MessagePack."""
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_encoder.default, use_bin_type=True)
+
+
+class MessagePackParser(BaseParser):
+    """Parse MessagePack request bodies."""
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except Exception as exc:
+            raise ParseError(f'MessagePack parse error - {exc}')
+
+
+class PlainTextJSONParser(JSONParser):
+    """Parse JSON sent as text/plain, as navigator.sendBeacon does with string payloads."""
+    media_type = 'text/plain'
@@ -0,0 +1,10 @@
+"""
+WebSocket URL configuration for urlbriefr project.
+"""
+from django.urls import path
+
+from .streams import UserEventConsumer
+
+websocket_urlpatterns = [
+    path('ws/events/', UserEventConsumer.as_asgi()),
+]
@@ -57,6 +57,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'urlbriefr.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -84,6 +85,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'urlbriefr.wsgi.application'
+ASGI_APPLICATION = 'urlbriefr.asgi.application'
 
 
 # Database
@@ -150,6 +152,17 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'rest_framework.renderers.JSONRenderer',
+        'urlbriefr.renderers.MessagePackRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'rest_framework.parsers.JSONParser',
+        'urlbriefr.renderers.MessagePackParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
     'DEFAULT_FILTER_BACKENDS': (
         'django_filters.rest_framework.DjangoFilterBackend',
         'rest_framework.filters.SearchFilter',
@@ -250,3 +263,52 @@ EMAIL_SERVICE_CONFIG = {
         'server_token': os.environ.get('POSTMARK_SERVER_TOKEN', ''),
     }
 }
+
+# Click archival: raw clicks older than the retention period are rolled up,
+# exported to date-partitioned gzip NDJSON files here and deleted
+CLICK_ARCHIVE_DIR = os.environ.get('CLICK_ARCHIVE_DIR', os.path.join(BASE_DIR, 'click_archive'))
+CLICK_RETENTION_DAYS = int(os.environ.get('CLICK_RETENTION_DAYS', '90'))
+
+# Identical clicks (same URL, IP and user agent) within this many seconds are
+# counted once; 0 counts every click
+CLICK_DEDUP_WINDOW = int(os.environ.get('CLICK_DEDUP_WINDOW', '2'))
+
+# Finished click export jobs are written here for download
+CLICK_EXPORT_DIR = os.environ.get('CLICK_EXPORT_DIR', os.path.join(BASE_DIR, 'click_exports'))
+
+# Analytics report workbooks, named by their content key so identical requests share one
+ANALYTICS_REPORT_DIR = os.environ.get('ANALYTICS_REPORT_DIR', os.path.join(BASE_DIR, 'analytics_reports'))
+
+# Real-time event streams need Redis (REDIS_URL): the channel layer carries
+# events between processes and the cache holds the flags saying which users
+# are listening, so both have to be shared. Without it the streams answer 503,
+# unless REALTIME_EVENTS_IN_PROCESS is set for a single-process development
+# server, where the in-memory layer and cache reach every stream.
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [REDIS_URL]},
+        },
+    }
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        },
+    }
+elif os.environ.get('REALTIME_EVENTS_IN_PROCESS', 'False').lower() == 'true':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
+else:
+    CHANNEL_LAYERS = {}
+
+# Whether the default cache is shared by every process (Redis). Per-user
+# cached responses and buffered session visits are only used when it is: a
+# per-process cache would miss other processes' invalidations, and session
+# visits are written straight to the database instead.
+SHARED_CACHE = bool(REDIS_URL)
@@ -0,0 +1,140 @@
+"""
+WebSocket and server-sent event transports for the user event streams.
+
+Both authenticate with a JWT access token in the `token` query parameter,
+since browsers can't set headers on WebSocket or EventSource requests
+(the SSE endpoint also accepts a normal Authorization header).
+"""
+import asyncio
+import json
+import logging
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from channels.layers import get_channel_layer
+from channels.middleware import BaseMiddleware
+from django.contrib.auth.models import AnonymousUser
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+
+from .events import EVENT_FLUSH_INTERVAL, EventBatcher, get_user_from_token, mark_listening, user_group
+
+logger = logging.getLogger(__name__)
+
+# Frames without events after which an SSE stream sends a comment, so proxies keep it open
+SSE_KEEPALIVE_INTERVALS = 15
+
+
+class JWTQueryAuthMiddleware(BaseMiddleware):
+    """Set scope['user'] from a JWT access token in the query string."""
+
+    async def __call__(self, scope, receive, send):
+        token = parse_qs(scope.get('query_string', b'').decode()).get('token', [None])[0]
+        user = await sync_to_async(get_user_from_token)(token)
+        scope['user'] = user or AnonymousUser()
+        return await super().__call__(scope, receive, send)
+
+
+class UserEventConsumer(AsyncJsonWebsocketConsumer):
+    """Push a user's batched link events over a WebSocket."""
+
+    async def connect(self):
+        user = self.scope.get('user')
+        if not user or not user.is_authenticated:
+            await self.close(code=4401)
+            return
+
+        if self.channel_layer is None:
+            # Real-time events are not configured (see REDIS_URL in settings)
+            await self.close(code=4503)
+            return
+
+        self.user_id = user.id
+        self.batcher = EventBatcher()
+        await self.channel_layer.group_add(user_group(self.user_id), self.channel_name)
+        await mark_listening(self.user_id)
+        await self.accept()
+        self.flusher = asyncio.ensure_future(self.flush_events())
+
+    async def disconnect(self, code):
+        flusher = getattr(self, 'flusher', None)
+        if flusher:
+            flusher.cancel()
+        if hasattr(self, 'user_id'):
+            await self.channel_layer.group_discard(user_group(self.user_id), self.channel_name)
+
+    async def user_event(self, message):
+        self.batcher.add(message)
+
+    async def flush_events(self):
+        while True:
+            await asyncio.sleep(EVENT_FLUSH_INTERVAL)
+            await mark_listening(self.user_id)
+            frame = self.batcher.flush()
+            if frame:
+                await self.send_json(frame)
+
+
+async def event_stream(request):
+    """
+    Stream a user's batched link events as server-sent events.
+
+    Only served over ASGI: under WSGI the endless stream would hold a worker
+    for as long as the client stays connected, so it is refused with a 503.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({"error": "Event streams are only available when the server runs under ASGI"}, status=503)
+
+    token = request.GET.get('token')
+    auth_header = request.headers.get('Authorization', '')
+    if not token and auth_header.startswith('Bearer '):
+        token = auth_header[len('Bearer '):]
+
+    user = await sync_to_async(get_user_from_token)(token)
+    if user is None:
+        return JsonResponse({"error": "Authentication credentials were not provided or are invalid"}, status=401)
+
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return JsonResponse({"error": "Real-time events are not configured"}, status=503)
+
+    response = StreamingHttpResponse(_sse_frames(channel_layer, user.id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def _sse_frames(channel_layer, user_id):
+    channel = await channel_layer.new_channel()
+    group = user_group(user_id)
+    await channel_layer.group_add(group, channel)
+    await mark_listening(user_id)
+    batcher = EventBatcher()
+    loop = asyncio.get_running_loop()
+    idle = 0
+    try:
+        yield f"retry: {int(EVENT_FLUSH_INTERVAL * 3000)}\n\n"
+        while True:
+            deadline = loop.time() + EVENT_FLUSH_INTERVAL
+            while (remaining := deadline - loop.time()) > 0:
+                try:
+                    message = await asyncio.wait_for(channel_layer.receive(channel), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if message.get('type') == 'user.event':
+                    batcher.add(message)
+
+            await mark_listening(user_id)
+            frame = batcher.flush()
+            if frame:
+                idle = 0
+                yield f"data: {json.dumps(frame)}\n\n"
+            else:
+                idle += 1
+                if idle >= SSE_KEEPALIVE_INTERVALS:
+                    idle = 0
+                    yield ": keep-alive\n\n"
+    finally:
+        await channel_layer.group_discard(group, channel)
@@ -18,6 +18,7 @@ from django.contrib import admin
 from django.urls import path, include
 from shortener.urls import api_urlpatterns as shortener_api_urlpatterns
 from shortener.urls import urlpatterns as shortener_urlpatterns
+from .events import CHANNELS_AVAILABLE
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -31,3 +32,9 @@ urlpatterns = [
     # URL shortener redirect (non-API endpoint)
     path('', include(shortener_urlpatterns)),
 ]
+
+if CHANNELS_AVAILABLE:
+    from .streams import event_stream
+    
+    # Server-sent events fallback for clients that can't use the WebSocket at /ws/events/
+    urlpatterns.insert(-1, path('api/events/stream/', event_stream, name='event-stream'))
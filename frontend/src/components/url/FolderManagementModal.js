@@ -10,6 +10,7 @@ const FolderManagementModal = ({ isOpen, onClose }) => {
   const [newFolderName, setNewFolderName] = useState('');
   const [editingFolder, setEditingFolder] = useState(null);
   const [folderCounts, setFolderCounts] = useState({});
+  const [folderIds, setFolderIds] = useState({});
   
   useEffect(() => {
     if (isOpen) {
@@ -20,23 +21,23 @@ const FolderManagementModal = ({ isOpen, onClose }) => {
   const fetchFolders = async () => {
     try {
       setLoading(true);
-      const data = await urlService.getFolders();
+      const data = await urlService.getFolderDetails();
       console.log('Fetched folders in FolderManagementModal:', data);
       
       // Ensure folders is always an array
-      const validFolders = Array.isArray(data) ? data.filter(Boolean) : [];
-      console.log('Valid folders after filtering:', validFolders);
-      setFolders(validFolders);
+      const validFolders = Array.isArray(data) ? data.filter(folder => folder && folder.name) : [];
+      setFolders(validFolders.map(folder => folder.name));
       
-      // Get URL counts for each folder
-      const urls = await urlService.getUserUrls();
+      // URL counts are maintained by the backend
       const counts = {};
-      
+      const ids = {};
       validFolders.forEach(folder => {
-        counts[folder] = urls.filter(url => url.folder === folder).length;
+        counts[folder.name] = folder.url_count;
+        ids[folder.name] = folder.id;
       });
       
       setFolderCounts(counts);
+      setFolderIds(ids);
       setError(null);
     } catch (err) {
       console.error('Error fetching folders:', err);
@@ -64,33 +65,15 @@ const FolderManagementModal = ({ isOpen, onClose }) => {
     }
     
     try {
-      // Use a simplified payload for folder creation
-      const folderPayload = {
-        original_url: 'https://example.com',
-        title: 'Temporary URL for folder creation',
-        folder: folderName,
-        is_active: false
-      };
-      
-      console.log('Creating folder with payload:', folderPayload);
-      
-      // Create a URL with the new folder name
-      const response = await urlService.createUrl(folderPayload);
-      console.log('Folder creation response:', response);
+      const folder = await urlService.createFolder(folderName);
+      console.log('Folder creation response:', folder);
       
       // If successful, update the local state to include the new folder
-      setFolders(prevFolders => {
-        const updatedFolders = [...prevFolders, folderName];
-        console.log('Updated folders list:', updatedFolders);
-        return updatedFolders;
-      });
-      
-      setFolderCounts(prevCounts => ({...prevCounts, [folderName]: 0}));
+      setFolders(prevFolders => [...prevFolders, folder.name]);
+      setFolderCounts(prevCounts => ({...prevCounts, [folder.name]: 0}));
+      setFolderIds(prevIds => ({...prevIds, [folder.name]: folder.id}));
       setNewFolderName('');
       setError(null);
-      
-      // Keep the temporary URL to maintain the folder in the system
-      // This ensures the folder will be properly listed
     } catch (err) {
       console.error('Error creating folder:', err);
       if (err.response?.data?.error) {
@@ -123,15 +106,8 @@ const FolderManagementModal = ({ isOpen, onClose }) => {
     }
     
     try {
-      // Get all URLs in the old folder
-      const urls = await urlService.getUserUrls({ folder: oldName });
-      
-      // Update each URL to the new folder name
-      let updatedCount = 0;
-      for (const url of urls) {
-        await urlService.updateUrl(url.id, { folder: newName });
-        updatedCount++;
-      }
+      // Renaming the folder also moves all of its URLs
+      await urlService.renameFolder(folderIds[oldName], newName);
       
       // Update local state
       setFolders(prevFolders => 
@@ -145,6 +121,11 @@ const FolderManagementModal = ({ isOpen, onClose }) => {
         delete newCounts[oldName];
         return newCounts;
       });
+      setFolderIds(prevIds => {
+        const newIds = { ...prevIds, [newName]: prevIds[oldName] };
+        delete newIds[oldName];
+        return newIds;
+      });
       
       setEditingFolder(null);
       setError(null);
@@ -156,13 +137,8 @@ const FolderManagementModal = ({ isOpen, onClose }) => {
   
   const handleDeleteFolder = async (folderName) => {
     try {
-      // Get all URLs in the folder
-      const urls = await urlService.getUserUrls({ folder: folderName });
-      
-      // Remove folder from each URL
-      for (const url of urls) {
-        await urlService.updateUrl(url.id, { folder: '' });
-      }
+      // Deleting the folder keeps its URLs and removes them from the folder
+      await urlService.deleteFolder(folderIds[folderName]);
       
       // Update local state
       setFolders(prevFolders => prevFolders.filter(folder => folder !== folderName));
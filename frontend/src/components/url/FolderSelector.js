@@ -84,18 +84,9 @@ const FolderSelector = ({ selectedFolder, onChange }) => {
     onChange(newFolder);
     
     // Register the folder in the backend (this happens asynchronously)
-    // Use a simplified payload for folder creation
-    const folderPayload = {
-      original_url: 'https://example.com',
-      title: 'Temporary URL for folder creation',
-      folder: newFolder,
-      is_active: false
-    };
-    
     console.log('Creating folder in FolderSelector:', newFolder);
-    urlService.createUrl(folderPayload).then(response => {
-      console.log('Successfully created folder:', newFolder, 'with URL ID:', response.id);
-      // Keep the temporary URL to maintain the folder in the system
+    urlService.createFolder(newFolder).then(folder => {
+      console.log('Successfully created folder:', folder.name);
     }).catch(err => {
       console.error('Error registering folder:', err);
       // Non-critical error, don't show to user
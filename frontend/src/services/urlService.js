@@ -725,6 +725,50 @@ const urlService = {
     }
   },
   
+  // Get folders with their URL counts
+  getFolderDetails: async () => {
+    try {
+      const response = await api.get('/folders/');
+      return response.data;
+    } catch (error) {
+      console.error('Error getting folder details:', error.response?.data || error.message);
+      throw error;
+    }
+  },
+  
+  // Create an empty folder
+  createFolder: async (name) => {
+    try {
+      const response = await api.post('/folders/', { name });
+      return response.data;
+    } catch (error) {
+      console.error('Error creating folder:', error.response?.data || error.message);
+      throw error;
+    }
+  },
+  
+  // Rename a folder (the backend moves its URLs along with it)
+  renameFolder: async (folderId, name) => {
+    try {
+      const response = await api.patch(`/folders/${folderId}/`, { name });
+      return response.data;
+    } catch (error) {
+      console.error('Error renaming folder:', error.response?.data || error.message);
+      throw error;
+    }
+  },
+  
+  // Delete a folder (its URLs are kept and removed from the folder)
+  deleteFolder: async (folderId) => {
+    try {
+      await api.delete(`/folders/${folderId}/`);
+      return true;
+    } catch (error) {
+      console.error('Error deleting folder:', error.response?.data || error.message);
+      throw error;
+    }
+  },
+  
   // Update URL with custom redirect page settings
   updateUrlRedirectSettings: async (urlId, redirectSettings) => {
     try {